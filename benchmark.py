@@ -0,0 +1,291 @@
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import networkx as nx
+
+import route_engine as routing
+
+# Bounding box of India used to place synthetic cities (lat, lng)
+INDIA_BOUNDS = ((8.0, 33.0), (68.0, 97.0))
+
+# Largest graphs (in nodes) each slow engine is run on: the O(V^2) reference
+# implementation, the all-pairs table, the contraction hierarchy (its build
+# takes over a minute on a 2,500-node grid once traced, and grows faster than
+# linearly) and alternative routes (several full searches per query)
+REFERENCE_LIMIT = 2000
+MATRIX_LIMIT = 2000
+CH_LIMIT = 5000
+ALTERNATIVES_LIMIT = 20000
+LIMITS = {'dijkstra': REFERENCE_LIMIT, 'matrix': MATRIX_LIMIT, 'ch': CH_LIMIT,
+          'alternatives': ALTERNATIVES_LIMIT}
+
+# Random points snapped to their nearest node in one batch by the 'snap' engine
+SNAP_POINTS = 100000
+
+
+# Function to turn a road length into hours at a random speed between 30 km/h
+# and a typical intercity top speed
+def travel_hours(rng, a, b):
+    return round(routing.haversine(a, b) / rng.uniform(30, routing.DEFAULT_MAX_SPEED), 3) + 0.001
+
+
+# Function to generate a road-like grid: side x side junctions spread over
+# India, each linked to its four neighbours in both directions. A few links
+# are dropped so the grid is not perfectly regular.
+def grid_graph(nodes, seed=0):
+    rng = random.Random(seed)
+    side = max(2, int(math.sqrt(nodes)))
+    (lat0, lat1), (lng0, lng1) = INDIA_BOUNDS
+    coordinates = {}
+    for row in range(side):
+        for col in range(side):
+            coordinates[f"g{row}_{col}"] = (lat0 + (lat1 - lat0) * row / (side - 1),
+                                            lng0 + (lng1 - lng0) * col / (side - 1))
+    graph = {name: {} for name in coordinates}
+    for row in range(side):
+        for col in range(side):
+            name = f"g{row}_{col}"
+            for other in (f"g{row + 1}_{col}", f"g{row}_{col + 1}"):
+                if other in graph and rng.random() > 0.05:
+                    graph[name][other] = travel_hours(rng, coordinates[name], coordinates[other])
+                    graph[other][name] = travel_hours(rng, coordinates[other], coordinates[name])
+    return graph, coordinates
+
+
+# Function to generate a random geometric graph: cities scattered over India,
+# each linked to its nearest neighbours (found through a bucket grid)
+def geometric_graph(nodes, seed=0, neighbors=3):
+    rng = random.Random(seed)
+    (lat0, lat1), (lng0, lng1) = INDIA_BOUNDS
+    coordinates = {f"c{i}": (rng.uniform(lat0, lat1), rng.uniform(lng0, lng1)) for i in range(nodes)}
+    cell = max((lat1 - lat0), (lng1 - lng0)) / max(1, int(math.sqrt(nodes / 2)))
+    buckets = {}
+    for name, (lat, lng) in coordinates.items():
+        buckets.setdefault((int(lat // cell), int(lng // cell)), []).append(name)
+
+    graph = {name: {} for name in coordinates}
+    for name, (lat, lng) in coordinates.items():
+        row, col = int(lat // cell), int(lng // cell)
+        candidates = [other for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+                      for other in buckets.get((row + dr, col + dc), ()) if other != name]
+        candidates.sort(key=lambda other: (coordinates[other][0] - lat) ** 2
+                        + (coordinates[other][1] - lng) ** 2)
+        for other in candidates[:neighbors]:
+            graph[name][other] = travel_hours(rng, coordinates[name], coordinates[other])
+            graph[other][name] = travel_hours(rng, coordinates[other], coordinates[name])
+    return graph, coordinates
+
+
+# Function to time a callable over a list of arguments; returns per-call times in ms
+def time_calls(function, calls):
+    times = []
+    for args in calls:
+        started = time.perf_counter()
+        function(*args)
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+# Function to measure the peak Python memory allocated while running a callable once
+def peak_memory_kb(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+# Function to run a callable once, timed, while tracing its peak Python
+# memory, for preprocessing too slow to run a second time just to measure
+# memory. Returns the time in ms (as a list, like time_calls()), the peak in
+# KiB and the callable's result. The time includes tracemalloc's overhead.
+def time_with_peak(function, *args):
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = (time.perf_counter() - started) * 1000
+        return [elapsed], tracemalloc.get_traced_memory()[1] / 1024, result
+    finally:
+        tracemalloc.stop()
+
+
+# Function to summarise a list of timings into a result record
+def summarise(graph_name, graph, engine, kind, times, peak_kb):
+    times = sorted(times)
+    return {
+        'graph': graph_name,
+        'nodes': len(graph),
+        'edges': sum(len(neighbors) for neighbors in graph.values()),
+        'engine': engine,
+        'kind': kind,
+        'runs': len(times),
+        'total_ms': round(sum(times), 3),
+        'mean_ms': round(sum(times) / len(times), 4),
+        'p50_ms': round(times[len(times) // 2], 4),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 4),
+        'peak_kb': round(peak_kb, 1),
+    }
+
+
+# Function to run every engine against one graph
+def benchmark_graph(graph_name, graph, coordinates, queries, engines, seed=0):
+    rng = random.Random(seed)
+    nodes = list(graph)
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(queries)]
+    results = []
+    for engine, limit in LIMITS.items():
+        if engine in engines and len(graph) > limit:
+            print(f"{graph_name} {len(graph)}: skipping {engine} (limit {limit} nodes)")
+    engines = [engine for engine in engines if len(graph) <= LIMITS.get(engine, len(graph))]
+
+    compact = routing.compile_graph(graph)
+    max_speed = routing.admissible_speed(compact, coordinates)
+    nx_graph = nx.DiGraph()
+    for node, neighbors in graph.items():
+        nx_graph.add_node(node)
+        for neighbor, weight in neighbors.items():
+            nx_graph.add_edge(node, neighbor, weight=weight)
+
+    def networkx_query(start, end):
+        try:
+            return nx.dijkstra_path(nx_graph, start, end)
+        except nx.NetworkXNoPath:
+            return []
+
+    single = {
+        'dijkstra': lambda start, end: routing.dijkstra(graph, start, end),
+        'dijkstra_heap': lambda start, end: routing.dijkstra_heap(graph, start, end),
+        'dijkstra_compact': lambda start, end: routing.dijkstra_heap(compact, start, end),
+        'astar': lambda start, end: routing.astar(compact, start, end, coordinates, max_speed),
+        'bidirectional': lambda start, end: routing.bidirectional_dijkstra(compact, start, end),
+        'networkx': networkx_query,
+        'alternatives': lambda start, end: routing.alternative_routes(compact, start, end),
+    }
+
+    if 'compile' in engines:
+        times, peak_kb, _ = time_with_peak(routing.compile_graph, graph)
+        results.append(summarise(graph_name, graph, 'compile', 'preprocess', times, peak_kb))
+
+    for engine, query in single.items():
+        if engine not in engines:
+            continue
+        times = time_calls(query, pairs)
+        results.append(summarise(graph_name, graph, engine, 'query', times,
+                                 peak_memory_kb(query, *pairs[0])))
+
+    if 'ch' in engines:
+        times, peak_kb, hierarchy = time_with_peak(routing.ContractionHierarchy.build, compact)
+        results.append(summarise(graph_name, graph, 'ch', 'preprocess', times, peak_kb))
+        times = time_calls(hierarchy.query, pairs)
+        results.append(summarise(graph_name, graph, 'ch', 'query', times,
+                                 peak_memory_kb(hierarchy.query, *pairs[0])))
+
+    if 'matrix' in engines:
+        times, peak_kb, _ = time_with_peak(routing.DistanceMatrix.build, compact)
+        results.append(summarise(graph_name, graph, 'matrix', 'preprocess', times, peak_kb))
+
+    if 'snap' in engines:
+        index = routing.SpatialIndex(coordinates)
+        (lat0, lat1), (lng0, lng1) = INDIA_BOUNDS
+        lats = [rng.uniform(lat0, lat1) for _ in range(SNAP_POINTS)]
+        lngs = [rng.uniform(lng0, lng1) for _ in range(SNAP_POINTS)]
+        times = time_calls(index.snap, [(lats, lngs)])
+        results.append(summarise(graph_name, graph, 'snap', 'batch', times,
+                                 peak_memory_kb(index.snap, lats, lngs)))
+
+    if 'batch' in engines:
+        def run_batch():
+            for _ in routing.batch_routes(compact, pairs, with_paths=False):
+                pass
+
+        times = time_calls(run_batch, [()])
+        results.append(summarise(graph_name, graph, 'batch', 'batch', times,
+                                 peak_memory_kb(run_batch)))
+
+    return results
+
+
+# Function to print the ratio of each mean time to the same measurement in an earlier run
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r['graph'], r['nodes'], r['engine'], r['kind']): r
+                    for r in json.load(f)['results']}
+    for result in results:
+        previous = baseline.get((result['graph'], result['nodes'], result['engine'], result['kind']))
+        if previous and previous['mean_ms'] > 0:
+            ratio = result['mean_ms'] / previous['mean_ms']
+            print(f"{result['graph']:>10} {result['nodes']:>8} {result['engine']:>16} "
+                  f"{result['kind']:>10}  {ratio:6.2f}x")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+ENGINES = ['compile', 'dijkstra', 'dijkstra_heap', 'dijkstra_compact', 'astar', 'bidirectional',
+           'networkx', 'alternatives', 'ch', 'matrix', 'batch', 'snap']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the routing engines")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help="node counts for the synthetic graphs (default: 1000 10000)")
+    parser.add_argument('--graphs', nargs='+', default=['india', 'grid', 'geometric'],
+                        choices=['india', 'grid', 'geometric'])
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--queries', type=int, default=100, help="random queries per graph")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results file to compare mean times against")
+    args = parser.parse_args()
+
+    results = []
+    if 'india' in args.graphs:
+        network = routing.load_network()
+        results += benchmark_graph('india', network.graph, network.coordinates,
+                                   args.queries, args.engines, args.seed)
+    for size in args.sizes:
+        for name, generate in (('grid', grid_graph), ('geometric', geometric_graph)):
+            if name in args.graphs:
+                graph, coordinates = generate(size, args.seed)
+                results += benchmark_graph(name, graph, coordinates, args.queries,
+                                           args.engines, args.seed)
+    for result in results:
+        print(f"{result['graph']:>10} {result['nodes']:>8} {result['engine']:>16} "
+              f"{result['kind']:>10}  mean {result['mean_ms']:10.3f} ms  "
+              f"peak {result['peak_kb']:10.1f} KiB")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'queries': args.queries,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
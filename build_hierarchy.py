@@ -0,0 +1,46 @@
+# Build the contraction hierarchy of a road network offline and save it where
+# the app and the routing service look for it (cache/ch-<fingerprint>.bin).
+# Building takes minutes on large imported networks, so the app and the
+# service only ever load the file, and only when a hierarchy is needed.
+#
+#   python build_hierarchy.py --data data/bavaria --cache cache
+#
+# The file belongs to the network's exact contents: rebuild it after the
+# roads or their travel times change.
+import argparse
+import time
+
+import route_engine as routing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the contraction hierarchy of a road network")
+    parser.add_argument('--data', default=routing.DATA_DIR, help="road network directory")
+    parser.add_argument('--cache', default=routing.CACHE_DIR, help="directory to save the hierarchy in")
+    parser.add_argument('--force', action='store_true', help="rebuild even if a hierarchy exists")
+    parser.add_argument('--verify', type=int, default=0, metavar='N',
+                        help="check N random queries against the reference dijkstra() (slow on "
+                             "large networks)")
+    args = parser.parse_args()
+
+    network = routing.load_network(args.data)
+    path = routing.hierarchy_path(network.fingerprint, args.cache)
+    if not args.force and routing.load_hierarchy(path, network.fingerprint) is not None:
+        print(f"{path} is up to date")
+        return
+
+    started = time.perf_counter()
+    hierarchy = routing.ContractionHierarchy.build(network.compact)
+    print(f"Built the hierarchy of {len(network.compact)} cities in "
+          f"{time.perf_counter() - started:.1f} s")
+    if args.verify:
+        mismatches = routing.verify_hierarchy(hierarchy, network.graph, samples=args.verify)
+        if mismatches:
+            raise SystemExit(f"{len(mismatches)} of {args.verify} queries disagree with dijkstra(), "
+                             f"e.g. {mismatches[0]}")
+    hierarchy.save(path)
+    print(f"Hierarchy written to {path}")
+
+
+if __name__ == "__main__":
+    main()
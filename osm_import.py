@@ -0,0 +1,432 @@
+# Import a road network from an OpenStreetMap extract (.osm, .osm.bz2, .osm.gz
+# or .osm.pbf) into the project's data format: cities.csv (city, lat, lng) and
+# roads.csv (source, target, hours), as read by route_engine.load_network().
+#
+#   python osm_import.py bavaria-latest.osm.pbf --output data/bavaria
+#   python route_server.py --data data/bavaria
+#
+# The file is streamed twice, so memory grows with the roads kept rather than
+# with the file:
+#   1. ways: keep highways of the chosen classes, with their node ids, speed
+#      and direction
+#   2. nodes: look up the coordinates of just the nodes those ways use
+# Ways are then split into roads at junctions, travel times come from length
+# and speed, and chains of degree-2 junctions are merged into single roads.
+import argparse
+import bz2
+import csv
+import gzip
+import os
+import time
+import xml.etree.ElementTree as ET
+import zlib
+from array import array
+
+import numpy as np
+
+from route_engine import EARTH_RADIUS_KM
+
+# Speeds (km/h) by highway class, used when a way has no usable maxspeed tag
+HIGHWAY_SPEEDS = {
+    'motorway': 110, 'motorway_link': 60,
+    'trunk': 90, 'trunk_link': 50,
+    'primary': 70, 'primary_link': 40,
+    'secondary': 60, 'secondary_link': 40,
+    'tertiary': 50, 'tertiary_link': 30,
+    'unclassified': 40, 'residential': 30, 'living_street': 10, 'service': 20,
+}
+
+# Highway classes imported by default: the intercity network
+DEFAULT_HIGHWAYS = ['motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link',
+                    'secondary', 'secondary_link', 'tertiary', 'tertiary_link']
+
+# Nodes handed over from the node pass in one chunk
+NODE_CHUNK = 100000
+
+
+# Function to read a maxspeed tag ("50", "50 mph", "none", "signals") as km/h;
+# None when it isn't a plain number
+def parse_speed(value):
+    if not value:
+        return None
+    number, _, unit = value.strip().partition(' ')
+    try:
+        speed = float(number)
+    except ValueError:
+        return None
+    if speed <= 0:
+        return None
+    return speed * 1.609344 if unit.strip() == 'mph' else speed
+
+
+# Function to find which way a road can be driven: 1 along the way's nodes
+# only, -1 against them only, 0 both ways
+def way_direction(tags):
+    oneway = tags.get('oneway')
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway == '-1':
+        return -1
+    if oneway in ('no', 'false', '0'):
+        return 0
+    # Motorways and roundabouts are one-way unless tagged otherwise
+    if tags.get('highway') == 'motorway' or tags.get('junction') in ('roundabout', 'circular'):
+        return 1
+    return 0
+
+
+# --- OSM XML ---
+
+def open_xml(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+# Function to stream the top-level elements of an OSM XML file with one tag,
+# clearing each one (and the root's hold on it) once it has been handled
+def xml_elements(path, tag):
+    with open_xml(path) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in ('node', 'way', 'relation'):
+                if elem.tag == tag:
+                    yield elem
+                elem.clear()
+                root.clear()
+
+
+def xml_ways(path):
+    for elem in xml_elements(path, 'way'):
+        refs = array('q', (int(nd.get('ref')) for nd in elem.iter('nd')))
+        yield refs, {t.get('k'): t.get('v') for t in elem.iter('tag')}
+
+
+def xml_nodes(path):
+    ids, lats, lngs = [], [], []
+    for elem in xml_elements(path, 'node'):
+        ids.append(int(elem.get('id')))
+        lats.append(float(elem.get('lat')))
+        lngs.append(float(elem.get('lon')))
+        if len(ids) == NODE_CHUNK:
+            yield np.array(ids, np.int64), np.array(lats), np.array(lngs)
+            ids, lats, lngs = [], [], []
+    if ids:
+        yield np.array(ids, np.int64), np.array(lats), np.array(lngs)
+
+
+# --- OSM PBF ---
+# A PBF file is a sequence of blobs (length-prefixed protobuf messages, usually
+# zlib-compressed), each holding a block of a few thousand nodes or ways.
+# Only the parts of the format needed here are decoded. Packed number arrays,
+# which make up most of the file, are decoded with NumPy.
+
+def _varint(data, i):
+    result = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, i
+        shift += 7
+
+
+def _signed(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+# Function to iterate over the (field number, value) pairs of a protobuf
+# message: ints for varints, memoryviews for length-delimited fields
+def _fields(data):
+    view = memoryview(data)
+    i = 0
+    while i < len(view):
+        key, i = _varint(view, i)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, i = _varint(view, i)
+        elif wire_type == 2:
+            length, i = _varint(view, i)
+            value = view[i:i + length]
+            i += length
+        elif wire_type == 1:
+            value, i = view[i:i + 8], i + 8
+        elif wire_type == 5:
+            value, i = view[i:i + 4], i + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield number, value
+
+
+# Function to decode a packed array of varints, optionally zigzag-signed and
+# delta-coded (each value stored as the difference from the previous one)
+def _packed(data, signed=False, delta=False):
+    b = np.frombuffer(data, np.uint8)
+    if not b.size:
+        return np.zeros(0, np.int64)
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.r_[0, ends[:-1] + 1]
+    shifts = ((np.arange(len(b)) - np.repeat(starts, ends - starts + 1)) * 7).astype(np.uint64)
+    values = np.add.reduceat((b & 0x7f).astype(np.uint64) << shifts, starts)
+    if signed:
+        values = (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+    else:
+        values = values.astype(np.int64)
+    return np.cumsum(values) if delta else values
+
+
+# Function to stream the data blocks of a PBF file, decompressed
+def pbf_blocks(path):
+    with open(path, 'rb') as f:
+        while True:
+            size = f.read(4)
+            if len(size) < 4:
+                return
+            header = dict(_fields(f.read(int.from_bytes(size, 'big'))))
+            blob = dict(_fields(f.read(header[3])))
+            if bytes(header[1]) != b'OSMData':
+                continue
+            if 1 in blob:
+                yield bytes(blob[1])
+            elif 3 in blob:
+                yield zlib.decompress(blob[3])
+            else:
+                raise ValueError(f"{path} uses a PBF compression other than zlib")
+
+
+# Function to split a data block into its string table (raw), primitive
+# groups and coordinate encoding (granularity and offsets in nanodegrees)
+def pbf_block(data):
+    strings, groups = None, []
+    granularity, lat_offset, lng_offset = 100, 0, 0
+    for number, value in _fields(data):
+        if number == 1:
+            strings = value
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            granularity = value
+        elif number == 19:
+            lat_offset = value - (1 << 64) if value >= 1 << 63 else value
+        elif number == 20:
+            lng_offset = value - (1 << 64) if value >= 1 << 63 else value
+    return strings, groups, granularity, lat_offset, lng_offset
+
+
+def pbf_ways(path):
+    for data in pbf_blocks(path):
+        strings, groups, _, _, _ = pbf_block(data)
+        table = None
+        for group in groups:
+            for number, way in _fields(group):
+                if number != 3:
+                    continue
+                if table is None:
+                    table = [bytes(s).decode('utf-8') for _, s in _fields(strings)]
+                fields = {}
+                for field, value in _fields(way):
+                    fields[field] = value
+                keys = _packed(fields.get(2, b''))
+                values = _packed(fields.get(3, b''))
+                refs = array('q')
+                refs.frombytes(_packed(fields.get(8, b''), signed=True, delta=True).tobytes())
+                yield refs, {table[k]: table[v] for k, v in zip(keys, values)}
+
+
+def pbf_nodes(path):
+    for data in pbf_blocks(path):
+        _, groups, granularity, lat_offset, lng_offset = pbf_block(data)
+        for group in groups:
+            ids, lats, lngs = [], [], []
+            for number, value in _fields(group):
+                if number == 2:
+                    dense = dict(_fields(value))
+                    ids.append(_packed(dense.get(1, b''), signed=True, delta=True))
+                    lats.append(_packed(dense.get(8, b''), signed=True, delta=True))
+                    lngs.append(_packed(dense.get(9, b''), signed=True, delta=True))
+                elif number == 1:
+                    node = dict(_fields(value))
+                    ids.append(np.array([_signed(node[1])], np.int64))
+                    lats.append(np.array([_signed(node[8])], np.int64))
+                    lngs.append(np.array([_signed(node[9])], np.int64))
+            if ids:
+                yield (np.concatenate(ids),
+                       (lat_offset + granularity * np.concatenate(lats)) * 1e-9,
+                       (lng_offset + granularity * np.concatenate(lngs)) * 1e-9)
+
+
+def read_ways(path):
+    return pbf_ways(path) if path.endswith('.pbf') else xml_ways(path)
+
+
+def read_nodes(path):
+    return pbf_nodes(path) if path.endswith('.pbf') else xml_nodes(path)
+
+
+# --- Building the network ---
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+
+# Function to merge chains of degree-2 junctions: a junction whose only
+# neighbours are u and w, passed straight through (u → v → w and/or
+# w → v → u), is replaced by direct roads u → w / w → u with the summed time.
+# Works in place on a dict of dicts of hours; returns the number merged.
+def compress_chains(graph):
+    incoming = {node: {} for node in graph}
+    for node, neighbors in graph.items():
+        for neighbor, hours in neighbors.items():
+            incoming[neighbor][node] = hours
+
+    merged = 0
+    pending = list(graph)
+    while pending:
+        v = pending.pop()
+        if v not in graph:
+            continue
+        neighbors = set(graph[v]) | set(incoming[v])
+        if len(neighbors) != 2:
+            continue
+        u, w = neighbors
+        forward = u in incoming[v], w in graph[v]
+        backward = w in incoming[v], u in graph[v]
+        if forward[0] != forward[1] or backward[0] != backward[1] or not (forward[0] or backward[0]):
+            continue
+        for a, b, used in ((u, w, forward[0]), (w, u, backward[0])):
+            if used:
+                hours = incoming[v][a] + graph[v][b]
+                if hours < graph[a].get(b, float('infinity')):
+                    graph[a][b] = hours
+                    incoming[b][a] = hours
+        for a in incoming[v]:
+            del graph[a][v]
+        for b in graph[v]:
+            del incoming[b][v]
+        del graph[v], incoming[v]
+        merged += 1
+        pending.extend((u, w))
+    return merged
+
+
+# Function to import an OSM extract into a road network; returns the graph
+# ({node: {node: hours}}) and coordinates ({node: (lat, lng)}), with OSM node
+# ids as names
+def import_osm(path, highways=DEFAULT_HIGHWAYS, compress=True, log=print):
+    highways = set(highways)
+    started = time.perf_counter()
+
+    # Pass 1: the ways to keep, as one flat array of node ids plus per-way data
+    refs, offsets = array('q'), array('q', [0])
+    speeds, directions = array('d'), array('b')
+    for way_refs, tags in read_ways(path):
+        highway = tags.get('highway')
+        if highway not in highways or len(way_refs) < 2:
+            continue
+        refs.extend(way_refs)
+        offsets.append(len(refs))
+        speeds.append(parse_speed(tags.get('maxspeed')) or HIGHWAY_SPEEDS.get(highway, 50))
+        directions.append(way_direction(tags))
+    log(f"{len(speeds)} ways, {len(refs)} node references ({time.perf_counter() - started:.1f} s)")
+    if not speeds:
+        raise ValueError(f"No roads of the classes {', '.join(sorted(highways))} in {path}")
+
+    refs = np.frombuffer(refs, np.int64)
+    offsets = np.frombuffer(offsets, np.int64)
+    node_ids, ref_nodes, uses = np.unique(refs, return_inverse=True, return_counts=True)
+
+    # Pass 2: coordinates of the nodes used
+    lat = np.full(len(node_ids), np.nan)
+    lng = np.full(len(node_ids), np.nan)
+    for ids, lats, lngs in read_nodes(path):
+        positions = np.minimum(np.searchsorted(node_ids, ids), len(node_ids) - 1)
+        found = node_ids[positions] == ids
+        lat[positions[found]] = lats[found]
+        lng[positions[found]] = lngs[found]
+    log(f"{int(np.isfinite(lat).sum())} of {len(node_ids)} nodes located "
+        f"({time.perf_counter() - started:.1f} s)")
+
+    # Roads run between junctions: nodes shared by several ways (or used twice by
+    # one) and the ends of every way. Consecutive junctions of one way make a road.
+    way_of = np.repeat(np.arange(len(speeds)), np.diff(offsets))
+    junction = (uses > 1)[ref_nodes]
+    junction[offsets[:-1]] = True
+    junction[offsets[1:] - 1] = True
+    segment_km = haversine_km(lat[ref_nodes[:-1]], lng[ref_nodes[:-1]],
+                              lat[ref_nodes[1:]], lng[ref_nodes[1:]])
+    # Segments with a node missing from the extract (cut at its border) are
+    # counted, so the roads through them can be dropped
+    missing = np.r_[0, np.cumsum(np.isnan(segment_km))]
+    distance = np.r_[0, np.cumsum(np.nan_to_num(segment_km))]
+    stops = np.flatnonzero(junction)
+    first, last = stops[:-1], stops[1:]
+    same_way = way_of[first] == way_of[last]
+    first, last = first[same_way], last[same_way]
+    hours = (distance[last] - distance[first]) / np.frombuffer(speeds, np.float64)[way_of[first]]
+    direction = np.frombuffer(directions, np.int8)[way_of[first]]
+    u, v = node_ids[ref_nodes[first]], node_ids[ref_nodes[last]]
+    usable = (missing[last] == missing[first]) & (u != v)
+
+    graph = {}
+    for a, b, h, d in zip(u[usable].tolist(), v[usable].tolist(), hours[usable].tolist(),
+                          direction[usable].tolist()):
+        graph.setdefault(a, {})
+        graph.setdefault(b, {})
+        if d == -1:
+            a, b = b, a
+        for source, target in ((a, b),) if d else ((a, b), (b, a)):
+            if h < graph[source].get(target, float('infinity')):
+                graph[source][target] = h
+    log(f"{len(graph)} junctions, {sum(map(len, graph.values()))} roads")
+
+    if compress:
+        merged = compress_chains(graph)
+        log(f"{merged} degree-2 junctions merged: {len(graph)} junctions, "
+            f"{sum(map(len, graph.values()))} roads ({time.perf_counter() - started:.1f} s)")
+
+    # node_ids is sorted, so the junctions kept are found by binary search
+    positions = np.searchsorted(node_ids, np.fromiter(graph, np.int64, len(graph)))
+    coordinates = dict(zip(graph, zip(lat[positions].tolist(), lng[positions].tolist())))
+    return graph, coordinates
+
+
+# Function to write a road network as cities.csv and roads.csv in a directory
+def write_network(directory, graph, coordinates):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'cities.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['city', 'lat', 'lng'])
+        for node in graph:
+            lat, lng = coordinates[node]
+            writer.writerow([node, round(lat, 7), round(lng, 7)])
+    with open(os.path.join(directory, 'roads.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['source', 'target', 'hours'])
+        for node, neighbors in graph.items():
+            for neighbor, hours in neighbors.items():
+                writer.writerow([node, neighbor, round(hours, 6)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a road network from an OpenStreetMap extract")
+    parser.add_argument('extract', help=".osm, .osm.bz2, .osm.gz or .osm.pbf file")
+    parser.add_argument('--output', required=True, help="directory to write cities.csv and roads.csv to")
+    parser.add_argument('--highways', nargs='+', default=DEFAULT_HIGHWAYS,
+                        help="highway classes to import (default: motorway to tertiary, with links)")
+    parser.add_argument('--no-compress', action='store_true',
+                        help="keep degree-2 junctions instead of merging their roads")
+    args = parser.parse_args()
+
+    graph, coordinates = import_osm(args.extract, args.highways, not args.no_compress)
+    write_network(args.output, graph, coordinates)
+    print(f"Road network written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1938 @@
+# Routing engine for the Route Optimizer: graph loading, compact graph storage,
+# search algorithms and precomputed tables. It has no UI dependencies, so it can
+# be used from the Streamlit app, the HTTP service (route_server.py), benchmarks
+# and scripts alike.
+import bisect
+import collections
+import contextlib
+import csv
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import urllib.parse
+from array import array
+
+import numpy as np
+
+# Function to implement Dijkstra's algorithm
+def dijkstra(graph, start, end):
+    distances = {node: float('infinity') for node in graph}
+    previous_nodes = {node: None for node in graph}
+    distances[start] = 0
+    nodes = list(graph)
+
+    while nodes:
+        current_node = min(nodes, key=lambda node: distances[node])
+        nodes.remove(current_node)
+
+        if distances[current_node] == float('infinity'):
+            break
+
+        for neighbor, weight in graph[current_node].items():
+            alternative_route = distances[current_node] + weight
+            if alternative_route < distances[neighbor]:
+                distances[neighbor] = alternative_route
+                previous_nodes[neighbor] = current_node
+
+    path, current_node = [], end
+    total_distance = distances[end]
+    while previous_nodes[current_node] is not None:
+        path.insert(0, current_node)
+        current_node = previous_nodes[current_node]
+    if path:
+        path.insert(0, current_node)
+    return path, total_distance
+
+# Search statistics are opt-in: every search routine takes a stats dict and only
+# fills it (nodes settled, edges relaxed, heap pushes, wall time) when one is
+# passed. Nothing is counted inside the search loops: heap pushes go through
+# heap_push(), which only counts when there are stats, and the other numbers
+# are worked out once the search is over, so uninstrumented searches pay
+# nothing. Callbacks registered here receive the stats of every instrumented
+# Route Optimizer query, found or not, e.g. to forward them to a metrics pipeline.
+STATS_HOOKS = []
+
+# Function to register a callback that is called with each query's stats dict
+def add_stats_hook(callback):
+    STATS_HOOKS.append(callback)
+
+# Function to pass a query's stats to every registered callback
+def emit_stats(stats):
+    for callback in STATS_HOOKS:
+        callback(stats)
+
+# Function to get the heap push a search should use: heapq.heappush itself
+# without stats, or one that also counts into stats['pushes'], starting from
+# the entries already queued
+def heap_push(stats, queued=1):
+    if stats is None:
+        return heapq.heappush
+    stats['pushes'] = queued
+
+    def push(heap, item):
+        stats['pushes'] += 1
+        heapq.heappush(heap, item)
+    return push
+
+# Function to fill a stats dict at the end of a search, given the number of
+# nodes settled and the out-degree of every node expanded (lazily, so it is
+# only summed after the search has been timed)
+def record_search_stats(stats, started, settled, degrees=()):
+    stats['search_ms'] = (time.perf_counter() - started) * 1000
+    stats['settled'] = settled
+    stats['relaxed'] = sum(degrees)
+    stats.setdefault('pushes', 0)
+
+# Function to list the out-degrees of the nodes a search over a CSR graph
+# expanded: those marked in settled, except stop, where it ended before
+# relaxing its roads
+def expanded_degrees(offsets, settled, stop=-1):
+    return (offsets[node + 1] - offsets[node] for node, done in enumerate(settled)
+            if done and node != stop)
+
+# Function to time a block into stats[key] in milliseconds; does nothing when
+# stats is None
+@contextlib.contextmanager
+def timed(stats, key):
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[key] = (time.perf_counter() - started) * 1000
+
+# Function to implement Dijkstra's algorithm with a binary heap
+# (lazy deletion of stale entries, stops once the destination is settled)
+def dijkstra_heap(graph, start, end, stats=None):
+    if is_compact(graph):
+        return dijkstra_compact(graph, start, end, stats)
+
+    started = time.perf_counter() if stats is not None else 0
+    push = heap_push(stats)
+    distances = {start: 0}
+    previous_nodes = {start: None}
+    settled = set()
+    heap = [(0, start)]
+
+    while heap:
+        distance, current_node = heapq.heappop(heap)
+        if current_node in settled:
+            continue
+        settled.add(current_node)
+        if current_node == end:
+            break
+
+        for neighbor, weight in graph[current_node].items():
+            alternative_route = distance + weight
+            if alternative_route < distances.get(neighbor, float('infinity')):
+                distances[neighbor] = alternative_route
+                previous_nodes[neighbor] = current_node
+                push(heap, (alternative_route, neighbor))
+
+    if stats is not None:
+        record_search_stats(stats, started, len(settled),
+                            (len(graph[node]) for node in settled if node != end))
+    total_distance = distances.get(end, float('infinity'))
+    return build_path(previous_nodes, start, end), total_distance
+
+# Function to rebuild a path from a predecessor map
+def build_path(previous_nodes, start, end):
+    if end == start or previous_nodes.get(end) is None:
+        return []
+    path = [end]
+    while previous_nodes[path[-1]] is not None:
+        path.append(previous_nodes[path[-1]])
+    path.reverse()
+    return path
+
+# Compact (CSR) graph: city names are mapped to integer ids and the adjacency
+# is stored in flat offset/target/weight arrays. The neighbours of node i are
+# targets[offsets[i]:offsets[i + 1]] with the matching weights.
+class CompactGraph:
+    def __init__(self, names, offsets, targets, weights):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+
+    @classmethod
+    def from_dict(cls, graph):
+        names, seen = list(graph), set(graph)
+        for neighbors in graph.values():
+            for neighbor in neighbors:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    names.append(neighbor)
+        index = {name: i for i, name in enumerate(names)}
+        offsets, targets, weights = array('l', [0]), array('l'), array('d')
+        for name in names:
+            for neighbor, weight in graph.get(name, {}).items():
+                targets.append(index[neighbor])
+                weights.append(weight)
+            offsets.append(len(targets))
+        return cls(names, offsets, targets, weights)
+
+    @classmethod
+    def from_networkx(cls, nx_graph, weight='weight'):
+        graph = {node: {} for node in nx_graph.nodes}
+        for u, v, data in nx_graph.edges(data=True):
+            graph[u][v] = data.get(weight, 1)
+            if not nx_graph.is_directed():
+                graph[v][u] = data.get(weight, 1)
+        return cls.from_dict(graph)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        i = self.index[name]
+        return {self.names[self.targets[k]]: self.weights[k]
+                for k in range(self.offsets[i], self.offsets[i + 1])}
+
+    def edge_count(self):
+        return len(self.targets)
+
+    # Reverse adjacency (every edge u -> v stored as v -> u), built once on demand.
+    # Needed for searches that walk backwards from the destination, since the
+    # road network is not symmetric (e.g. Lucknow -> Patna differs from Patna -> Lucknow).
+    def reverse(self):
+        if getattr(self, '_reverse', None) is None:
+            counts = [0] * (len(self.names) + 1)
+            for target in self.targets:
+                counts[target + 1] += 1
+            for i in range(len(self.names)):
+                counts[i + 1] += counts[i]
+            offsets = array('l', counts)
+            targets = array('l', [0]) * len(self.targets)
+            weights = array('d', [0.0]) * len(self.targets)
+            fill = counts[:-1]
+            for node in range(len(self.names)):
+                for k in range(self.offsets[node], self.offsets[node + 1]):
+                    slot = fill[self.targets[k]]
+                    targets[slot] = node
+                    weights[slot] = self.weights[k]
+                    fill[self.targets[k]] += 1
+            self._reverse = CompactGraph(self.names, offsets, targets, weights)
+            self._reverse._reverse = self
+        return self._reverse
+
+    # Position of edge u -> v (node ids) in the CSR arrays, or -1 if there is none
+    def edge_slot(self, u, v):
+        for k in range(self.offsets[u], self.offsets[u + 1]):
+            if self.targets[k] == v:
+                return k
+        return -1
+
+    # Change the weights of existing roads in place, given (source, target,
+    # weight) name triples. The reverse graph is kept in step if it was built.
+    # Returns the changes as (u, v, old, new) id tuples for repair_tree().
+    # Nothing is changed if any update is invalid. The compact graph of a
+    # RoadNetwork must be changed through RoadNetwork.update_weights(), which
+    # keeps the rest of the network (and its fingerprint) in step.
+    def update_weights(self, updates):
+        slots = []
+        for source, target, weight in updates:
+            u, v = self.index[source], self.index[target]
+            k = self.edge_slot(u, v)
+            if k == -1:
+                raise KeyError(f"No road {source} → {target}")
+            if weight < 0:
+                raise ValueError(f"Road {source} → {target} can't have a negative time")
+            slots.append((u, v, k, weight))
+
+        # Several updates to one road collapse into one change (first old, last new)
+        changes = {}
+        reverse = getattr(self, '_reverse', None)
+        for u, v, k, weight in slots:
+            old = changes[(u, v)][0] if (u, v) in changes else self.weights[k]
+            self.weights[k] = weight
+            if reverse is not None:
+                reverse.weights[reverse.edge_slot(v, u)] = weight
+            changes[(u, v)] = (old, weight)
+        return [(u, v, old, new) for (u, v), (old, new) in changes.items() if old != new]
+
+# Function to check for a CompactGraph. Checks for the CSR arrays rather than
+# using isinstance(), so graphs cached by the Streamlit app survive the module
+# being reloaded (which redefines the class) during development.
+def is_compact(graph):
+    return hasattr(graph, 'offsets') and hasattr(graph, 'targets')
+
+# Function to compile a dict of dicts or a NetworkX graph into a CompactGraph
+def compile_graph(graph):
+    if is_compact(graph):
+        return graph
+    if hasattr(graph, 'is_directed') and hasattr(graph, 'edges'):
+        return CompactGraph.from_networkx(graph)
+    return CompactGraph.from_dict(graph)
+
+# Function to run the heap-based Dijkstra directly on a CompactGraph
+def dijkstra_compact(cgraph, start, end, stats=None):
+    started = time.perf_counter() if stats is not None else 0
+    source, target = cgraph.index[start], cgraph.index[end]
+    offsets, targets, weights = cgraph.offsets, cgraph.targets, cgraph.weights
+    distances = [float('infinity')] * len(cgraph)
+    previous = [-1] * len(cgraph)
+    settled = bytearray(len(cgraph))
+    distances[source] = 0
+    heap = [(0, source)]
+    push = heap_push(stats)
+
+    while heap:
+        distance, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = 1
+        if node == target:
+            break
+        for k in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[k]
+            alternative_route = distance + weights[k]
+            if alternative_route < distances[neighbor]:
+                distances[neighbor] = alternative_route
+                previous[neighbor] = node
+                push(heap, (alternative_route, neighbor))
+
+    if stats is not None:
+        record_search_stats(stats, started, sum(settled), expanded_degrees(offsets, settled, target))
+    return build_compact_path(cgraph, previous, source, target), distances[target]
+
+# Function to implement bidirectional Dijkstra: one search forward from the start
+# over the graph and one backward from the destination over the reverse graph,
+# stopping once the two frontiers can no longer produce a shorter route. The
+# route always takes as long as dijkstra_heap()'s, but when several routes tie
+# for the fastest it may be a different one of them, depending on where the
+# two searches meet.
+def bidirectional_dijkstra(graph, start, end, stats=None):
+    started = time.perf_counter() if stats is not None else 0
+    cgraph = compile_graph(graph)
+    source, target = cgraph.index[start], cgraph.index[end]
+    if source == target:
+        if stats is not None:
+            record_search_stats(stats, started, 0)
+        return [], 0
+    rgraph = cgraph.reverse()
+    n = len(cgraph)
+    sides = [
+        (cgraph, [float('infinity')] * n, [-1] * n, bytearray(n), [(0, source)]),
+        (rgraph, [float('infinity')] * n, [-1] * n, bytearray(n), [(0, target)]),
+    ]
+    sides[0][1][source] = 0
+    sides[1][1][target] = 0
+    best, meeting_node = float('infinity'), -1
+    push = heap_push(stats, 2)
+
+    while sides[0][4] and sides[1][4]:
+        if sides[0][4][0][0] + sides[1][4][0][0] >= best:
+            break
+        # Expand the side with the smaller frontier
+        side = 0 if len(sides[0][4]) <= len(sides[1][4]) else 1
+        search_graph, distances, previous, settled, heap = sides[side]
+        other_distances = sides[1 - side][1]
+
+        distance, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = 1
+        for k in range(search_graph.offsets[node], search_graph.offsets[node + 1]):
+            neighbor = search_graph.targets[k]
+            alternative_route = distance + search_graph.weights[k]
+            if alternative_route < distances[neighbor]:
+                distances[neighbor] = alternative_route
+                previous[neighbor] = node
+                push(heap, (alternative_route, neighbor))
+            if alternative_route + other_distances[neighbor] < best:
+                best = alternative_route + other_distances[neighbor]
+                meeting_node = neighbor
+
+    if stats is not None:
+        record_search_stats(stats, started, sum(sides[0][3]) + sum(sides[1][3]),
+                            itertools.chain(expanded_degrees(cgraph.offsets, sides[0][3]),
+                                            expanded_degrees(rgraph.offsets, sides[1][3])))
+    if meeting_node == -1:
+        return [], float('infinity')
+
+    forward_previous, backward_previous = sides[0][2], sides[1][2]
+    path = build_compact_path(cgraph, forward_previous, source, meeting_node) or [start]
+    node = meeting_node
+    while backward_previous[node] != -1:
+        node = backward_previous[node]
+        path.append(cgraph.names[node])
+    return path, best
+
+# Graph used by batch routing worker processes, set once per worker
+_batch_graph = None
+
+def _init_batch_worker(cgraph):
+    global _batch_graph
+    _batch_graph = cgraph
+
+# Function to answer every pair that shares a start node with one one-to-many
+# search, which stops once all of the group's destinations are settled
+def _route_from_source(task):
+    start, ends, with_paths = task
+    cgraph = _batch_graph
+    distances, previous = dijkstra_all(cgraph, start, targets=[cgraph.index[end] for end in ends])
+    source = cgraph.index[start]
+    results = []
+    for end in ends:
+        target = cgraph.index[end]
+        path = build_compact_path(cgraph, previous, source, target) if with_paths else None
+        results.append((start, end, path, distances[target]))
+    return results
+
+# Function to route a large iterable of (start, end) pairs. Pairs are read in
+# chunks and grouped by start node so each one-to-many search is reused, and the
+# groups are spread over a process pool. The compiled graph is sent to each
+# worker once when the pool starts. Results are yielded as (start, end, path,
+# total_distance) tuples, grouped by start node within each chunk, so memory
+# stays bounded by the chunk size rather than the number of pairs.
+def batch_routes(graph, pairs, processes=None, chunk_size=100000, with_paths=True):
+    cgraph = compile_graph(graph)
+    pairs = iter(pairs)
+
+    def tasks():
+        while True:
+            chunk = list(itertools.islice(pairs, chunk_size))
+            if not chunk:
+                return
+            groups = {}
+            for start, end in chunk:
+                groups.setdefault(start, []).append(end)
+            for start, ends in groups.items():
+                yield start, ends, with_paths
+
+    if processes == 1:
+        _init_batch_worker(cgraph)
+        for task in tasks():
+            yield from _route_from_source(task)
+        return
+
+    # Only a few tasks per worker are kept in flight, so the input is never
+    # read much further ahead than the results being consumed
+    processes = processes or os.cpu_count() or 1
+    with multiprocessing.Pool(processes, initializer=_init_batch_worker,
+                              initargs=(cgraph,)) as pool:
+        pending = collections.deque()
+        for task in tasks():
+            pending.append(pool.apply_async(_route_from_source, (task,)))
+            if len(pending) >= processes * 4:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+# Mean Earth radius used for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+
+# Top speed (km/h) of a typical intercity road, e.g. for synthetic benchmark
+# roads. A* doesn't rely on it: its heuristic needs the top speed of the
+# network searched, which admissible_speed() works out.
+DEFAULT_MAX_SPEED = 80
+
+# Function to compute the great-circle distance in km between two (lat, lng) points
+def haversine(a, b):
+    lat1, lng1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lng2 = math.radians(b[0]), math.radians(b[1])
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+# Function to find the smallest top speed that keeps the heuristic admissible
+# for a graph, i.e. the fastest straight-line speed over any single edge.
+# A road that takes no time between two places makes it infinite, which
+# turns the heuristic off.
+def admissible_speed(graph, coordinates):
+    cgraph = compile_graph(graph)
+    speed = 0
+    for node in range(len(cgraph)):
+        name = cgraph.names[node]
+        if name not in coordinates:
+            continue
+        for k in range(cgraph.offsets[node], cgraph.offsets[node + 1]):
+            neighbor = cgraph.names[cgraph.targets[k]]
+            if neighbor in coordinates:
+                speed = max(speed, edge_speed(coordinates[name], coordinates[neighbor],
+                                              cgraph.weights[k]))
+    return speed
+
+# Function to compute the straight-line speed (km/h) of one road
+def edge_speed(a, b, hours):
+    km = haversine(a, b)
+    if hours > 0:
+        return km / hours
+    return float('infinity') if km > 0 else 0
+
+# Function to check that every node of a compact graph has coordinates. The
+# great-circle heuristic is only consistent when it is: a node without any
+# would get an estimate of 0 and could be settled too early.
+def has_all_coordinates(cgraph, coordinates):
+    return all(name in coordinates for name in cgraph.names)
+
+# Function to implement A* search with a great-circle heuristic
+# (distance to the destination divided by the top speed, in hours). The top
+# speed must be at least admissible_speed() of the graph; it is computed
+# when not given, so callers searching one network repeatedly should pass
+# it (RoadNetwork.max_speed). Graphs with cities lacking coordinates are
+# searched with plain Dijkstra instead. Among routes that tie for the fastest
+# it may return a different one than dijkstra_heap().
+def astar(graph, start, end, coordinates, max_speed=None, stats=None):
+    cgraph = compile_graph(graph)
+    if not has_all_coordinates(cgraph, coordinates):
+        return dijkstra_compact(cgraph, start, end, stats)
+    if max_speed is None:
+        max_speed = admissible_speed(cgraph, coordinates)
+    started = time.perf_counter() if stats is not None else 0
+    source, target = cgraph.index[start], cgraph.index[end]
+    offsets, targets, weights = cgraph.offsets, cgraph.targets, cgraph.weights
+    goal = coordinates[end]
+    scale = 1 / max_speed if max_speed > 0 else 0
+    heuristic = [None] * len(cgraph)
+
+    def estimate(node):
+        if heuristic[node] is None:
+            heuristic[node] = haversine(coordinates[cgraph.names[node]], goal) * scale
+        return heuristic[node]
+
+    distances = [float('infinity')] * len(cgraph)
+    previous = [-1] * len(cgraph)
+    settled = bytearray(len(cgraph))
+    distances[source] = 0
+    heap = [(estimate(source), source)]
+    push = heap_push(stats)
+
+    while heap:
+        _, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = 1
+        if node == target:
+            break
+        distance = distances[node]
+        for k in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[k]
+            alternative_route = distance + weights[k]
+            if alternative_route < distances[neighbor]:
+                distances[neighbor] = alternative_route
+                previous[neighbor] = node
+                push(heap, (alternative_route + estimate(neighbor), neighbor))
+
+    if stats is not None:
+        record_search_stats(stats, started, sum(settled), expanded_degrees(offsets, settled, target))
+    return build_compact_path(cgraph, previous, source, target), distances[target]
+
+# Function to rebuild a path of city names from a predecessor id array
+def build_compact_path(cgraph, previous, source, target):
+    if target == source or previous[target] == -1:
+        return []
+    path = [target]
+    while previous[path[-1]] != -1:
+        path.append(previous[path[-1]])
+    return [cgraph.names[node] for node in reversed(path)]
+
+# Function to run a full one-to-all Dijkstra from a start node; returns the
+# distance and predecessor (-1 for none) of every node id in the compact graph.
+# Given target ids it is one-to-many instead, stopping once all are settled
+# (distances of nodes not yet settled are then only upper bounds).
+def dijkstra_all(graph, start, stats=None, targets=None):
+    started = time.perf_counter() if stats is not None else 0
+    cgraph = compile_graph(graph)
+    source = cgraph.index[start]
+    remaining = len(set(targets)) if targets is not None else -1
+    wanted = set(targets) if targets is not None else ()
+    offsets, heads, weights = cgraph.offsets, cgraph.targets, cgraph.weights
+    distances = [float('infinity')] * len(cgraph)
+    previous = [-1] * len(cgraph)
+    settled = bytearray(len(cgraph))
+    distances[source] = 0
+    heap = [(0, source)]
+    push = heap_push(stats)
+    stop = -1
+
+    while heap:
+        distance, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = 1
+        if node in wanted:
+            remaining -= 1
+            if remaining == 0:
+                stop = node
+                break
+        for k in range(offsets[node], offsets[node + 1]):
+            neighbor = heads[k]
+            alternative_route = distance + weights[k]
+            if alternative_route < distances[neighbor]:
+                distances[neighbor] = alternative_route
+                previous[neighbor] = node
+                push(heap, (alternative_route, neighbor))
+
+    if stats is not None:
+        record_search_stats(stats, started, sum(settled), expanded_degrees(offsets, settled, stop))
+    return distances, previous
+
+# Function to find every city within budget hours of the nearest of one or
+# more sources (a city name or a list of them) in a single search: Dijkstra
+# started from all sources at once, stopping at the first city over budget.
+# Returns {city: (hours, source, previous city or None)}, closest first, so
+# with several depots it gives every reachable city's nearest depot.
+def reachable(graph, sources, budget=float('infinity'), stats=None):
+    started = time.perf_counter() if stats is not None else 0
+    cgraph = compile_graph(graph)
+    if isinstance(sources, str):
+        sources = [sources]
+    offsets, targets, weights = cgraph.offsets, cgraph.targets, cgraph.weights
+    distances = [float('infinity')] * len(cgraph)
+    origin = [-1] * len(cgraph)
+    previous = [-1] * len(cgraph)
+    settled = bytearray(len(cgraph))
+    heap = []
+    for source in sources:
+        node = cgraph.index[source]
+        distances[node] = 0
+        origin[node] = node
+        heap.append((0, node))
+    heapq.heapify(heap)
+    push = heap_push(stats, len(heap))
+
+    result = {}
+    while heap:
+        distance, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        if distance > budget:
+            break
+        settled[node] = 1
+        result[cgraph.names[node]] = (distance, cgraph.names[origin[node]],
+                                      cgraph.names[previous[node]] if previous[node] != -1 else None)
+        for k in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[k]
+            alternative_route = distance + weights[k]
+            if alternative_route < distances[neighbor] and alternative_route <= budget:
+                distances[neighbor] = alternative_route
+                origin[neighbor] = origin[node]
+                previous[neighbor] = node
+                push(heap, (alternative_route, neighbor))
+
+    if stats is not None:
+        record_search_stats(stats, started, len(result), expanded_degrees(offsets, settled))
+    return result
+
+# Function to find up to k meaningfully different routes from start to end
+# with the plateau (via-city) method. Two full searches, one forward from the
+# start and one backward from the destination, give the best route through
+# every city v (start → v → end) without further searching. Cities whose
+# incoming tree road lies on both trees share their route with the previous
+# city, so only the first city of each such plateau is considered. Candidates
+# are taken fastest first and kept if they don't visit a city twice, take at
+# most max_stretch times the fastest route, and share at most max_overlap of
+# their time with the routes already kept. Returns [(path, hours), ...],
+# fastest first.
+def alternative_routes(graph, start, end, k=3, max_overlap=0.5, max_stretch=1.4, stats=None):
+    started = time.perf_counter() if stats is not None else 0
+    cgraph = compile_graph(graph)
+    source, target = cgraph.index[start], cgraph.index[end]
+    forward_stats, backward_stats = ({}, {}) if stats is not None else (None, None)
+    forward, previous = dijkstra_all(cgraph, start, stats=forward_stats)
+    backward, following = dijkstra_all(cgraph.reverse(), end, stats=backward_stats)
+
+    routes = []
+    if source != target and forward[target] < float('infinity'):
+        limit = forward[target] * max_stretch
+        candidates = sorted((forward[v] + backward[v], v) for v in range(len(cgraph))
+                            if forward[v] + backward[v] <= limit
+                            and (previous[v] == -1 or following[previous[v]] != v))
+        used = set()
+        for hours, via in candidates:
+            head = [via]
+            while previous[head[-1]] != -1:
+                head.append(previous[head[-1]])
+            tail = [via]
+            while following[tail[-1]] != -1:
+                tail.append(following[tail[-1]])
+            if len(set(head) | set(tail)) != len(head) + len(tail) - 1:
+                continue
+            path = head[::-1] + tail[1:]
+            roads = list(zip(path[:-1], path[1:]))
+            # Tree roads take exactly the difference of their ends' distances
+            shared = sum(forward[v] - forward[u] if i < len(head) - 1 else backward[u] - backward[v]
+                         for i, (u, v) in enumerate(roads) if (u, v) in used)
+            if routes and shared > max_overlap * hours:
+                continue
+            used.update(roads)
+            routes.append(([cgraph.names[node] for node in path], hours))
+            if len(routes) == k:
+                break
+
+    if stats is not None:
+        stats['pushes'] = forward_stats['pushes'] + backward_stats['pushes']
+        record_search_stats(stats, started, forward_stats['settled'] + backward_stats['settled'],
+                            (forward_stats['relaxed'], backward_stats['relaxed']))
+    return routes
+
+# Function to build the travel-time matrix between stops (city names) with one
+# one-to-many search per stop. Returns the matrix (rows and columns in stop
+# order) and each stop's predecessor array, used to expand legs into paths.
+# With a contraction hierarchy the matrix comes from its many-to-many
+# buckets instead, which is much faster, and no predecessor arrays are kept.
+def stop_matrix(graph, stops, hierarchy=None):
+    if hierarchy is not None:
+        return hierarchy.many_to_many(stops, stops), None
+    cgraph = compile_graph(graph)
+    ids = [cgraph.index[stop] for stop in stops]
+    matrix, trees = [], []
+    for stop in stops:
+        distances, previous = dijkstra_all(cgraph, stop, targets=ids)
+        matrix.append([distances[i] for i in ids])
+        trees.append(previous)
+    return matrix, trees
+
+# Function to order stops greedily: leave the depot (stop 0) and always drive
+# to the closest stop not visited yet
+def nearest_neighbor_tour(matrix):
+    tour = [0]
+    unvisited = set(range(1, len(matrix)))
+    while unvisited:
+        row = matrix[tour[-1]]
+        tour.append(min(unvisited, key=row.__getitem__))
+        unvisited.remove(tour[-1])
+    return tour
+
+# Function to compute the travel time of a tour that returns to its first stop
+def tour_hours(matrix, tour):
+    return sum(matrix[a][b] for a, b in zip(tour, tour[1:] + tour[:1]))
+
+# Function to improve a tour (a list of stop positions starting with the depot)
+# with 2-opt moves (reverse a stretch of the tour) and Or-opt moves (move a
+# run of 1-3 stops elsewhere) until no move helps or the deadline, a
+# time.perf_counter() value, has passed. Road times differ by direction, so
+# 2-opt costs reversed stretches from prefix sums of the backward times.
+def improve_tour(matrix, tour, deadline):
+    route = tour + [tour[0]]
+    n = len(tour)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        forward, backward = [0], [0]
+        for a, b in zip(route, route[1:]):
+            forward.append(forward[-1] + matrix[a][b])
+            backward.append(backward[-1] + matrix[b][a])
+
+        for i in range(1, n - 1):
+            if time.perf_counter() >= deadline:
+                break
+            before = route[i - 1]
+            for j in range(i + 1, n):
+                after = route[j + 1]
+                delta = (matrix[before][route[j]] + backward[j] - backward[i] + matrix[route[i]][after]
+                         - matrix[before][route[i]] - forward[j] + forward[i] - matrix[route[j]][after])
+                if delta < -1e-9:
+                    route[i:j + 1] = route[j:i - 1:-1]
+                    improved = True
+                    break
+            if improved:
+                break
+        if improved:
+            continue
+
+        for length in (1, 2, 3):
+            for i in range(1, n - length + 1):
+                if time.perf_counter() >= deadline:
+                    break
+                first, last = route[i], route[i + length - 1]
+                before, after = route[i - 1], route[i + length]
+                removed = (matrix[before][first] + matrix[last][after] - matrix[before][after])
+                for p in range(n):
+                    if i - 1 <= p <= i + length - 1:
+                        continue
+                    delta = (matrix[route[p]][first] + matrix[last][route[p + 1]]
+                             - matrix[route[p]][route[p + 1]] - removed)
+                    if delta < -1e-9:
+                        segment = route[i:i + length]
+                        del route[i:i + length]
+                        p = p if p < i else p - length
+                        route[p + 1:p + 1] = segment
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return route[:-1]
+
+# Tours of up to this many stops (depot included) are solved exactly
+EXACT_TOUR_STOPS = 12
+
+# Function to find the fastest tour through every stop with the Held-Karp
+# dynamic program over subsets of stops, O(2^n n^2): best[visited][last] is
+# the fastest way from the depot through the stops in the bit set visited
+# (stop i is bit i - 1), ending at last
+def exact_tour(matrix):
+    n = len(matrix)
+    full = (1 << (n - 1)) - 1
+    best = [[float('infinity')] * n for _ in range(full + 1)]
+    parent = [[0] * n for _ in range(full + 1)]
+    for stop in range(1, n):
+        best[1 << (stop - 1)][stop] = matrix[0][stop]
+    # Every subset comes before the larger ones built from it
+    for visited in range(1, full + 1):
+        row = best[visited]
+        for last in range(1, n):
+            hours = row[last]
+            if hours == float('infinity'):
+                continue
+            for stop in range(1, n):
+                bit = 1 << (stop - 1)
+                if not visited & bit and hours + matrix[last][stop] < best[visited | bit][stop]:
+                    best[visited | bit][stop] = hours + matrix[last][stop]
+                    parent[visited | bit][stop] = last
+    last = min(range(1, n), key=lambda stop: best[full][stop] + matrix[stop][0])
+    tour, visited = [], full
+    while last:
+        tour.append(last)
+        visited, last = visited & ~(1 << (last - 1)), parent[visited][last]
+    return [0] + tour[::-1]
+
+# Function to plan a tour that leaves the first stop (the depot), visits every
+# other stop once and returns to the depot, or ends at the last visit when
+# round_trip is False. The stop-to-stop matrix comes from one-to-many
+# searches. Up to EXACT_TOUR_STOPS stops the order is exact; beyond that it
+# starts from nearest neighbor and is improved with 2-opt and Or-opt moves
+# for at most time_limit seconds. A contraction hierarchy of the graph, if
+# given, is used for the matrix and the legs.
+# Returns the stops in visiting order, the legs between them as
+# (path, hours) and the total hours.
+def plan_tour(graph, stops, round_trip=True, time_limit=1.0, hierarchy=None, stats=None):
+    cgraph = compile_graph(graph)
+    stops = list(dict.fromkeys(stops))
+    if len(stops) < 2:
+        raise ValueError("A tour needs at least two different stops")
+    with timed(stats, 'matrix_ms'):
+        hours, trees = stop_matrix(cgraph, stops, hierarchy)
+    for i, row in enumerate(hours):
+        for j, value in enumerate(row):
+            if value == float('infinity'):
+                raise ValueError(f"{stops[j]} can't be reached from {stops[i]}")
+
+    with timed(stats, 'solve_ms'):
+        # Without the drive back, returning to the depot is free
+        matrix = hours if round_trip else [[0 if j == 0 else value for j, value in enumerate(row)]
+                                           for row in hours]
+        tour = nearest_neighbor_tour(matrix)
+        initial = tour_hours(matrix, tour)
+        if len(stops) <= EXACT_TOUR_STOPS:
+            tour = exact_tour(matrix)
+        else:
+            tour = improve_tour(matrix, tour, time.perf_counter() + time_limit)
+    if round_trip:
+        tour.append(0)
+
+    if trees is None:
+        legs = [(hierarchy.query(stops[a], stops[b])[0], hours[a][b]) for a, b in zip(tour, tour[1:])]
+    else:
+        legs = [(build_compact_path(cgraph, trees[a], cgraph.index[stops[a]], cgraph.index[stops[b]]),
+                 hours[a][b]) for a, b in zip(tour, tour[1:])]
+    total = sum(leg_hours for _, leg_hours in legs)
+    if stats is not None:
+        stats.update(stops=len(stops), initial_hours=initial, hours=total)
+    return [stops[i] for i in tour], legs, total
+
+# Function to repair a one-to-all shortest-path tree (distances and previous,
+# indexed by node id, as returned by dijkstra_all) after road weights changed,
+# given the (u, v, old, new) changes from RoadNetwork.update_weights().
+# Only the affected part of the tree is recomputed:
+#   - a slower road that is on the tree invalidates the subtree below it; those
+#     nodes are re-seeded from their unaffected in-neighbours,
+#   - a faster road seeds its end node if it now gives a shorter route,
+# and a Dijkstra run from the seeds propagates the new distances.
+# Works on lists or NumPy rows; returns the ids whose distance changed.
+def repair_tree(cgraph, distances, previous, changes):
+    roots = [v for u, v, old, new in changes if new > old and previous[v] == u]
+    affected = set()
+    if roots:
+        children = {}
+        for node, parent in enumerate(previous):
+            if parent != -1:
+                children.setdefault(int(parent), []).append(node)
+        stack = roots
+        while stack:
+            node = stack.pop()
+            if node not in affected:
+                affected.add(node)
+                stack.extend(children.get(node, ()))
+
+    changed = set()
+    old_distances = {node: distances[node] for node in affected}
+    for node in affected:
+        distances[node] = float('infinity')
+        previous[node] = -1
+
+    heap = []
+    rgraph = cgraph.reverse() if affected else None
+    for node in affected:
+        for k in range(rgraph.offsets[node], rgraph.offsets[node + 1]):
+            neighbor = rgraph.targets[k]
+            if neighbor in affected:
+                continue
+            alternative_route = distances[neighbor] + rgraph.weights[k]
+            if alternative_route < distances[node]:
+                distances[node] = alternative_route
+                previous[node] = neighbor
+        if distances[node] < float('infinity'):
+            heapq.heappush(heap, (distances[node], node))
+    for u, v, old, new in changes:
+        if new < old and distances[u] + new < distances[v]:
+            distances[v] = distances[u] + new
+            previous[v] = u
+            heapq.heappush(heap, (distances[v], v))
+            changed.add(v)
+
+    offsets, targets, weights = cgraph.offsets, cgraph.targets, cgraph.weights
+    while heap:
+        distance, node = heapq.heappop(heap)
+        if distance > distances[node]:
+            continue
+        for k in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[k]
+            alternative_route = distance + weights[k]
+            if alternative_route < distances[neighbor]:
+                distances[neighbor] = alternative_route
+                previous[neighbor] = node
+                heapq.heappush(heap, (alternative_route, neighbor))
+                changed.add(neighbor)
+
+    changed.update(node for node in affected if distances[node] != old_distances[node])
+    return changed
+
+# Shortest-path tree from one start node that is kept up to date as road
+# weights change, instead of being recomputed from scratch. The tree never
+# changes weights itself: change them with RoadNetwork.update_weights() and
+# pass the changes it returns to repair() of every tree built on the network.
+class ShortestPathTree:
+    def __init__(self, graph, start):
+        self.graph = compile_graph(graph)
+        self.start = start
+        self.distances, self.previous = dijkstra_all(self.graph, start)
+
+    # Repair the tree after the graph's weights changed; returns the names of
+    # the cities whose travel time changed
+    def repair(self, changes):
+        changed = repair_tree(self.graph, self.distances, self.previous, changes)
+        return [self.graph.names[node] for node in changed]
+
+    def distance(self, end):
+        return self.distances[self.graph.index[end]]
+
+    def path(self, end):
+        source, target = self.graph.index[self.start], self.graph.index[end]
+        return build_compact_path(self.graph, self.previous, source, target)
+
+# Time-dependent travel times. Each road either keeps its fixed time or follows
+# a shape: a daily piecewise-linear curve of factors applied to the road's time
+# (e.g. 1.5 at 08:00 means 50% slower in the morning peak). Breakpoints are in
+# hours of the day, and the curve wraps around midnight. Shapes are shared
+# between roads, so a national network only needs one small shape id per road
+# plus a table of a few distinct shapes.
+class TravelTimeProfiles:
+    def __init__(self, graph, edge_shapes=None, shape_names=None, offsets=None, hours=None,
+                 factors=None):
+        self.graph = compile_graph(graph)
+        self.edge_shapes = edge_shapes or array('i', [-1]) * self.graph.edge_count()
+        self.shape_names = shape_names or []
+        self.offsets = offsets or array('l', [0])
+        self.hours = hours or array('f')
+        self.factors = factors or array('f')
+
+    # Add a shape from (hour, factor) breakpoints; returns its id
+    def add_shape(self, name, points):
+        points = sorted(points)
+        if not points:
+            raise ValueError(f"Shape {name} has no breakpoints")
+        for hour, factor in points:
+            if not 0 <= hour < 24 or factor <= 0:
+                raise ValueError(f"Shape {name} has an invalid breakpoint ({hour}, {factor})")
+        for hour, factor in points:
+            self.hours.append(hour)
+            self.factors.append(factor)
+        self.offsets.append(len(self.hours))
+        self.shape_names.append(name)
+        return len(self.shape_names) - 1
+
+    def shape_id(self, name):
+        return self.shape_names.index(name)
+
+    # Steepest drop of a shape's factor, per hour, over all its segments
+    # (including the one wrapping around midnight)
+    def _min_slope(self, shape):
+        start, end = self.offsets[shape], self.offsets[shape + 1]
+        slope = 0
+        for i in range(start, end):
+            j = i + 1 if i + 1 < end else start
+            span = (self.hours[j] - self.hours[i]) % 24 or 24
+            slope = min(slope, (self.factors[j] - self.factors[i]) / span)
+        return slope
+
+    def _slot(self, source, target):
+        k = self.graph.edge_slot(self.graph.index[source], self.graph.index[target])
+        if k == -1:
+            raise KeyError(f"No road {source} → {target}")
+        return k
+
+    # Check that a road taking hours (before its shape's factor) keeps the FIFO
+    # property time-dependent Dijkstra relies on, i.e. a later departure never
+    # arrives earlier: the road's time may never drop faster than one hour per
+    # hour. Checks the road's own shape unless another one is given.
+    def check_fifo(self, source, target, hours, shape=None):
+        shape = self.edge_shapes[self._slot(source, target)] if shape is None else shape
+        if shape >= 0 and hours * self._min_slope(shape) < -1:
+            raise ValueError(f"Shape {self.shape_names[shape]} drops too fast for road "
+                             f"{source} → {target} ({hours:g} h) to keep later departures "
+                             f"arriving later")
+
+    # Give a road a shape, rejecting shapes that would break FIFO
+    def assign(self, source, target, shape_name):
+        k = self._slot(source, target)
+        shape = self.shape_id(shape_name)
+        self.check_fifo(source, target, self.graph.weights[k], shape)
+        self.edge_shapes[k] = shape
+
+    # Factor of a shape at an absolute time in hours (any day)
+    def factor(self, shape, time_of_day):
+        start, end = self.offsets[shape], self.offsets[shape + 1]
+        hour = time_of_day % 24
+        i = bisect.bisect_right(self.hours, hour, start, end) - 1
+        if i < start:
+            i = end - 1
+        j = i + 1 if i + 1 < end else start
+        if i == j:
+            return self.factors[i]
+        span = (self.hours[j] - self.hours[i]) % 24 or 24
+        position = (hour - self.hours[i]) % 24 / span
+        return self.factors[i] + (self.factors[j] - self.factors[i]) * position
+
+    # Travel time in hours of the road in CSR slot k when entered at time t
+    def travel_time(self, k, t):
+        shape = self.edge_shapes[k]
+        if shape < 0:
+            return self.graph.weights[k]
+        return self.graph.weights[k] * self.factor(shape, t)
+
+    # Smallest factor of any shape (at most 1), used to keep A* admissible
+    def min_factor(self):
+        return min([1.0, *self.factors])
+
+    # Time of every leg of a path of city names, leaving at departure
+    def leg_times(self, path, departure):
+        times, t = [], departure
+        for a, b in zip(path[:-1], path[1:]):
+            k = self.graph.edge_slot(self.graph.index[a], self.graph.index[b])
+            times.append(self.travel_time(k, t))
+            t += times[-1]
+        return times
+
+    def save(self, path):
+        write_arrays(path, {'format': 'travel-time-profiles', 'shapes': self.shape_names,
+                            'fingerprint': graph_fingerprint(self.graph)},
+                     {'edge_shapes': self.edge_shapes, 'offsets': self.offsets,
+                      'hours': self.hours, 'factors': self.factors})
+
+    # Shapes are stored per CSR slot, so they only fit the exact graph they
+    # were saved with (any change to its roads or times changes its fingerprint)
+    @classmethod
+    def load(cls, path, graph):
+        header, arrays = read_arrays(path)
+        if header.get('format') != 'travel-time-profiles':
+            raise ValueError(f"{path} is not a travel time profiles file")
+        graph = compile_graph(graph)
+        if header.get('fingerprint') != graph_fingerprint(graph):
+            raise ValueError(f"{path} was saved for a different graph")
+        return cls(graph, arrays['edge_shapes'], header['shapes'], arrays['offsets'],
+                   arrays['hours'], arrays['factors'])
+
+# Function to find the earliest arrival from start to end when leaving at
+# departure (hours; 8.5 is 08:30), using time-dependent road times. This is
+# Dijkstra over arrival times, which is exact because every road keeps the
+# FIFO property. With coordinates for every city it becomes A*, with the
+# great-circle heuristic scaled by the smallest congestion factor (max_speed
+# as for astar()). Returns the path, the travel time and the arrival time.
+def time_dependent_route(profiles, start, end, departure, coordinates=None,
+                         max_speed=None, stats=None):
+    cgraph = profiles.graph
+    if coordinates and not has_all_coordinates(cgraph, coordinates):
+        coordinates = None
+    if coordinates and max_speed is None:
+        max_speed = admissible_speed(cgraph, coordinates)
+    started = time.perf_counter() if stats is not None else 0
+    source, target = cgraph.index[start], cgraph.index[end]
+    offsets, targets = cgraph.offsets, cgraph.targets
+    goal = coordinates[end] if coordinates else None
+    scale = profiles.min_factor() / max_speed if goal is not None and max_speed > 0 else 0
+    heuristic = [None] * len(cgraph)
+
+    def estimate(node):
+        if goal is None:
+            return 0
+        if heuristic[node] is None:
+            heuristic[node] = haversine(coordinates[cgraph.names[node]], goal) * scale
+        return heuristic[node]
+
+    arrivals = [float('infinity')] * len(cgraph)
+    previous = [-1] * len(cgraph)
+    settled = bytearray(len(cgraph))
+    arrivals[source] = departure
+    heap = [(departure + estimate(source), source)]
+    push = heap_push(stats)
+
+    while heap:
+        _, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = 1
+        if node == target:
+            break
+        arrival = arrivals[node]
+        for k in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[k]
+            alternative_arrival = arrival + profiles.travel_time(k, arrival)
+            if alternative_arrival < arrivals[neighbor]:
+                arrivals[neighbor] = alternative_arrival
+                previous[neighbor] = node
+                push(heap, (alternative_arrival + estimate(neighbor), neighbor))
+
+    if stats is not None:
+        record_search_stats(stats, started, sum(settled), expanded_degrees(offsets, settled, target))
+    path = build_compact_path(cgraph, previous, source, target)
+    return path, arrivals[target] - departure, arrivals[target]
+
+# Function to compute a stable fingerprint of a graph's contents, used to tell
+# whether a file precomputed from a graph is still valid for it
+def graph_fingerprint(graph):
+    cgraph = compile_graph(graph)
+    digest = hashlib.sha256()
+    digest.update(json.dumps(cgraph.names, default=str).encode())
+    digest.update(cgraph.offsets.tobytes())
+    digest.update(cgraph.targets.tobytes())
+    digest.update(cgraph.weights.tobytes())
+    return digest.hexdigest()
+
+# Function to write named arrays to a compact binary file: one JSON header line
+# (metadata plus typecode and length of every array) followed by the raw array bytes.
+# The file is written under a temporary name of its own and then moved into
+# place, so processes writing the same file at once never share a partial file.
+def write_arrays(path, header, arrays):
+    header = dict(header, arrays=[(name, values.typecode, len(values)) for name, values in arrays.items()])
+
+    def write(f):
+        f.write(json.dumps(header).encode() + b'\n')
+        for values in arrays.values():
+            values.tofile(f)
+
+    write_replacing(path, write)
+
+# Function to write a file with write(f) into a temporary file next to it that
+# then replaces it, so a reader never sees a half-written file
+def write_replacing(path, write, mode='wb'):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(path) + '.',
+                                     suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+# Function to read a file written by write_arrays()
+def read_arrays(path):
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        arrays = {}
+        for name, typecode, length in header['arrays']:
+            values = array(typecode)
+            values.fromfile(f, length)
+            arrays[name] = values
+    return header, arrays
+
+# Contraction hierarchy: nodes are contracted one by one in order of importance,
+# adding shortcut edges so that shortest paths between the remaining nodes are
+# preserved. A query then only needs to search "upward" (towards more important
+# nodes) from both ends. Upward edges are stored in CSR form; the backward graph
+# holds edges u -> v indexed from v, so both searches only ever follow increasing rank.
+# Shortcut edges record the contracted middle node (-1 for original roads)
+# so routes can be unpacked back into real cities.
+class ContractionHierarchy:
+    VERSION = 1
+
+    def __init__(self, names, rank, forward, backward, fingerprint=None):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.rank = rank
+        self.forward = forward
+        self.backward = backward
+        self.fingerprint = fingerprint
+        self._middles = None
+
+    @classmethod
+    def build(cls, graph, witness_limit=500):
+        cgraph = compile_graph(graph)
+        n = len(cgraph)
+        out_edges = [{} for _ in range(n)]
+        in_edges = [{} for _ in range(n)]
+        for node in range(n):
+            for k in range(cgraph.offsets[node], cgraph.offsets[node + 1]):
+                neighbor, weight = cgraph.targets[k], cgraph.weights[k]
+                if neighbor != node and weight < out_edges[node].get(neighbor, (float('infinity'),))[0]:
+                    out_edges[node][neighbor] = (weight, -1)
+                    in_edges[neighbor][node] = (weight, -1)
+        # Every edge that ever existed (original roads and shortcuts), cheapest kept
+        edges = {}
+        for node in range(n):
+            for neighbor, edge in out_edges[node].items():
+                edges[(node, neighbor)] = edge
+
+        contracted = bytearray(n)
+        contracted_neighbors = [0] * n
+
+        def witness_distances(source, skip, limit):
+            distances = {source: 0}
+            heap = [(0, source)]
+            settled = 0
+            while heap and settled < witness_limit:
+                distance, node = heapq.heappop(heap)
+                if distance > distances[node]:
+                    continue
+                if distance > limit:
+                    break
+                settled += 1
+                for neighbor, (weight, _) in out_edges[node].items():
+                    if neighbor == skip or contracted[neighbor]:
+                        continue
+                    alternative_route = distance + weight
+                    if alternative_route < distances.get(neighbor, float('infinity')):
+                        distances[neighbor] = alternative_route
+                        heapq.heappush(heap, (alternative_route, neighbor))
+            return distances
+
+        def shortcuts_for(node):
+            shortcuts = []
+            outgoing = [(x, w) for x, (w, _) in out_edges[node].items() if not contracted[x]]
+            for u, (w_in, _) in in_edges[node].items():
+                if contracted[u] or not outgoing:
+                    continue
+                limit = w_in + max(w for _, w in outgoing)
+                distances = witness_distances(u, node, limit)
+                for x, w_out in outgoing:
+                    if x != u and distances.get(x, float('infinity')) > w_in + w_out:
+                        shortcuts.append((u, x, w_in + w_out))
+            return shortcuts
+
+        def priority(node):
+            degree = (sum(1 for x in out_edges[node] if not contracted[x])
+                      + sum(1 for u in in_edges[node] if not contracted[u]))
+            return len(shortcuts_for(node)) - degree + contracted_neighbors[node]
+
+        queue = [(priority(node), node) for node in range(n)]
+        heapq.heapify(queue)
+        rank = array('l', [0]) * n
+        order = 0
+        while queue:
+            _, node = heapq.heappop(queue)
+            # Lazy update: re-evaluate and put back if no longer the cheapest
+            current = priority(node)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, node))
+                continue
+            for u, x, weight in shortcuts_for(node):
+                if weight < out_edges[u].get(x, (float('infinity'),))[0]:
+                    out_edges[u][x] = (weight, node)
+                    in_edges[x][u] = (weight, node)
+                    edges[(u, x)] = (weight, node)
+            contracted[node] = 1
+            rank[node] = order
+            order += 1
+            for neighbor in set(out_edges[node]) | set(in_edges[node]):
+                contracted_neighbors[neighbor] += 1
+
+        forward = [[] for _ in range(n)]
+        backward = [[] for _ in range(n)]
+        for (u, x), (weight, middle) in edges.items():
+            if rank[x] > rank[u]:
+                forward[u].append((x, weight, middle))
+            else:
+                backward[x].append((u, weight, middle))
+        return cls(cgraph.names, rank, cls._pack(forward), cls._pack(backward),
+                   graph_fingerprint(cgraph))
+
+    @staticmethod
+    def _pack(adjacency):
+        offsets, targets = array('l', [0]), array('l')
+        weights, middles = array('d'), array('l')
+        for edges in adjacency:
+            for target, weight, middle in edges:
+                targets.append(target)
+                weights.append(weight)
+                middles.append(middle)
+            offsets.append(len(targets))
+        return offsets, targets, weights, middles
+
+    def save(self, path):
+        arrays = {'rank': self.rank}
+        for prefix, csr in (('forward', self.forward), ('backward', self.backward)):
+            for name, values in zip(('offsets', 'targets', 'weights', 'middles'), csr):
+                arrays[f'{prefix}_{name}'] = values
+        write_arrays(path, {'format': 'contraction-hierarchy', 'version': self.VERSION,
+                            'fingerprint': self.fingerprint, 'names': self.names}, arrays)
+
+    @classmethod
+    def load(cls, path):
+        header, arrays = read_arrays(path)
+        if header.get('format') != 'contraction-hierarchy' or header.get('version') != cls.VERSION:
+            raise ValueError(f"{path} is not a contraction hierarchy file")
+        csr = {prefix: tuple(arrays[f'{prefix}_{name}']
+                             for name in ('offsets', 'targets', 'weights', 'middles'))
+               for prefix in ('forward', 'backward')}
+        return cls(header['names'], arrays['rank'], csr['forward'], csr['backward'],
+                   header['fingerprint'])
+
+    # Fastest route from start to end as (path, hours). Like
+    # bidirectional_dijkstra(), it may return a different route than
+    # dijkstra_heap() when several tie for the fastest.
+    def query(self, start, end, stats=None):
+        started = time.perf_counter() if stats is not None else 0
+        source, target = self.index[start], self.index[end]
+        if source == target:
+            if stats is not None:
+                record_search_stats(stats, started, 0)
+            return [], 0
+        n = len(self.names)
+        sides = [
+            (self.forward, [float('infinity')] * n, [-1] * n, [(0, source)], bytearray(n)),
+            (self.backward, [float('infinity')] * n, [-1] * n, [(0, target)], bytearray(n)),
+        ]
+        sides[0][1][source] = 0
+        sides[1][1][target] = 0
+        best, meeting_node = float('infinity'), -1
+        push = heap_push(stats, 2)
+
+        side = 0
+        while sides[0][3] or sides[1][3]:
+            if not sides[side][3] or sides[side][3][0][0] >= best:
+                sides[side][3].clear()
+                side = 1 - side
+                continue
+            (offsets, targets, weights, _), distances, previous, heap, settled = sides[side]
+            distance, node = heapq.heappop(heap)
+            if settled[node]:
+                continue
+            settled[node] = 1
+            other_distance = sides[1 - side][1][node]
+            if distance + other_distance < best:
+                best, meeting_node = distance + other_distance, node
+            for k in range(offsets[node], offsets[node + 1]):
+                neighbor = targets[k]
+                alternative_route = distance + weights[k]
+                if alternative_route < distances[neighbor]:
+                    distances[neighbor] = alternative_route
+                    previous[neighbor] = node
+                    push(heap, (alternative_route, neighbor))
+            side = 1 - side
+
+        if stats is not None:
+            record_search_stats(stats, started, sum(sides[0][4]) + sum(sides[1][4]),
+                                itertools.chain(expanded_degrees(self.forward[0], sides[0][4]),
+                                                expanded_degrees(self.backward[0], sides[1][4])))
+        if meeting_node == -1:
+            return [], float('infinity')
+
+        route = [meeting_node]
+        while sides[0][2][route[0]] != -1:
+            route.insert(0, sides[0][2][route[0]])
+        while sides[1][2][route[-1]] != -1:
+            route.append(sides[1][2][route[-1]])
+        path = [route[0]]
+        for u, x in zip(route[:-1], route[1:]):
+            self._unpack(u, x, path)
+        return [self.names[node] for node in path], best
+
+    # Travel times from every source to every target (city names), as rows in
+    # source order, with the bucket method: one upward search per target leaves
+    # its distance in a bucket at every node it reaches, then one upward search
+    # per source combines its distances with the buckets it finds
+    def many_to_many(self, sources, targets):
+        buckets = {}
+        for j, target in enumerate(targets):
+            for node, distance in self._upward(self.backward, self.index[target]).items():
+                buckets.setdefault(node, []).append((j, distance))
+        matrix = []
+        for source in sources:
+            row = [float('infinity')] * len(targets)
+            for node, distance in self._upward(self.forward, self.index[source]).items():
+                for j, other in buckets.get(node, ()):
+                    if distance + other < row[j]:
+                        row[j] = distance + other
+            matrix.append(row)
+        return matrix
+
+    # Complete search from start over one side of the hierarchy; returns the
+    # distance of every node reached
+    def _upward(self, csr, start):
+        offsets, targets, weights, _ = csr
+        distances = {start: 0}
+        settled = {}
+        heap = [(0, start)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = distance
+            for k in range(offsets[node], offsets[node + 1]):
+                neighbor = targets[k]
+                alternative_route = distance + weights[k]
+                if alternative_route < distances.get(neighbor, float('infinity')):
+                    distances[neighbor] = alternative_route
+                    heapq.heappush(heap, (alternative_route, neighbor))
+        return settled
+
+    # Expand a (possibly shortcut) edge u -> x into real roads,
+    # appending every node after u to path
+    def _unpack(self, u, x, path):
+        if self._middles is None:
+            self._middles = {}
+            for node in range(len(self.names)):
+                offsets, targets, _, middles = self.forward
+                for k in range(offsets[node], offsets[node + 1]):
+                    self._middles[(node, targets[k])] = middles[k]
+                offsets, targets, _, middles = self.backward
+                for k in range(offsets[node], offsets[node + 1]):
+                    self._middles[(targets[k], node)] = middles[k]
+        stack = [(u, x)]
+        while stack:
+            a, b = stack.pop()
+            middle = self._middles[(a, b)]
+            if middle == -1:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+# Function to check a contraction hierarchy against the reference dijkstra()
+# on random start/destination pairs; returns the pairs whose costs disagree.
+# Shortcuts add road times up in a different order than a plain search, so
+# float times are compared with a small tolerance.
+def verify_hierarchy(hierarchy, graph, samples=100, seed=0):
+    rng = random.Random(seed)
+    nodes = list(graph)
+    mismatches = []
+    for _ in range(samples):
+        start, end = rng.choice(nodes), rng.choice(nodes)
+        _, expected = dijkstra(graph, start, end)
+        _, actual = hierarchy.query(start, end)
+        if not math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-12):
+            mismatches.append((start, end, expected, actual))
+    return mismatches
+
+# Function to find where the contraction hierarchy of a graph (given by its
+# fingerprint) is kept in a cache directory
+def hierarchy_path(fingerprint, cache_dir):
+    return os.path.join(cache_dir, f"ch-{fingerprint[:16]}.bin")
+
+# Function to load a precomputed contraction hierarchy for a graph (given by
+# its fingerprint); returns None when the file is missing, unreadable or was
+# built from a different graph. Hierarchies are never built on demand, as
+# that takes minutes on large networks: build_hierarchy.py builds them offline.
+def load_hierarchy(path, fingerprint):
+    try:
+        hierarchy = ContractionHierarchy.load(path)
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+    return hierarchy if hierarchy.fingerprint == fingerprint else None
+
+# Directory of the graphs saved from the app (see GraphStore)
+GRAPHS_DIR = 'graphs'
+
+# Saved graphs, one file per graph in a directory shared by every session. Each
+# file holds the graph's CSR arrays and node positions in write_arrays()
+# format, so loading reads them straight into a CompactGraph in a few bulk
+# reads instead of rebuilding the graph edge by edge.
+class GraphStore:
+    VERSION = 1
+    SUFFIX = '.graph'
+
+    def __init__(self, directory=GRAPHS_DIR):
+        self.directory = directory
+
+    # Graph names are used as file names, escaped so any name is safe
+    def path(self, name):
+        return os.path.join(self.directory, urllib.parse.quote(name, safe='') + self.SUFFIX)
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(urllib.parse.unquote(entry[:-len(self.SUFFIX)])
+                      for entry in os.listdir(self.directory) if entry.endswith(self.SUFFIX))
+
+    def __contains__(self, name):
+        return os.path.exists(self.path(name))
+
+    # Save a graph (dict of dicts, NetworkX graph or CompactGraph) with
+    # optional {node: (x, y)} positions, replacing any graph of the same name
+    def save(self, name, graph, positions=None):
+        cgraph = compile_graph(graph)
+        positions = positions or {}
+        missing = (float('nan'), float('nan'))
+        xs = array('d', (positions.get(node, missing)[0] for node in cgraph.names))
+        ys = array('d', (positions.get(node, missing)[1] for node in cgraph.names))
+        directed = graph.is_directed() if hasattr(graph, 'is_directed') else True
+        write_arrays(self.path(name),
+                     {'format': 'graph', 'version': self.VERSION, 'name': name,
+                      'directed': directed, 'names': cgraph.names},
+                     {'offsets': cgraph.offsets, 'targets': cgraph.targets,
+                      'weights': cgraph.weights, 'x': xs, 'y': ys})
+
+    # Load a saved graph; returns the CompactGraph, the {node: (x, y)} positions
+    # of the nodes that have one and whether the graph is directed
+    def load(self, name):
+        header, arrays = read_arrays(self.path(name))
+        if header.get('format') != 'graph' or header.get('version') != self.VERSION:
+            raise ValueError(f"{self.path(name)} is not a saved graph")
+        names = header['names']
+        cgraph = CompactGraph(names, arrays['offsets'], arrays['targets'], arrays['weights'])
+        positions = {node: (x, y) for node, x, y in zip(names, arrays['x'], arrays['y'])
+                     if not math.isnan(x)}
+        return cgraph, positions, header['directed']
+
+    def delete(self, name):
+        os.remove(self.path(name))
+
+# Directory holding the built-in road network (cities and roads tables)
+DATA_DIR = 'data'
+
+# Directory for files precomputed from a graph (hierarchies, distance tables)
+CACHE_DIR = 'cache'
+
+# Function to read a table from CSV or Parquet, chosen by file extension, as a
+# dict of column name -> list of values. CSV values are left as strings.
+# pandas is only imported for Parquet, so loading CSV data stays fast.
+def read_table(path):
+    if path.endswith('.parquet'):
+        import pandas as pd
+        return pd.read_parquet(path).to_dict('list')
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = csv.reader(f)
+        header = next(rows, [])
+        columns = [[] for _ in header]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+    return dict(zip(header, columns))
+
+# Function to convert a table value to a number; int for whole numbers so
+# travel times like 3 stay 3. Empty or missing values become None.
+def to_number(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    if value != value:
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+# Function to find a table in a data directory, preferring Parquet over CSV
+def find_table(directory, name):
+    for extension in ('.parquet', '.csv'):
+        path = os.path.join(directory, name + extension)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {name}.parquet or {name}.csv in {directory}")
+
+# Function to check a road network. Problems that make it unusable (no cities,
+# roads to unknown cities, negative or missing times, cities without valid
+# coordinates, which every map needs) raise ValueError; anything the app can
+# live with (one-way roads) is returned as a list of warnings.
+def validate_network(graph, coordinates):
+    errors, warnings = [], []
+    if not graph:
+        errors.append("The network has no cities")
+    for node, neighbors in graph.items():
+        for neighbor, weight in neighbors.items():
+            if neighbor not in graph:
+                errors.append(f"Road {node} → {neighbor} leads to an unknown city")
+            elif weight is None or weight != weight or weight < 0:
+                errors.append(f"Road {node} → {neighbor} has an invalid time: {weight}")
+            elif node not in graph[neighbor]:
+                warnings.append(f"Road {node} → {neighbor} has no return road")
+    for node in graph:
+        if node not in coordinates:
+            errors.append(f"City {node} has no coordinates")
+        elif not all(math.isfinite(value) for value in coordinates[node]):
+            errors.append(f"City {node} has invalid coordinates: {coordinates[node]}")
+        elif not (-90 <= coordinates[node][0] <= 90 and -180 <= coordinates[node][1] <= 180):
+            errors.append(f"City {node} has coordinates out of range: {coordinates[node]}")
+    if errors:
+        raise ValueError("Invalid road network:\n" + "\n".join(errors))
+    return warnings
+
+# A loaded road network with everything derived from it that searches need
+class RoadNetwork:
+    def __init__(self, graph, coordinates, warnings=()):
+        self.graph = graph
+        self.coordinates = coordinates
+        self.warnings = list(warnings)
+        self.compact = compile_graph(graph)
+        # Top speed that keeps the A* heuristic admissible on this network
+        self.max_speed = admissible_speed(self.compact, coordinates)
+        # Time-of-day road times (TravelTimeProfiles), if the network has them
+        self.profiles = None
+        # Identifies the graph (for precomputed hierarchies and tables)
+        self.fingerprint = graph_fingerprint(self.compact)
+        self._refresh_version()
+
+    def _refresh_version(self):
+        # Identifies graph and coordinates together (for anything drawn on the map)
+        self.version = hashlib.sha256(
+            (self.fingerprint + json.dumps(sorted(self.coordinates.items()), default=str)).encode()
+        ).hexdigest()
+
+    # Change the travel times of existing roads in bulk, given (source, target,
+    # hours) triples. Returns the id-level changes so shortest-path trees and
+    # distance tables built on this network can be repaired with them. Roads
+    # with a time-of-day profile must keep FIFO at their new time; otherwise
+    # ValueError is raised and nothing is changed.
+    def update_weights(self, updates):
+        updates = list(updates)
+        if self.profiles is not None:
+            for source, target, hours in updates:
+                self.profiles.check_fifo(source, target, hours)
+        changes = self.compact.update_weights(updates)
+        for source, target, hours in updates:
+            self.graph[source][target] = hours
+            # Slower roads leave the old top speed admissible; faster ones may raise it
+            if source in self.coordinates and target in self.coordinates:
+                self.max_speed = max(self.max_speed, edge_speed(self.coordinates[source],
+                                                                self.coordinates[target], hours))
+        if changes:
+            self.fingerprint = graph_fingerprint(self.compact)
+            self._refresh_version()
+        return changes
+
+# Function to load a road network from a directory holding a cities table
+# (city, lat, lng) and a roads table (source, target, hours), one row per direction
+def load_network(directory=DATA_DIR):
+    cities = read_table(find_table(directory, 'cities'))
+    roads = read_table(find_table(directory, 'roads'))
+    missing = {'city', 'lat', 'lng'} - set(cities) | {'source', 'target', 'hours'} - set(roads)
+    if missing:
+        raise ValueError(f"Missing columns in {directory}: {', '.join(sorted(missing))}")
+
+    graph, coordinates = {}, {}
+    for city, lat, lng in zip(cities['city'], cities['lat'], cities['lng']):
+        graph[city] = {}
+        lat, lng = to_number(lat), to_number(lng)
+        if lat is not None and lng is not None:
+            coordinates[city] = (lat, lng)
+    for source, target, hours in zip(roads['source'], roads['target'], roads['hours']):
+        if source not in graph:
+            raise ValueError(f"Road {source} → {target} starts at an unknown city")
+        graph[source][target] = to_number(hours)
+    network = RoadNetwork(graph, coordinates, validate_network(graph, coordinates))
+    network.profiles = load_profiles(directory, network.compact, roads)
+    return network
+
+# Function to load the optional time-of-day shapes of a road network: a profiles
+# table (profile, hour, factor) plus a profile column in the roads table naming
+# each road's shape (empty for roads with a fixed time). Returns None when the
+# network has no profiles table.
+def load_profiles(directory, cgraph, roads):
+    try:
+        table = read_table(find_table(directory, 'profiles'))
+    except FileNotFoundError:
+        return None
+    shapes = {}
+    for name, hour, factor in zip(table['profile'], table['hour'], table['factor']):
+        shapes.setdefault(name, []).append((to_number(hour), to_number(factor)))
+    profiles = TravelTimeProfiles(cgraph)
+    for name, points in shapes.items():
+        profiles.add_shape(name, points)
+    for source, target, shape in zip(roads['source'], roads['target'],
+                                     roads.get('profile', [None] * len(roads['source']))):
+        if shape and shape == shape:
+            if shape not in shapes:
+                raise ValueError(f"Road {source} → {target} uses unknown profile {shape}")
+            profiles.assign(source, target, shape)
+    return profiles
+
+# All-pairs distance table: one one-to-all search per node, stored as an
+# n x n distance matrix and an n x n predecessor matrix (row = start node),
+# so every lookup afterwards is a plain array index
+class DistanceMatrix:
+    def __init__(self, names, distances, predecessors, fingerprint=None):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.distances = distances
+        self.predecessors = predecessors
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, graph):
+        cgraph = compile_graph(graph)
+        n = len(cgraph)
+        distances = np.empty((n, n), dtype=np.float64)
+        predecessors = np.empty((n, n), dtype=np.int32)
+        for source in range(n):
+            distances[source], predecessors[source] = dijkstra_all(cgraph, cgraph.names[source])
+        return cls(cgraph.names, distances, predecessors, graph_fingerprint(cgraph))
+
+    # Each file replaces the old one whole, so a table that other processes
+    # have memory-mapped is never overwritten under them
+    def save(self, directory):
+        for name, values in (('distances.npy', self.distances), ('predecessors.npy', self.predecessors)):
+            write_replacing(os.path.join(directory, name), lambda f: np.save(f, values))
+        # Written last, so a directory with a names file is always complete
+        write_replacing(os.path.join(directory, 'names.json'),
+                        lambda f: json.dump({'fingerprint': self.fingerprint, 'names': self.names}, f),
+                        mode='w')
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, 'names.json')) as f:
+            header = json.load(f)
+        distances = np.load(os.path.join(directory, 'distances.npy'), mmap_mode=mmap_mode)
+        predecessors = np.load(os.path.join(directory, 'predecessors.npy'), mmap_mode=mmap_mode)
+        return cls(header['names'], distances, predecessors, header['fingerprint'])
+
+    def distance(self, start, end):
+        return float(self.distances[self.index[start], self.index[end]])
+
+    # Repair the table after RoadNetwork.update_weights() changed the graph
+    # it was built from. Each row is a shortest-path tree, so only the rows
+    # a change can affect are repaired (see repair_tree()). A memory-mapped
+    # table is read into memory first. Returns the number of rows repaired.
+    def repair(self, cgraph, changes):
+        if not self.distances.flags.writeable:
+            self.distances = np.array(self.distances)
+            self.predecessors = np.array(self.predecessors)
+        repaired = 0
+        for source in range(len(self.names)):
+            distances, previous = self.distances[source], self.predecessors[source]
+            if any((new > old and previous[v] == u) or (new < old and distances[u] + new < distances[v])
+                   for u, v, old, new in changes):
+                repair_tree(cgraph, distances, previous, changes)
+                repaired += 1
+        self.fingerprint = graph_fingerprint(cgraph)
+        return repaired
+
+    def query(self, start, end):
+        source, target = self.index[start], self.index[end]
+        total_distance = float(self.distances[source, target])
+        row = self.predecessors[source]
+        if target == source or row[target] == -1:
+            return [], total_distance
+        path = [target]
+        while row[path[-1]] != -1:
+            path.append(int(row[path[-1]]))
+        return [self.names[node] for node in reversed(path)], total_distance
+
+# Function to load the distance table for a graph from the cache directory,
+# building it when no table exists for the graph's current contents
+def load_or_build_distance_matrix(graph, cache_dir=CACHE_DIR):
+    fingerprint = graph_fingerprint(graph)
+    directory = os.path.join(cache_dir, f"apsp-{fingerprint[:16]}")
+    if os.path.exists(os.path.join(directory, 'names.json')):
+        try:
+            matrix = DistanceMatrix.load(directory)
+            if matrix.fingerprint == fingerprint:
+                return matrix
+        except (OSError, ValueError, KeyError):
+            pass
+    matrix = DistanceMatrix.build(graph)
+    matrix.save(directory)
+    return matrix
+
+# Bounded LRU cache of route results. Entries belong to one graph version:
+# looking up or storing under a different version drops every entry first,
+# so a route computed before the graph changed is never returned.
+class RouteCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.version = None
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    def get(self, version, key):
+        self._check_version(version)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, version, key, value):
+        self._check_version(version)
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
+
+# Spatial index over city coordinates, for snapping arbitrary points (GPS
+# positions, map clicks) to the nearest cities without scanning every city.
+# Cities are bucketed in a uniform grid over an equirectangular projection (km)
+# and sorted by cell, so each cell is a slice of the arrays. A query scans
+# rings of cells outwards from its own until no unscanned cell can hold a
+# closer city. Distances are great-circle km.
+class SpatialIndex:
+    def __init__(self, coordinates, points_per_cell=2):
+        names = list(coordinates)
+        if not names:
+            raise ValueError("No coordinates to index")
+        lat = np.radians([coordinates[name][0] for name in names])
+        lng = np.radians([coordinates[name][1] for name in names])
+        # Project with the widest east-west scale in the data; elsewhere projected
+        # distances overstate great-circle ones by at most 1 / slack
+        self.scale = math.cos(np.abs(lat).min())
+        self.slack = math.cos(np.abs(lat).max()) / self.scale
+        x, y = self._project(lat, lng)
+        self.x0, self.y0 = x.min(), y.min()
+        area = max((x.max() - self.x0) * (y.max() - self.y0), 1e-9)
+        self.cell = max(math.sqrt(area * points_per_cell / len(names)), 1e-6)
+        self.width = int((x.max() - self.x0) // self.cell) + 1
+        self.height = int((y.max() - self.y0) // self.cell) + 1
+
+        cx, cy = self._cell(x, y)
+        cells = cy * self.width + cx
+        order = np.argsort(cells, kind='stable')
+        self.names = np.array(names, dtype=object)[order]
+        self.lat, self.lng = lat[order], lng[order]
+        self.starts = np.searchsorted(cells[order], np.arange(self.width * self.height + 1))
+
+    def _project(self, lat, lng):
+        return EARTH_RADIUS_KM * lng * self.scale, EARTH_RADIUS_KM * lat
+
+    # Grid cell of projected points, clamped to the grid
+    def _cell(self, x, y):
+        cx = np.clip(np.nan_to_num((x - self.x0) // self.cell), 0, self.width - 1).astype(np.int64)
+        cy = np.clip(np.nan_to_num((y - self.y0) // self.cell), 0, self.height - 1).astype(np.int64)
+        return cx, cy
+
+    # Cell offsets at Chebyshev distance r
+    @staticmethod
+    def _ring(r):
+        if r == 0:
+            return np.zeros(1, np.int64), np.zeros(1, np.int64)
+        side = np.arange(-r, r + 1)
+        inner = side[1:-1]
+        dx = np.concatenate([side, side, np.full(len(inner), -r), np.full(len(inner), r)])
+        dy = np.concatenate([np.full(len(side), -r), np.full(len(side), r), inner, inner])
+        return dx, dy
+
+    # Ids of the cities in ring r around cells (cx, cy) (arrays, one per query),
+    # with the position of the query each one belongs to
+    def _ring_members(self, cx, cy, r):
+        dx, dy = self._ring(r)
+        owners = np.repeat(np.arange(len(cx)), len(dx))
+        xs, ys = np.repeat(cx, len(dx)) + np.tile(dx, len(cx)), np.repeat(cy, len(dx)) + np.tile(dy, len(cx))
+        valid = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        owners, cells = owners[valid], ys[valid] * self.width + xs[valid]
+        starts = self.starts[cells]
+        counts = self.starts[cells + 1] - starts
+        ids = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return np.repeat(owners, counts), ids
+
+    def _distances(self, lat, lng, ids):
+        h = (np.sin((self.lat[ids] - lat) / 2) ** 2
+             + np.cos(lat) * np.cos(self.lat[ids]) * np.sin((self.lng[ids] - lng) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+    # Scan rings around one point until done(distances, bound) says so, where
+    # bound is the least distance of any city not scanned yet
+    def _scan(self, lat, lng, done):
+        lat, lng = np.radians([lat]), np.radians([lng])
+        cx, cy = self._cell(*self._project(lat, lng))
+        ids, distances = np.zeros(0, np.int64), np.zeros(0)
+        for r in range(max(self.width, self.height) + 1):
+            _, ring_ids = self._ring_members(cx, cy, r)
+            ids = np.concatenate([ids, ring_ids])
+            distances = np.concatenate([distances, self._distances(lat, lng, ring_ids)])
+            if done(distances, r * self.cell * self.slack):
+                break
+        order = np.argsort(distances, kind='stable')
+        return [(self.names[ids[i]], float(distances[i])) for i in order]
+
+    # The k cities nearest to a point, as [(city, km), ...] closest first
+    def nearest(self, lat, lng, k=1):
+        k = min(k, len(self.names))
+        return self._scan(lat, lng, lambda distances, bound: len(distances) >= k
+                          and np.partition(distances, k - 1)[k - 1] <= bound)[:k]
+
+    # Every city within radius km of a point, as [(city, km), ...] closest first
+    def within(self, lat, lng, radius):
+        found = self._scan(lat, lng, lambda distances, bound: bound > radius)
+        return [(city, km) for city, km in found if km <= radius]
+
+    # Nearest city to each of many points at once (sequences or arrays of
+    # latitudes and longitudes). All points scan the same ring together, and
+    # points drop out once nothing closer can remain; points are taken in
+    # chunks to bound memory. Returns arrays of city names and distances in km.
+    def snap(self, lats, lngs, chunk_size=100000):
+        lat, lng = np.radians(np.asarray(lats, float)), np.radians(np.asarray(lngs, float))
+        nearest, best = np.zeros(len(lat), np.int64), np.zeros(len(lat))
+        for i in range(0, len(lat), chunk_size):
+            nearest[i:i + chunk_size], best[i:i + chunk_size] = self._snap(lat[i:i + chunk_size],
+                                                                           lng[i:i + chunk_size])
+        return self.names[nearest], best
+
+    def _snap(self, lat, lng):
+        cx, cy = self._cell(*self._project(lat, lng))
+        best = np.full(len(lat), np.inf)
+        nearest = np.zeros(len(lat), np.int64)
+        active = np.arange(len(lat))
+        r = 0
+        while active.size and r <= max(self.width, self.height):
+            owners, ids = self._ring_members(cx[active], cy[active], r)
+            if ids.size:
+                queries = active[owners]
+                distances = self._distances(lat[queries], lng[queries], ids)
+                # Candidates come grouped by query, so take each group's closest
+                starts = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]])
+                closest = np.minimum.reduceat(distances, starts)
+                hits = np.flatnonzero(distances == np.repeat(closest, np.diff(np.r_[starts, len(queries)])))
+                hits = hits[np.r_[True, queries[hits[1:]] != queries[hits[:-1]]]]
+                queries, ids, distances = queries[hits], ids[hits], distances[hits]
+                closer = distances < best[queries]
+                best[queries[closer]] = distances[closer]
+                nearest[queries[closer]] = ids[closer]
+            active = active[best[active] > r * self.cell * self.slack]
+            r += 1
+        return nearest, best
@@ -1,10 +1,18 @@
+import os
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
+from branca.colormap import LinearColormap
 import pandas as pd
 import networkx as nx
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
+from matplotlib.collections import LineCollection
+from PIL import Image, ImageDraw
+from route_engine import (CACHE_DIR, DATA_DIR, GRAPHS_DIR, STATS_HOOKS, GraphStore, RouteCache,
+                          SpatialIndex, alternative_routes, astar, bidirectional_dijkstra, compile_graph,
+                          dijkstra_heap, emit_stats, hierarchy_path, load_hierarchy, load_network,
+                          plan_tour, reachable, time_dependent_route, timed)
 
 # Set page configuration
 st.set_page_config(
@@ -82,93 +90,290 @@ if 'graph' not in st.session_state:
     st.session_state.graph = nx.Graph()
 if 'positions' not in st.session_state:
     st.session_state.positions = {}
-if 'saved_graphs' not in st.session_state:
-    st.session_state.saved_graphs = {}
-
-# Function to implement Dijkstra's algorithm
-def dijkstra(graph, start, end):
-    distances = {node: float('infinity') for node in graph}
-    previous_nodes = {node: None for node in graph}
-    distances[start] = 0
-    nodes = list(graph)
-
-    while nodes:
-        current_node = min(nodes, key=lambda node: distances[node])
-        nodes.remove(current_node)
-
-        if distances[current_node] == float('infinity'):
-            break
-
-        for neighbor, weight in graph[current_node].items():
-            alternative_route = distances[current_node] + weight
-            if alternative_route < distances[neighbor]:
-                distances[neighbor] = alternative_route
-                previous_nodes[neighbor] = current_node
-
-    path, current_node = [], end
-    total_distance = distances[end]
-    while previous_nodes[current_node] is not None:
-        path.insert(0, current_node)
-        current_node = previous_nodes[current_node]
-    if path:
-        path.insert(0, current_node)
-    return path, total_distance
-
-# Function to draw the graph using NetworkX
+# Bumped on every change to st.session_state.graph (see bump_graph_version)
+if 'graph_version' not in st.session_state:
+    st.session_state.graph_version = 0
+if 'route_cache' not in st.session_state:
+    st.session_state.route_cache = RouteCache()
+if 'city_route_cache' not in st.session_state:
+    st.session_state.city_route_cache = RouteCache()
+
+# Function to get the built-in road network, loaded once per process and shared
+# by every session
+@st.cache_resource(show_spinner="Loading road network...")
+def get_network(directory=DATA_DIR):
+    return load_network(directory)
+
+# Graphs with more nodes than this are drawn without node and edge labels
+LABEL_LIMIT = 100
+
+# Function to get the spatial index of a network's cities, built once per
+# network version and shared by every session
+@st.cache_resource
+def get_spatial_index(version, _coordinates):
+    return SpatialIndex(_coordinates)
+
+# Function to get the store of saved graphs, shared by every session
+@st.cache_resource
+def get_graph_store(directory=GRAPHS_DIR):
+    return GraphStore(directory)
+
+# Function to get st.session_state.graph compiled for searching, compiled at
+# most once per graph version (a loaded graph arrives already compiled)
+def get_compact_graph():
+    version, cgraph = st.session_state.get('compact_graph', (None, None))
+    if version != st.session_state.graph_version:
+        cgraph = compile_graph(st.session_state.graph)
+        st.session_state.compact_graph = (st.session_state.graph_version, cgraph)
+    return cgraph
+
+# Function to get the precomputed contraction hierarchy of a network, or None
+# when none has been built (see build_hierarchy.py). It is only loaded when
+# first needed, and the file is read once per process (again if it is rebuilt)
+# and shared by all sessions.
+def get_hierarchy(fingerprint):
+    path = hierarchy_path(fingerprint, CACHE_DIR)
+    if not os.path.exists(path):
+        return None
+    return read_hierarchy(path, os.path.getmtime(path), fingerprint)
+
+@st.cache_resource(show_spinner="Loading route hierarchy...")
+def read_hierarchy(path, modified, fingerprint):
+    return load_hierarchy(path, fingerprint)
+
+# Function to build the static part of the route map once per network version: the map
+# center and a single GeoJSON collection holding every city and every road.
+# Roads in both directions are drawn once, with both travel times in the tooltip.
+@st.cache_data(show_spinner=False)
+def base_map_layer(version, _graph, _coordinates):
+    center = [sum(coord[0] for coord in _coordinates.values()) / len(_coordinates),
+              sum(coord[1] for coord in _coordinates.values()) / len(_coordinates)]
+    features = []
+    for node, (lat, lng) in _coordinates.items():
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lng, lat]},
+            'properties': {'name': node},
+        })
+    for node in _graph:
+        for neighbor, weight in _graph[node].items():
+            if node not in _coordinates or neighbor not in _coordinates:
+                continue
+            back = _graph[neighbor].get(node) if neighbor in _graph else None
+            if back is not None and neighbor < node:
+                continue
+            name = (f"{node} ↔ {neighbor} ({weight:g} h / {back:g} h)" if back is not None
+                    else f"{node} to {neighbor} ({weight:g} h)")
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': [
+                    [_coordinates[node][1], _coordinates[node][0]],
+                    [_coordinates[neighbor][1], _coordinates[neighbor][0]],
+                ]},
+                'properties': {'name': name},
+            })
+    return center, {'type': 'FeatureCollection', 'features': features}
+
+# Function to create a map showing the cached road network layer
+def build_base_map(base_layer):
+    center, geojson = base_layer
+    m = folium.Map(location=center, zoom_start=5, control_scale=True)
+    folium.GeoJson(
+        geojson,
+        name="Road network",
+        style_function=lambda feature: {'color': 'gray', 'weight': 2, 'opacity': 0.5},
+        marker=folium.Marker(icon=folium.Icon(color='blue', icon='info-sign')),
+        tooltip=folium.GeoJsonTooltip(fields=['name'], labels=False),
+    ).add_to(m)
+    return m
+
+# Colors of the alternative routes drawn under the optimal (red) one
+ALTERNATIVE_COLORS = ['blue', 'purple', 'green', 'orange']
+
+# Function to build the route map, with any alternatives drawn under the optimal route
+def build_route_map(base_layer, coordinates, path, start_node, end_node, alternatives=()):
+    m = build_base_map(base_layer)
+
+    for node in {start_node, end_node}:
+        folium.Marker(
+            coordinates[node],
+            popup=node,
+            icon=folium.Icon(color='red', icon='flag'),
+            tooltip=node
+        ).add_to(m)
+
+    for i, (alternative, hours) in enumerate(alternatives):
+        folium.PolyLine(
+            locations=[coordinates[node] for node in alternative],
+            color=ALTERNATIVE_COLORS[i % len(ALTERNATIVE_COLORS)],
+            weight=4,
+            opacity=0.6,
+            dash_array="8",
+            tooltip=f"Route {i + 2} ({hours:g} hours)"
+        ).add_to(m)
+
+    folium.PolyLine(
+        locations=[coordinates[node] for node in path],
+        color="red",
+        weight=4,
+        opacity=0.8,
+        tooltip="Optimal Route"
+    ).add_to(m)
+    return m
+
+# Colors of the areas reached from each source when there are several
+SOURCE_COLORS = ['blue', 'green', 'purple', 'orange', 'darkred', 'cadetblue']
+
+# Function to build the reachability map: the cities reached (as returned by
+# reachable()) and the roads of their fastest routes, shaded by travel time
+# for a single source or colored by nearest source for several
+def build_reachability_map(base_layer, coordinates, reached, sources, budget):
+    m = build_base_map(base_layer)
+    colormap = LinearColormap(['green', 'yellow', 'red'], vmin=0,
+                              vmax=max(max(hours for hours, _, _ in reached.values()), 1),
+                              caption="Travel time (hours)")
+    layer = folium.FeatureGroup(name=f"Reachable within {budget:g} hours")
+    for city, (hours, source, previous) in reached.items():
+        if city not in coordinates:
+            continue
+        if len(sources) == 1:
+            color, tooltip = colormap(hours), f"{city}: {hours:g} hours"
+        else:
+            color = SOURCE_COLORS[sources.index(source) % len(SOURCE_COLORS)]
+            tooltip = f"{city}: {hours:g} hours from {source}"
+        if previous is not None and previous in coordinates:
+            folium.PolyLine([coordinates[previous], coordinates[city]], color=color, weight=6,
+                            opacity=0.6).add_to(layer)
+        folium.CircleMarker(coordinates[city], radius=10, color=color, fill=True, fill_color=color,
+                            fill_opacity=0.5, tooltip=tooltip).add_to(layer)
+    layer.add_to(m)
+
+    for source in sources:
+        folium.Marker(
+            coordinates[source],
+            popup=source,
+            icon=folium.Icon(color='red', icon='home'),
+            tooltip=source
+        ).add_to(m)
+    if len(sources) == 1:
+        colormap.add_to(m)
+    folium.LayerControl().add_to(m)
+    return m
+
+# Function to format an hour value (8.5) as a clock time (08:30)
+def format_hour(hour):
+    minutes = round(hour * 60) % (24 * 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+# Function to show a query's statistics in a collapsible panel
+def show_search_stats(stats):
+    with st.expander("📈 Query statistics"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Nodes settled", stats.get('settled', 0))
+        col2.metric("Edges relaxed", stats.get('relaxed', 0))
+        col3.metric("Heap pushes", stats.get('pushes', 0))
+        if 'dijkstra_settled' in stats:
+            st.caption(f"Plain Dijkstra settles {stats['dijkstra_settled']} nodes for this query")
+        if stats.get('cached'):
+            st.caption("Served from the route cache")
+        st.table(pd.DataFrame([
+            {'Stage': 'Search', 'Time (ms)': round(stats.get('search_ms', 0), 3)},
+            {'Stage': 'Map build (folium)', 'Time (ms)': round(stats.get('map_ms', 0), 3)},
+            {'Stage': 'Map render (st_folium)', 'Time (ms)': round(stats.get('map_render_ms', 0), 3)},
+            {'Stage': 'Table render (st.table)', 'Time (ms)': round(stats.get('table_render_ms', 0), 3)},
+        ]))
+
+# Function to render the graph, without any path, to an image at most once per
+# graph version. Every edge goes into a single LineCollection and every node
+# into a single scatter; labels are only drawn for graphs of up to LABEL_LIMIT
+# nodes. Returns the image and the affine transform (3x3 rows) from graph to
+# pixel coordinates, so paths can be drawn on top without redrawing the graph.
+def graph_base_image():
+    version, image, transform = st.session_state.get('graph_image', (None, None, None))
+    if version == st.session_state.graph_version:
+        return image, transform
+
+    graph, pos = st.session_state.graph, st.session_state.positions
+    fig, ax = plt.subplots(figsize=(10, 8))
+    xs = [pos[node][0] for node in graph.nodes]
+    ys = [pos[node][1] for node in graph.nodes]
+    limits = []
+    for values in (xs, ys):
+        low, high = (min(values), max(values)) if values else (0, 10)
+        margin = max(1, (high - low) * 0.05)
+        limits.append((low - margin, high + margin))
+    labelled = len(xs) <= LABEL_LIMIT
+
+    ax.add_collection(LineCollection([(pos[u], pos[v]) for u, v in graph.edges],
+                                     colors='black', linewidths=1, zorder=1))
+    ax.scatter(xs, ys, s=700 if labelled else 12, c='lightblue', zorder=2)
+    if labelled:
+        nx.draw_networkx_labels(graph, pos, ax=ax, font_size=10, font_weight='bold')
+        nx.draw_networkx_edge_labels(graph, pos, ax=ax,
+                                     edge_labels=nx.get_edge_attributes(graph, 'weight'))
+
+    (x0, x1), (y0, y1) = limits
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    ax.grid(True, linestyle='--', alpha=0.7)
+    ax.add_patch(patches.Rectangle((x0, y0), x1 - x0, y1 - y0, linewidth=2,
+                                   edgecolor='black', facecolor='none'))
+    fig.canvas.draw()
+    image = Image.frombuffer('RGBA', fig.canvas.get_width_height(), fig.canvas.buffer_rgba()).copy()
+    transform = ax.transData.get_matrix().tolist()
+    plt.close(fig)
+    st.session_state.graph_image = (st.session_state.graph_version, image, transform)
+    return image, transform
+
+# Function to show the graph, highlighting a path (orange, last edge red) by
+# drawing it over the cached graph image
 def draw_graph(path=None):
-    plt.figure(figsize=(10, 8))
-    pos = st.session_state.positions
-    nx.draw(st.session_state.graph, pos, with_labels=True, 
-            node_size=700, 
-            node_color='lightblue',
-            font_size=10,
-            font_weight='bold')
+    image, transform = graph_base_image()
+    if path:
+        image = image.copy()
+        draw = ImageDraw.Draw(image)
+        (a, b, c), (d, e, f), _ = transform
 
-    edge_labels = nx.get_edge_attributes(st.session_state.graph, 'weight')
-    nx.draw_networkx_edge_labels(st.session_state.graph, pos, edge_labels=edge_labels)
+        def pixel(node):
+            x, y = st.session_state.positions[node]
+            # Image rows count from the top, display coordinates from the bottom
+            return a * x + b * y + c, image.height - (d * x + e * y + f)
 
-    if path:
         path_edges = list(zip(path[:-1], path[1:]))
-        nx.draw_networkx_edges(st.session_state.graph, pos, edgelist=path_edges, 
-                             edge_color='orange', width=2)
-        if len(path_edges) > 0:
-            nx.draw_networkx_edges(st.session_state.graph, pos, 
-                                 edgelist=[path_edges[-1]], 
-                                 edge_color='red', width=3)
-
-    plt.xlim(-1, 11)
-    plt.ylim(-1, 11)
-    plt.grid(True, linestyle='--', alpha=0.7)
-    border = patches.Rectangle((-1, -1), 12, 12, linewidth=2, 
-                             edgecolor='black', facecolor='none')
-    plt.gca().add_patch(border)
-    st.pyplot(plt)
-    plt.close()
-
-# Function to save the current graph
+        for u, v in path_edges:
+            draw.line([pixel(u), pixel(v)], fill='orange', width=3)
+        if path_edges:
+            draw.line([pixel(node) for node in path_edges[-1]], fill='red', width=4)
+    st.image(image)
+
+# Function to mark st.session_state.graph as changed, invalidating cached routes
+def bump_graph_version():
+    st.session_state.graph_version += 1
+
+# Function to save the current graph to the graph store
 def save_graph(graph_name):
-    graph_data = {
-        'nodes': list(st.session_state.graph.nodes),
-        'edges': [(u, v, d['weight']) for u, v, d in st.session_state.graph.edges(data=True)],
-        'positions': {node: st.session_state.positions[node] for node in st.session_state.graph.nodes}
-    }
-    st.session_state.saved_graphs[graph_name] = graph_data
+    get_graph_store().save(graph_name, st.session_state.graph, st.session_state.positions)
     st.success(f"✅ Graph '{graph_name}' saved successfully!")
 
-# Function to load a saved graph
+# Function to load a saved graph from the graph store
 def load_graph(graph_name):
-    if graph_name in st.session_state.saved_graphs:
-        graph_data = st.session_state.saved_graphs[graph_name]
-        st.session_state.graph.clear()
-        st.session_state.positions.clear()
-        
-        for node in graph_data['nodes']:
-            st.session_state.graph.add_node(node)
-            st.session_state.positions[node] = graph_data['positions'].get(node, (0, 0))
-        
-        for u, v, weight in graph_data['edges']:
-            st.session_state.graph.add_edge(u, v, weight=weight)
-        
+    store = get_graph_store()
+    if graph_name in store:
+        cgraph, positions, directed = store.load(graph_name)
+        # The playground edits a NetworkX graph, so it is rebuilt from the stored
+        # one. An undirected graph stores each edge both ways; it is added once.
+        graph = nx.DiGraph() if directed else nx.Graph()
+        graph.add_nodes_from(cgraph.names)
+        graph.add_weighted_edges_from(
+            (cgraph.names[node], cgraph.names[cgraph.targets[k]], cgraph.weights[k])
+            for node in range(len(cgraph))
+            for k in range(cgraph.offsets[node], cgraph.offsets[node + 1])
+            if directed or node <= cgraph.targets[k])
+        st.session_state.graph = graph
+        st.session_state.positions = {**dict.fromkeys(cgraph.names, (0, 0)), **positions}
+        bump_graph_version()
+        st.session_state.compact_graph = (st.session_state.graph_version, cgraph)
+
         st.success(f"✅ Graph '{graph_name}' loaded successfully!")
     else:
         st.error(f"❌ Graph '{graph_name}' does not exist.")
@@ -176,7 +381,8 @@ def load_graph(graph_name):
 # Streamlit app
 def main():
     # Create tabs
-    tabs = st.tabs(["🗺 Indian Cities Route Optimizer", "📈 Dijkstra's Visualization", "ℹ️ About"])
+    tabs = st.tabs(["🗺 Indian Cities Route Optimizer", "🚚 Multi-Stop Tour", "⏱ Reachability",
+                    "📈 Dijkstra's Visualization", "ℹ️ About"])
 
     with tabs[0]:
         # Header
@@ -191,165 +397,164 @@ def main():
             3. Click 'Find Shortest Path' to see the optimal route
             """)
 
-        # Predefined graph with coordinates and distances (in approximate hours of travel time)
-        graph = {
-            'Mumbai': {'Pune': 3, 'Nashik': 4, 'Ahmedabad': 8, 'Surat': 5},
-            'Pune': {'Mumbai': 3, 'Nashik': 4, 'Bangalore': 12, 'Hyderabad': 9},
-            'Nashik': {'Mumbai': 4, 'Pune': 4, 'Ahmedabad': 7, 'Indore': 5},
-            'Ahmedabad': {'Mumbai': 8, 'Nashik': 7, 'Delhi': 12, 'Surat': 6},
-            'Delhi': {'Ahmedabad': 12, 'Jaipur': 4, 'Lucknow': 7, 'Chandigarh': 5},
-            'Bangalore': {'Pune': 12, 'Chennai': 6, 'Hyderabad': 8, 'Mysore': 3},
-            'Chennai': {'Bangalore': 6, 'Hyderabad': 8, 'Visakhapatnam': 12},
-            'Hyderabad': {'Bangalore': 8, 'Chennai': 8, 'Nagpur': 10, 'Pune': 9},
-            'Jaipur': {'Delhi': 4, 'Ahmedabad': 8, 'Agra': 4},
-            'Lucknow': {'Delhi': 7, 'Nagpur': 12, 'Patna': 6},
-            'Nagpur': {'Hyderabad': 10, 'Lucknow': 12, 'Bhopal': 5},
-            'Kolkata': {'Bhubaneswar': 6, 'Patna': 8, 'Ranchi': 7},
-            'Bhubaneswar': {'Kolkata': 6, 'Visakhapatnam': 7},
-            'Visakhapatnam': {'Bhubaneswar': 7, 'Hyderabad': 9, 'Chennai': 12},
-            'Patna': {'Kolkata': 8, 'Lucknow': 10, 'Ranchi': 4},
-            'Surat': {'Mumbai': 5, 'Ahmedabad': 6},
-            'Indore': {'Bhopal': 3, 'Ahmedabad': 7, 'Nashik': 5},
-            'Bhopal': {'Indore': 3, 'Nagpur': 5, 'Gwalior': 6},
-            'Chandigarh': {'Delhi': 5, 'Amritsar': 4},
-            'Mysore': {'Bangalore': 3, 'Coimbatore': 6},
-            'Agra': {'Jaipur': 4, 'Delhi': 3},
-            'Ranchi': {'Kolkata': 7, 'Patna': 4},
-            'Amritsar': {'Chandigarh': 4, 'Jammu': 6},
-            'Coimbatore': {'Mysore': 6, 'Chennai': 8},
-            'Gwalior': {'Bhopal': 6, 'Agra': 3},
-            'Jammu': {'Amritsar': 6},
-            # Additional cities
-            'Kanpur': {'Lucknow': 2, 'Delhi': 8},
-            'Vadodara': {'Ahmedabad': 2, 'Surat': 4},
-            'Ludhiana': {'Chandigarh': 3, 'Amritsar': 3},
-            'Madurai': {'Chennai': 8, 'Coimbatore': 4},
-            'Varanasi': {'Lucknow': 4, 'Patna': 3},
-            'Meerut': {'Delhi': 2, 'Agra': 4},
-            'Rajkot': {'Ahmedabad': 4, 'Surat': 5},
-            'Jodhpur': {'Jaipur': 5, 'Ahmedabad': 9},
-            'Raipur': {'Nagpur': 5, 'Bhubaneswar': 8},
-            'Kochi': {'Coimbatore': 5, 'Bangalore': 10},
-            'Guwahati': {'Kolkata': 10, 'Shillong': 3},
-            'Shillong': {'Guwahati': 3},
-            'Thiruvananthapuram': {'Kochi': 4, 'Madurai': 6}
-        }
-
-        coordinates = {
-            'Mumbai': (19.0760, 72.8777),
-            'Pune': (18.5204, 73.8567),
-            'Nashik': (20.0059, 73.7897),
-            'Ahmedabad': (23.0225, 72.5714),
-            'Delhi': (28.6139, 77.2090),
-            'Bangalore': (12.9716, 77.5946),
-            'Chennai': (13.0827, 80.2707),
-            'Hyderabad': (17.3850, 78.4867),
-            'Jaipur': (26.9124, 75.7873),
-            'Lucknow': (26.8467, 80.9462),
-            'Nagpur': (21.1458, 79.0882),
-            'Kolkata': (22.5726, 88.3639),
-            'Bhubaneswar': (20.2961, 85.8245),
-            'Visakhapatnam': (17.6868, 83.2185),
-            'Patna': (25.5941, 85.1376),
-            'Surat': (21.1702, 72.8311),
-            'Indore': (22.7196, 75.8577),
-            'Bhopal': (23.2599, 77.4126),
-            'Chandigarh': (30.7333, 76.7794),
-            'Mysore': (12.2958, 76.6394),
-            'Agra': (27.1767, 78.0081),
-            'Ranchi': (23.3441, 85.3096),
-            'Amritsar': (31.6340, 74.8723),
-            'Coimbatore': (11.0168, 76.9558),
-            'Gwalior': (26.2183, 78.1828),
-            'Jammu': (32.7266, 74.8570),
-            # Additional cities
-            'Kanpur': (26.4499, 80.3319),
-            'Vadodara': (22.3072, 73.1812),
-            'Ludhiana': (30.9010, 75.8573),
-            'Madurai': (9.9252, 78.1198),
-            'Varanasi': (25.3176, 82.9739),
-            'Meerut': (28.9845, 77.7064),
-            'Rajkot': (22.3039, 70.8022),
-            'Jodhpur': (26.2389, 73.0243),
-            'Raipur': (21.2514, 81.6296),
-            'Kochi': (9.9312, 76.2673),
-            'Guwahati': (26.1445, 91.7362),
-            'Shillong': (25.5788, 91.8933),
-            'Thiruvananthapuram': (8.5241, 76.9366)
-        }
+        # Road network with coordinates and distances (in approximate hours of travel time)
+        network = get_network()
+        graph, coordinates = network.graph, network.coordinates
+        compact_graph = network.compact
+        if network.warnings:
+            with st.expander(f"⚠️ Road network notes ({len(network.warnings)})"):
+                st.markdown("\n".join(f"- {warning}" for warning in network.warnings))
+
+        # Clicking the map snaps to the nearest city and selects it below. The map
+        # is only drawn when asked for, so it doesn't slow down every rerun.
+        if st.checkbox("📍 Pick cities on the map"):
+            pick = st.radio("Clicking the map sets the:", ["Starting city", "Destination city"],
+                            horizontal=True)
+            clicked = st_folium(build_base_map(base_map_layer(network.version, graph, coordinates)),
+                                width=1200, height=400, returned_objects=["last_clicked"],
+                                key="pick_map")
+            point = (clicked or {}).get("last_clicked")
+            if point and point != st.session_state.get('last_pick'):
+                st.session_state.last_pick = point
+                city, km = get_spatial_index(network.version, coordinates).nearest(
+                    point['lat'], point['lng'])[0]
+                st.session_state['route_start' if pick == "Starting city" else 'route_end'] = city
+                st.caption(f"📍 Snapped to {city} ({km:.0f} km from the click)")
 
         # Create two columns for input
         col1, col2 = st.columns(2)
 
         with col1:
-            start_node = st.selectbox("🚩 Select starting city:", list(graph.keys()))
+            start_node = st.selectbox("🚩 Select starting city:", list(graph.keys()), key="route_start")
             
         with col2:
-            end_node = st.selectbox("🏁 Select destination city:", list(graph.keys()))
-
-        if st.button("🔍 Find Shortest Path"):
-            path, total_distance = dijkstra(graph, start_node, end_node)
+            end_node = st.selectbox("🏁 Select destination city:", list(graph.keys()), key="route_end")
+
+        algorithms = ["Dijkstra", "A* (great-circle heuristic)", "Bidirectional Dijkstra",
+                      "Contraction Hierarchies"]
+        if network.profiles is not None:
+            algorithms.append("Time-dependent (departure time)")
+        algorithm = st.radio("🧭 Search algorithm:", algorithms, horizontal=True)
+        hierarchy = None
+        if algorithm == "Contraction Hierarchies":
+            hierarchy = get_hierarchy(network.fingerprint)
+            if hierarchy is None:
+                st.warning("No contraction hierarchy has been built for this road network. Build it "
+                           "once with `python build_hierarchy.py`, or choose another algorithm.")
+        departure = None
+        if algorithm == "Time-dependent (departure time)":
+            departure = st.slider("🕗 Departure time (hour of day):", 0.0, 23.5, 8.0, step=0.5)
+        route_count, max_overlap = 1, None
+        if departure is None:
+            col1, col2 = st.columns(2)
+            with col1:
+                route_count = st.slider("🔀 Routes to show:", 1, 5, 1)
+            if route_count > 1:
+                with col2:
+                    max_overlap = st.slider("Max shared travel time between routes (%):",
+                                            10, 90, 50, step=10)
+        collect_stats = st.checkbox("📈 Collect query statistics") or bool(STATS_HOOKS)
+
+        if st.button("🔍 Find Shortest Path",
+                     disabled=algorithm == "Contraction Hierarchies" and hierarchy is None):
+            search_stats = {} if collect_stats else None
+            # The built-in network's version is its fingerprint
+            route_cache = st.session_state.city_route_cache
+            cache_key = (algorithm, start_node, end_node, departure, route_count, max_overlap)
+            cached = route_cache.get(network.fingerprint, cache_key)
+            alternatives = []
+            if cached is not None:
+                path, total_distance, cached_stats, alternatives = cached
+                if collect_stats:
+                    search_stats = dict(cached_stats or {}, cached=True, search_ms=0)
+            elif algorithm == "Dijkstra":
+                path, total_distance = dijkstra_heap(compact_graph, start_node, end_node,
+                                                     stats=search_stats)
+            elif algorithm == "Bidirectional Dijkstra":
+                path, total_distance = bidirectional_dijkstra(compact_graph, start_node, end_node,
+                                                              stats=search_stats)
+            elif algorithm == "Contraction Hierarchies":
+                path, total_distance = hierarchy.query(start_node, end_node, stats=search_stats)
+            elif departure is not None:
+                path, total_distance, _ = time_dependent_route(network.profiles, start_node, end_node,
+                                                               departure, coordinates,
+                                                               max_speed=network.max_speed,
+                                                               stats=search_stats)
+            else:
+                path, total_distance = astar(compact_graph, start_node, end_node, coordinates,
+                                             max_speed=network.max_speed, stats=search_stats)
+            if cached is None:
+                if collect_stats and algorithm != "Dijkstra":
+                    dijkstra_stats = {}
+                    dijkstra_heap(compact_graph, start_node, end_node, stats=dijkstra_stats)
+                    search_stats['dijkstra_settled'] = dijkstra_stats['settled']
+                if route_count > 1 and path:
+                    with timed(search_stats, 'alternatives_ms'):
+                        routes = alternative_routes(compact_graph, start_node, end_node,
+                                                    k=route_count, max_overlap=max_overlap / 100)
+                    # On a tie the fastest route found may not be the algorithm's own, so
+                    # only the algorithm's route is dropped, wherever it comes
+                    alternatives = [route for route in routes if route[0] != path][:route_count - 1]
+                route_cache.put(network.fingerprint, cache_key,
+                                (path, total_distance, search_stats and dict(search_stats),
+                                 alternatives))
             
             if path:
                 # Success message with path and estimated time
                 st.success(f"📍 Optimal Route: {' → '.join(path)}")
-                st.info(f"⏱ Estimated travel time: {total_distance} hours")
-
-                # Create a map
-                center_lat = sum(coord[0] for coord in coordinates.values()) / len(coordinates)
-                center_lng = sum(coord[1] for coord in coordinates.values()) / len(coordinates)
-                m = folium.Map(location=[center_lat, center_lng], zoom_start=5, control_scale=True)
-
-                # Add cities to the map
-                for node, coord in coordinates.items():
-                    color = 'red' if node in [start_node, end_node] else 'blue'
-                    icon = 'flag' if node in [start_node, end_node] else 'info-sign'
-                    folium.Marker(
-                        coord,
-                        popup=node,
-                        icon=folium.Icon(color=color, icon=icon),
-                        tooltip=node
-                    ).add_to(m)
-
-                # Add all routes to the map
-                for node, neighbors in graph.items():
-                    for neighbor in neighbors:
-                        folium.PolyLine(
-                            locations=[coordinates[node], coordinates[neighbor]],
-                            color="gray",
-                            weight=2,
-                            opacity=0.5,
-                            tooltip=f"{node} to {neighbor}"
-                        ).add_to(m)
-
-                # Highlight the optimal path
-                path_coords = [coordinates[node] for node in path]
-                folium.PolyLine(
-                    locations=path_coords,
-                    color="red",
-                    weight=4,
-                    opacity=0.8,
-                    tooltip="Optimal Route"
-                ).add_to(m)
+                st.info(f"⏱ Estimated travel time: {total_distance:g} hours")
+                if departure is not None:
+                    arrival = departure + total_distance
+                    st.caption(f"Leaving at {format_hour(departure)}, arriving at "
+                               f"{format_hour(arrival)}"
+                               + (f" (+{int(arrival // 24)} day)" if arrival >= 24 else ""))
+                for i, (alternative, hours) in enumerate(alternatives):
+                    st.caption(f"Route {i + 2} ({ALTERNATIVE_COLORS[i % len(ALTERNATIVE_COLORS)]}, "
+                               f"+{hours - total_distance:g} h): {' → '.join(alternative)}")
+                if route_count > 1 and not alternatives:
+                    st.caption("No alternative route within the overlap limit.")
+
+                # Create a map on top of the cached base layer
+                with timed(search_stats, 'map_ms'):
+                    base_layer = base_map_layer(network.version, graph, coordinates)
+                    m = build_route_map(base_layer, coordinates, path, start_node, end_node,
+                                        alternatives)
 
                 # Display the map
-                st_folium(m, width=1200, height=600, returned_objects=[])
+                with timed(search_stats, 'map_render_ms'):
+                    st_folium(m, width=1200, height=600, returned_objects=[])
 
                 # Display additional information
                 st.markdown("### 📊 Route Details")
                 route_details = []
-                for i in range(len(path)-1):
-                    route_details.append({
-                        'From': path[i],
-                        'To': path[i+1],
-                        'Time (hours)': graph[path[i]][path[i+1]]
-                    })
+                leg_times = (network.profiles.leg_times(path, departure) if departure is not None
+                             else [graph[a][b] for a, b in zip(path[:-1], path[1:])])
+                routes = [(path, leg_times)] + [
+                    (alternative, [graph[a][b] for a, b in zip(alternative[:-1], alternative[1:])])
+                    for alternative, _ in alternatives]
+                for number, (route, times) in enumerate(routes, start=1):
+                    for i in range(len(route)-1):
+                        row = {'Route': number} if alternatives else {}
+                        row.update({
+                            'From': route[i],
+                            'To': route[i+1],
+                            'Time (hours)': round(times[i], 2)
+                        })
+                        route_details.append(row)
                 
                 if route_details:
-                    st.table(pd.DataFrame(route_details))
+                    with timed(search_stats, 'table_render_ms'):
+                        st.table(pd.DataFrame(route_details))
             else:
                 st.error("No path found between selected cities")
 
+            # Queries that find no route are reported too
+            if collect_stats:
+                search_stats.update(algorithm=algorithm, start=start_node, end=end_node,
+                                    found=bool(path))
+                emit_stats(search_stats)
+                show_search_stats(search_stats)
+
         # Footer
         st.markdown("---")
         st.markdown("""
@@ -360,6 +565,101 @@ def main():
         """, unsafe_allow_html=True)
 
     with tabs[1]:
+        st.markdown("<h1 class='title'>🚚 Multi-Stop Tour</h1>", unsafe_allow_html=True)
+        with st.expander("❗ How to use:"):
+            st.markdown("""
+            1. Select the depot the tour starts from
+            2. Select the cities to visit
+            3. Click 'Plan Tour' to get the fastest order found and its roads
+            """)
+
+        network = get_network()
+        graph, coordinates = network.graph, network.coordinates
+
+        depot = st.selectbox("🏠 Depot:", list(graph.keys()), key="tour_depot")
+        stops = st.multiselect("📦 Cities to visit:", [city for city in graph if city != depot])
+        col1, col2 = st.columns(2)
+        with col1:
+            round_trip = st.checkbox("🔁 Return to the depot", value=True)
+        with col2:
+            time_limit = st.slider("⏳ Optimization time limit (seconds):", 0.1, 5.0, 1.0, step=0.1)
+
+        if st.button("🚚 Plan Tour", disabled=not stops):
+            tour_stats = {}
+            try:
+                # Without a hierarchy the stop matrix comes from one-to-many searches
+                order, legs, total = plan_tour(network.compact, [depot] + stops, round_trip,
+                                               time_limit, hierarchy=get_hierarchy(network.fingerprint),
+                                               stats=tour_stats)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success(f"📍 Tour: {' → '.join(order)}")
+                st.info(f"⏱ Estimated travel time: {total:g} hours")
+                st.caption(f"Nearest-neighbor order: {tour_stats['initial_hours']:g} hours, "
+                           f"improved to {tour_stats['hours']:g} hours "
+                           f"(matrix {tour_stats['matrix_ms']:.0f} ms, "
+                           f"ordering {tour_stats['solve_ms']:.0f} ms)")
+
+                path = [order[0]] + [city for leg, _ in legs for city in leg[1:]]
+                base_layer = base_map_layer(network.version, graph, coordinates)
+                m = build_route_map(base_layer, coordinates, path, order[0], order[-1])
+                for number, stop in enumerate(order[1:len(stops) + 1], start=1):
+                    folium.Marker(
+                        coordinates[stop],
+                        popup=stop,
+                        icon=folium.Icon(color='green', icon='info-sign'),
+                        tooltip=f"Stop {number}: {stop}"
+                    ).add_to(m)
+                st_folium(m, width=1200, height=600, returned_objects=[])
+
+                st.markdown("### 📊 Tour Legs")
+                st.table(pd.DataFrame([{
+                    'Leg': number,
+                    'From': leg[0],
+                    'To': leg[-1],
+                    'Via': ' → '.join(leg[1:-1]),
+                    'Time (hours)': hours,
+                } for number, (leg, hours) in enumerate(legs, start=1)]))
+
+    with tabs[2]:
+        st.markdown("<h1 class='title'>⏱ Reachability</h1>", unsafe_allow_html=True)
+        with st.expander("❗ How to use:"):
+            st.markdown("""
+            1. Select one or more starting cities (e.g. depots)
+            2. Choose the travel time budget
+            3. Click 'Show Reachable Cities' to see every city within the budget, and with
+               several starting cities, which one is nearest
+            """)
+
+        network = get_network()
+        graph, coordinates = network.graph, network.coordinates
+        sources = st.multiselect("🏠 Starting cities:", list(graph.keys()),
+                                 default=["Nagpur"] if "Nagpur" in graph else None)
+        budget = st.slider("⏱ Travel time budget (hours):", 1, 72, 10)
+
+        if st.button("📡 Show Reachable Cities", disabled=not sources):
+            reach_stats = {}
+            reached = reachable(network.compact, sources, budget, stats=reach_stats)
+            st.info(f"🏙 {len(reached) - len(sources)} cities reachable within {budget} hours "
+                    f"({reach_stats['search_ms']:.1f} ms)")
+
+            base_layer = base_map_layer(network.version, graph, coordinates)
+            m = build_reachability_map(base_layer, coordinates, reached, sources, budget)
+            st_folium(m, width=1200, height=600, returned_objects=[])
+
+            rows = []
+            for city, (hours, source, _) in reached.items():
+                if city in sources:
+                    continue
+                row = {'City': city, 'Time (hours)': hours}
+                if len(sources) > 1:
+                    row['Nearest start'] = source
+                rows.append(row)
+            if rows:
+                st.table(pd.DataFrame(rows))
+
+    with tabs[3]:
         st.markdown('<h1 class="main-header">Dijkstra\'s Algorithm Visualization</h1>', 
                     unsafe_allow_html=True)
 
@@ -403,6 +703,7 @@ def main():
                 new_node = f"Node {len(st.session_state.graph.nodes) + 1}"
                 st.session_state.graph.add_node(new_node)
                 st.session_state.positions[new_node] = (x_coord, y_coord)
+                bump_graph_version()
                 st.success(f"✅ {new_node} added at ({x_coord}, {y_coord})")
 
             # Edge creation section
@@ -420,6 +721,7 @@ def main():
                 
                 if st.button("🔗 Add Edge"):
                     st.session_state.graph.add_edge(node1, node2, weight=edge_cost)
+                    bump_graph_version()
                     st.success(f"✅ Edge added: {node1} ↔ {node2} (cost: {edge_cost})")
             else:
                 st.info("ℹ️ Add at least two nodes to create edges.")
@@ -437,14 +739,22 @@ def main():
                 
                 if st.button("🎯 Find Path"):
                     try:
-                        path = nx.dijkstra_path(st.session_state.graph, start_node, end_node)
-                        total_cost = sum(st.session_state.graph[u][v]['weight'] 
-                                       for u, v in zip(path[:-1], path[1:]))
-                        st.success(f"✅ Shortest path: {' → '.join(path)}")
-                        st.success(f"💰 Total cost: {total_cost}")
-                        draw_graph(path)
-                    except nx.NetworkXNoPath:
-                        st.error("❌ No path exists between selected nodes!")
+                        route_cache = st.session_state.route_cache
+                        cached = route_cache.get(st.session_state.graph_version,
+                                                 (start_node, end_node))
+                        if cached is None:
+                            path, total_cost = dijkstra_heap(get_compact_graph(), start_node,
+                                                             end_node)
+                            route_cache.put(st.session_state.graph_version,
+                                            (start_node, end_node), (path, total_cost))
+                        else:
+                            path, total_cost = cached
+                        if path:
+                            st.success(f"✅ Shortest path: {' → '.join(path)}")
+                            st.success(f"💰 Total cost: {total_cost:g}")
+                            draw_graph(path)
+                        else:
+                            st.error("❌ No path exists between selected nodes!")
                     except Exception as e:
                         st.error(f"❌ An error occurred: {str(e)}")
 
@@ -462,6 +772,14 @@ def main():
                     <li>Edges: {}</li>
                 </ul>
             </div>
+            <div class="side-info">
+                <h4>Route Cache</h4>
+                <ul>
+                    <li>Hits: {hits}</li>
+                    <li>Misses: {misses}</li>
+                    <li>Evictions: {evictions}</li>
+                </ul>
+            </div>
             <div class="side-info">
                 <h4>Did you know?</h4>
                 <p>Dijkstra's algorithm is used in:</p>
@@ -473,7 +791,8 @@ def main():
                 </ul>
             </div>
             """.format(len(st.session_state.graph.nodes), 
-                      len(st.session_state.graph.edges)), 
+                      len(st.session_state.graph.edges),
+                      **st.session_state.route_cache.stats()), 
             unsafe_allow_html=True)
 
         # Save/Load section at the bottom
@@ -490,15 +809,15 @@ def main():
                     st.error("❌ Please enter a graph name.")
 
         with col2:
-            if st.session_state.saved_graphs:
-                selected_graph = st.selectbox("Select Saved Graph", 
-                                            list(st.session_state.saved_graphs.keys()))
+            saved_graphs = get_graph_store().names()
+            if saved_graphs:
+                selected_graph = st.selectbox("Select Saved Graph", saved_graphs)
                 if st.button("📂 Load Graph"):
                     load_graph(selected_graph)
             else:
                 st.info("ℹ️ No saved graphs available")
 
-    with tabs[2]:
+    with tabs[4]:
         st.markdown('<h2 class="main-header">About Dijkstra\'s Algorithm</h2>', 
                     unsafe_allow_html=True)
         
@@ -0,0 +1,441 @@
+# Headless routing service: a small asyncio HTTP/JSON server in front of the
+# routing engine. Searches run in a process pool so the event loop only ever
+# parses requests and writes responses.
+#
+#   python route_server.py --port 8080 --workers 4
+#
+#   GET  /health
+#   GET  /route?start=Mumbai&end=Delhi&algorithm=dijkstra
+#   POST /route   {"start": "Mumbai", "end": [28.61, 77.21], "algorithm": "astar"}
+#   POST /batch   {"pairs": [["Mumbai", "Delhi"], ...], "paths": false}
+#   POST /matrix  {"sources": ["Mumbai", ...], "targets": ["Delhi", ...]}
+#
+# With --distance-table, /matrix looks travel times up in the network's
+# all-pairs distance table (cache/apsp-<fingerprint>/), built when the server
+# starts unless the cache already holds it. The table has n x n entries, so
+# it is only meant for networks of up to a few thousand cities.
+#   GET  /reachable?sources=Nagpur&hours=10
+#   POST /reachable {"sources": ["Nagpur", "Delhi"], "hours": 10}
+#   GET  /nearest?lat=19.07&lng=72.88&k=3
+#   POST /snap    {"points": [[19.07, 72.88], ...]}
+#   POST /tour    {"stops": ["Mumbai", "Pune", ...], "round_trip": true, "time_limit": 1.0}
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import route_engine as routing
+
+ALGORITHMS = ('dijkstra', 'astar', 'bidirectional', 'ch')
+
+# Largest request body accepted, in bytes
+MAX_BODY = 64 * 1024 * 1024
+
+# Pairs (or matrix rows) handed to a worker in one task
+TASK_SIZE = 5000
+
+# Longest time a tour request may spend improving its stop order, in seconds
+MAX_TOUR_SECONDS = 10
+
+# Road network and contraction hierarchy of a worker process, loaded once per worker
+# (the hierarchy from the file build_hierarchy.py writes, on first use)
+_network = None
+_hierarchy = None
+_spatial_index = None
+_distance_table = None
+_cache_dir = routing.CACHE_DIR
+
+
+def _init_worker(data_dir, cache_dir, distance_table=False):
+    global _network, _cache_dir, _distance_table
+    _network = routing.load_network(data_dir)
+    _cache_dir = cache_dir
+    if distance_table:
+        # Memory-mapped, so the workers share one copy of the table
+        _distance_table = routing.load_or_build_distance_matrix(_network.compact, cache_dir)
+
+
+# Raised in a worker when a query needs a hierarchy that hasn't been built
+class HierarchyMissing(Exception):
+    pass
+
+
+# The network's precomputed contraction hierarchy; None when there is none,
+# unless required
+def _get_hierarchy(required=True):
+    global _hierarchy
+    if _hierarchy is None:
+        path = routing.hierarchy_path(_network.fingerprint, _cache_dir)
+        _hierarchy = routing.load_hierarchy(path, _network.fingerprint)
+        if _hierarchy is None and required:
+            raise HierarchyMissing(f"No contraction hierarchy has been built for this network; "
+                                   f"run build_hierarchy.py to write {path}")
+    return _hierarchy
+
+
+def _get_spatial_index():
+    global _spatial_index
+    if _spatial_index is None:
+        _spatial_index = routing.SpatialIndex(_network.coordinates)
+    return _spatial_index
+
+
+# Route ends may be city names or [lat, lng] points, snapped to the nearest city
+def _city(end):
+    if isinstance(end, list):
+        return _get_spatial_index().nearest(*end)[0][0]
+    return end
+
+
+# JSON has no infinity, so unreachable destinations are reported as null
+def _hours(value):
+    return None if math.isinf(value) else value
+
+
+def _route(start, end, algorithm):
+    start, end = _city(start), _city(end)
+    compact = _network.compact
+    stats = {}
+    if algorithm == 'astar':
+        path, total = routing.astar(compact, start, end, _network.coordinates,
+                                    max_speed=_network.max_speed, stats=stats)
+    elif algorithm == 'bidirectional':
+        path, total = routing.bidirectional_dijkstra(compact, start, end, stats=stats)
+    elif algorithm == 'ch':
+        path, total = _get_hierarchy().query(start, end, stats=stats)
+    else:
+        path, total = routing.dijkstra_heap(compact, start, end, stats=stats)
+    return {'start': start, 'end': end, 'path': path, 'hours': _hours(total), 'stats': stats}
+
+
+def _batch(pairs, with_paths):
+    pairs = [(_city(start), _city(end)) for start, end in pairs]
+    # batch_routes() groups pairs by start, so put its routes back in pair order
+    slots = {}
+    for i, pair in enumerate(pairs):
+        slots.setdefault(pair, []).append(i)
+    routes = [None] * len(pairs)
+    for start, end, path, total in routing.batch_routes(_network.compact, pairs, processes=1,
+                                                        with_paths=with_paths):
+        routes[slots[(start, end)].pop()] = {'start': start, 'end': end, 'path': path,
+                                             'hours': _hours(total)}
+    return routes
+
+
+def _matrix_rows(sources, targets):
+    compact = _network.compact
+    sources = [_city(source) for source in sources]
+    target_ids = [compact.index[_city(target)] for target in targets]
+    if _distance_table is not None:
+        return [[_hours(float(_distance_table.distances[compact.index[source], target]))
+                 for target in target_ids] for source in sources]
+    rows = []
+    for source in sources:
+        distances, _ = routing.dijkstra_all(compact, source, targets=target_ids)
+        rows.append([_hours(distances[target]) for target in target_ids])
+    return rows
+
+
+def _reachable(sources, budget):
+    stats = {}
+    reached = routing.reachable(_network.compact, sources, budget, stats=stats)
+    return {'sources': sources, 'hours': None if math.isinf(budget) else budget,
+            'reachable': [{'city': city, 'hours': hours, 'source': source, 'previous': previous}
+                          for city, (hours, source, previous) in reached.items()],
+            'stats': stats}
+
+
+def _tour(stops, round_trip, time_limit):
+    stats = {}
+    # Without a hierarchy the stop matrix comes from one-to-many searches
+    order, legs, total = routing.plan_tour(_network.compact, stops, round_trip, time_limit,
+                                           hierarchy=_get_hierarchy(required=False), stats=stats)
+    return {'order': order, 'hours': total,
+            'legs': [{'path': path, 'hours': hours} for path, hours in legs], 'stats': stats}
+
+
+def _nearest(lat, lng, k):
+    return {'nearest': [{'city': city, 'km': km}
+                        for city, km in _get_spatial_index().nearest(lat, lng, k)]}
+
+
+def _snap(points):
+    cities, km = _get_spatial_index().snap([lat for lat, _ in points], [lng for _, lng in points])
+    return {'cities': cities.tolist(), 'km': km.tolist()}
+
+
+def _ping():
+    return _network is not None
+
+
+# JSON numbers may be huge ints or, from some encoders, NaN or infinity
+def is_finite_number(value):
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_point(value):
+    return (isinstance(value, list) and len(value) == 2 and all(map(is_finite_number, value))
+            and -90 <= value[0] <= 90 and -180 <= value[1] <= 180)
+
+
+# Route ends in a request must be city names or [lat, lng] points
+def is_place(value):
+    return isinstance(value, str) or is_point(value)
+
+
+# Raised by request handlers to answer with an error status
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RouteService:
+    def __init__(self, data_dir=routing.DATA_DIR, cache_dir=routing.CACHE_DIR, workers=None,
+                 distance_table=False):
+        self.workers = workers or os.cpu_count() or 1
+        if distance_table:
+            # Built here once, so the workers only ever load it
+            routing.load_or_build_distance_matrix(routing.load_network(data_dir).compact, cache_dir)
+        # Workers are started on first use, so the server starts listening at once
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker,
+                                        initargs=(data_dir, cache_dir, distance_table))
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('GET', '/route'): self.route,
+            ('POST', '/route'): self.route,
+            ('POST', '/batch'): self.batch,
+            ('POST', '/matrix'): self.matrix,
+            ('GET', '/nearest'): self.nearest,
+            ('POST', '/snap'): self.snap,
+            ('GET', '/reachable'): self.reachable,
+            ('POST', '/reachable'): self.reachable,
+            ('POST', '/tour'): self.tour,
+        }
+
+    async def run_in_pool(self, function, *args):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+        except KeyError as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Unknown city: {e.args[0]}")
+        except HierarchyMissing as e:
+            raise RequestError(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+        except ValueError as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, str(e))
+
+    async def health(self, params):
+        return {'status': 'ok', 'workers': self.workers}
+
+    async def route(self, params):
+        start, end = params.get('start'), params.get('end')
+        algorithm = params.get('algorithm', 'dijkstra')
+        if not start or not end:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'start' and 'end' are required")
+        if not all(is_place(place) for place in (start, end)):
+            raise RequestError(HTTPStatus.BAD_REQUEST,
+                               "'start' and 'end' must be city names or [lat, lng] points")
+        if algorithm not in ALGORITHMS:
+            raise RequestError(HTTPStatus.BAD_REQUEST,
+                               f"'algorithm' must be one of: {', '.join(ALGORITHMS)}")
+        return await self.run_in_pool(_route, start, end, algorithm)
+
+    async def batch(self, params):
+        pairs = params.get('pairs')
+        if not isinstance(pairs, list) or not all(isinstance(p, list) and len(p) == 2
+                                                  and all(is_place(place) for place in p)
+                                                  for p in pairs):
+            raise RequestError(HTTPStatus.BAD_REQUEST,
+                               "'pairs' must be a list of [start, end] pairs of city names "
+                               "or [lat, lng] points")
+        # Keep pairs with the same start in one task so their search is shared,
+        # then return the routes in request order
+        order = sorted(range(len(pairs)), key=lambda i: str(pairs[i][0]))
+        chunks = [[pairs[i] for i in order[j:j + TASK_SIZE]] for j in range(0, len(order), TASK_SIZE)]
+        results = await asyncio.gather(*(self.run_in_pool(_batch, chunk, bool(params.get('paths', True)))
+                                         for chunk in chunks))
+        routes = [None] * len(pairs)
+        for i, route in zip(order, (route for chunk in results for route in chunk)):
+            routes[i] = route
+        return {'routes': routes}
+
+    async def matrix(self, params):
+        sources = params.get('sources')
+        targets = params.get('targets', sources)
+        if not all(isinstance(places, list) and all(is_place(place) for place in places)
+                   for places in (sources, targets)):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'sources' and 'targets' must be lists of "
+                                                       "city names or [lat, lng] points")
+        step = max(1, TASK_SIZE // max(1, len(targets)))
+        results = await asyncio.gather(*(self.run_in_pool(_matrix_rows, sources[i:i + step], targets)
+                                         for i in range(0, len(sources), step)))
+        return {'sources': sources, 'targets': targets,
+                'hours': [row for rows in results for row in rows]}
+
+    async def nearest(self, params):
+        try:
+            lat, lng = float(params['lat']), float(params['lng'])
+            k = int(params.get('k', 1))
+        except (KeyError, TypeError, ValueError):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'lat' and 'lng' (and optional 'k') must be numbers")
+        if not is_point([lat, lng]):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'lat' and 'lng' must be a point on Earth")
+        return await self.run_in_pool(_nearest, lat, lng, max(1, k))
+
+    async def snap(self, params):
+        points = params.get('points')
+        if not isinstance(points, list) or not all(is_point(point) for point in points):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'points' must be a list of [lat, lng] points")
+        # One vectorized pass per task, split like /batch
+        chunks = [points[i:i + TASK_SIZE * 20] for i in range(0, len(points), TASK_SIZE * 20)]
+        results = await asyncio.gather(*(self.run_in_pool(_snap, chunk) for chunk in chunks))
+        return {'cities': [city for result in results for city in result['cities']],
+                'km': [km for result in results for km in result['km']]}
+
+    async def reachable(self, params):
+        sources = params.get('sources')
+        # Query strings give one comma-separated value
+        if isinstance(sources, str):
+            sources = [source for source in sources.split(',') if source]
+        if (not isinstance(sources, list) or not sources
+                or not all(isinstance(source, str) for source in sources)):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'sources' must list at least one city")
+        # Without 'hours' every reachable city is returned
+        try:
+            budget = float(params['hours']) if 'hours' in params else float('infinity')
+        except (TypeError, ValueError):
+            budget = float('nan')
+        if 'hours' in params and not (math.isfinite(budget) and budget >= 0):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'hours' must be a number of hours")
+        return await self.run_in_pool(_reachable, sources, budget)
+
+    async def tour(self, params):
+        stops = params.get('stops')
+        if (not isinstance(stops, list) or len(stops) < 2
+                or not all(isinstance(stop, str) for stop in stops)):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'stops' must be a list of at least two cities")
+        try:
+            time_limit = min(float(params.get('time_limit', 1.0)), MAX_TOUR_SECONDS)
+        except (TypeError, ValueError):
+            time_limit = float('nan')
+        if not math.isfinite(time_limit):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "'time_limit' must be a number of seconds")
+        return await self.run_in_pool(_tour, stops, bool(params.get('round_trip', True)), time_limit)
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed on {url.path}")
+            raise RequestError(HTTPStatus.NOT_FOUND, f"No such endpoint: {url.path}")
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON")
+            if not isinstance(payload, dict):
+                raise RequestError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+            params.update(payload)
+        return await handler(params)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                       {'error': 'Request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, payload = HTTPStatus.OK, await self.dispatch(method, target, body)
+                except RequestError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # Responses are strict JSON: a NaN or infinity left in a payload is a bug,
+    # reported as such rather than sent as invalid JSON
+    async def respond(self, writer, status, payload, keep_alive):
+        try:
+            body = json.dumps(payload, allow_nan=False).encode()
+        except ValueError as e:
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            body = json.dumps({'error': f"Response could not be encoded: {e}"}).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        # Warm the workers up in the background so the first queries don't pay for it
+        loop = asyncio.get_running_loop()
+        for _ in range(self.workers):
+            loop.run_in_executor(self.pool, _ping)
+        print(f"Route service listening on http://{host}:{port} ({self.workers} workers)", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve shortest-path queries over HTTP/JSON")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument('--data', default=routing.DATA_DIR, help="road network directory")
+    parser.add_argument('--cache', default=routing.CACHE_DIR,
+                        help="directory of the hierarchies written by build_hierarchy.py "
+                             "and of the distance table")
+    parser.add_argument('--distance-table', action='store_true',
+                        help="answer /matrix from an all-pairs distance table, built at startup "
+                             "when the cache has none for the network")
+    args = parser.parse_args()
+
+    service = RouteService(args.data, args.cache, args.workers, args.distance_table)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+import route_engine as routing
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+
+# Directory of the built-in road network
+@pytest.fixture(scope='session')
+def data_dir():
+    return DATA_DIR
+
+
+# The built-in road network, loaded once per test module
+@pytest.fixture(scope='module')
+def network():
+    return routing.load_network(DATA_DIR)
+
+
+# A copy of the built-in road network of its own, for tests that change it
+@pytest.fixture
+def fresh_network():
+    return routing.load_network(DATA_DIR)
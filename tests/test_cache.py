@@ -0,0 +1,53 @@
+import route_engine as routing
+
+
+def test_least_recently_used_route_is_evicted():
+    cache = routing.RouteCache(maxsize=2)
+    cache.put(1, 'a', 'route a')
+    cache.put(1, 'b', 'route b')
+    assert cache.get(1, 'a') == 'route a'
+    # b is now the least recently used
+    cache.put(1, 'c', 'route c')
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.get(1, 'b') is None
+    # Storing a key again also makes it the most recently used
+    cache.put(1, 'a', 'new route a')
+    cache.put(1, 'd', 'route d')
+    assert list(cache.entries) == ['a', 'd'] and cache.get(1, 'a') == 'new route a'
+
+
+def test_counters():
+    cache = routing.RouteCache(maxsize=1)
+    assert cache.stats() == {'size': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+    cache.get(1, 'a')
+    cache.put(1, 'a', 'route a')
+    cache.get(1, 'a')
+    cache.get(1, 'a')
+    cache.put(1, 'b', 'route b')
+    cache.get(1, 'a')
+    cache.get(2, 'b')
+    assert cache.stats() == {'size': 0, 'hits': 2, 'misses': 3, 'evictions': 1, 'invalidations': 1}
+
+
+# The app keys its cache by the network's fingerprint, which changes with
+# every update to the road times
+def test_new_graph_version_drops_every_route(fresh_network):
+    network = fresh_network
+    cache = routing.RouteCache()
+    before = network.fingerprint
+    cache.put(before, ('Mumbai', 'Pune'), routing.dijkstra_heap(network.compact, 'Mumbai', 'Pune'))
+    cache.put(before, ('Delhi', 'Agra'), routing.dijkstra_heap(network.compact, 'Delhi', 'Agra'))
+    network.update_weights([('Mumbai', 'Pune', network.graph['Mumbai']['Pune'] / 2)])
+    assert network.fingerprint != before
+    assert cache.get(network.fingerprint, ('Mumbai', 'Pune')) is None
+    assert cache.stats()['size'] == 0 and cache.invalidations == 1
+    # Any change of version drops the entries, even back to an older one
+    cache.put(network.fingerprint, ('Mumbai', 'Pune'), 'new route')
+    cache.put(before, ('Delhi', 'Agra'), 'old route')
+    assert cache.get(network.fingerprint, ('Mumbai', 'Pune')) is None
+    assert cache.invalidations == 3
+    # Switching versions while empty isn't an invalidation
+    empty = routing.RouteCache()
+    empty.get(1, 'a')
+    empty.get(2, 'a')
+    assert empty.invalidations == 0
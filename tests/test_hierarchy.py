@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+import route_engine as routing
+
+
+# Random directed graph with float weights, including one-way roads and
+# cities nothing leads to
+def random_graph(nodes, edges, seed):
+    rng = random.Random(seed)
+    graph = {f"n{i}": {} for i in range(nodes)}
+    names = list(graph)
+    for _ in range(edges):
+        u, v = rng.choice(names), rng.choice(names)
+        if u != v and v != names[0]:
+            graph[u][v] = rng.uniform(0.1, 10)
+    return graph
+
+
+RANDOM_GRAPHS = [random_graph(n, e, seed) for seed, (n, e) in enumerate([(20, 50), (80, 250), (200, 700)])]
+
+
+def test_hierarchy_matches_reference_on_builtin_network(network):
+    hierarchy = routing.ContractionHierarchy.build(network.compact)
+    assert routing.verify_hierarchy(hierarchy, network.graph, samples=500) == []
+
+
+@pytest.mark.parametrize('graph', RANDOM_GRAPHS)
+def test_hierarchy_matches_reference_on_random_graphs(graph):
+    hierarchy = routing.ContractionHierarchy.build(graph)
+    assert routing.verify_hierarchy(hierarchy, graph, samples=300, seed=1) == []
+    # Unpacked routes are made of real roads and take the reported time
+    rng = random.Random(2)
+    for _ in range(100):
+        start, end = rng.choice(list(graph)), rng.choice(list(graph))
+        path, hours = hierarchy.query(start, end)
+        if path:
+            assert (path[0], path[-1]) == (start, end)
+            assert sum(graph[a][b] for a, b in zip(path[:-1], path[1:])) == pytest.approx(hours)
+
+
+@pytest.mark.parametrize('graph', RANDOM_GRAPHS[:2])
+def test_many_to_many_matches_reference(graph):
+    hierarchy = routing.ContractionHierarchy.build(graph)
+    rng = random.Random(3)
+    sources, targets = rng.sample(list(graph), 8), rng.sample(list(graph), 6)
+    matrix = hierarchy.many_to_many(sources, targets)
+    for source, row in zip(sources, matrix):
+        for target, hours in zip(targets, row):
+            assert hours == pytest.approx(routing.dijkstra(graph, source, target)[1])
+
+
+def test_hierarchy_survives_save_and_load(network, tmp_path):
+    hierarchy = routing.ContractionHierarchy.build(network.compact)
+    path = str(tmp_path / 'ch.bin')
+    hierarchy.save(path)
+    loaded = routing.ContractionHierarchy.load(path)
+    assert loaded.fingerprint == network.fingerprint
+    assert routing.verify_hierarchy(loaded, network.graph, samples=200) == []
+
+
+def test_load_hierarchy_rejects_other_graphs(network, tmp_path):
+    path = routing.hierarchy_path(network.fingerprint, str(tmp_path))
+    assert routing.load_hierarchy(path, network.fingerprint) is None
+    routing.ContractionHierarchy.build(RANDOM_GRAPHS[0]).save(path)
+    assert routing.load_hierarchy(path, network.fingerprint) is None
+    routing.ContractionHierarchy.build(network.compact).save(path)
+    assert routing.load_hierarchy(path, network.fingerprint).fingerprint == network.fingerprint
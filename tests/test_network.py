@@ -0,0 +1,44 @@
+import csv
+import os
+import shutil
+
+import pytest
+
+import route_engine as routing
+
+
+# Copy of the built-in network's tables, with the given (lat, lng) of some
+# cities replaced
+def copy_network(data_dir, directory, replaced=None):
+    for name in os.listdir(data_dir):
+        shutil.copy(os.path.join(data_dir, name), directory)
+    path = os.path.join(directory, 'cities.csv')
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    for row in rows[1:]:
+        if row[0] in (replaced or {}):
+            row[1:] = replaced[row[0]]
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return str(directory)
+
+
+def test_builtin_network_loads(network):
+    assert network.graph and set(network.coordinates) == set(network.graph)
+
+
+@pytest.mark.parametrize('lat, lng', [('', ''), ('18.52', ''), ('nan', '73.85'), ('95', '73.85')])
+def test_city_without_valid_coordinates_is_rejected(data_dir, tmp_path, lat, lng):
+    directory = copy_network(data_dir, tmp_path, {'Pune': (lat, lng)})
+    with pytest.raises(ValueError, match='City Pune has'):
+        routing.load_network(directory)
+
+
+def test_network_without_cities_is_rejected(data_dir, tmp_path):
+    directory = copy_network(data_dir, tmp_path)
+    for name, header in (('cities.csv', 'city,lat,lng'), ('roads.csv', 'source,target,hours')):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(header + '\n')
+    os.remove(os.path.join(directory, 'profiles.csv'))
+    with pytest.raises(ValueError, match='no cities'):
+        routing.load_network(directory)
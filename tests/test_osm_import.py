@@ -0,0 +1,186 @@
+import math
+import random
+import zlib
+
+import pytest
+
+import osm_import
+import route_engine as routing
+
+# Node 999999 is used by a way but lies outside the extract
+OUTSIDE = 999999
+
+
+# A 10 x 10 grid of nodes, rows as primary ways (every third one one-way) and
+# every fourth column as a secondary way, plus a footway and a road leaving
+# the extract
+def small_extract(seed=1, side=10):
+    rng = random.Random(seed)
+    nodes = {1000 + row * side + col: (48 + row * 0.01 + rng.uniform(-1e-3, 1e-3), 11 + col * 0.01)
+             for row in range(side) for col in range(side)}
+    ways = []
+    for row in range(side):
+        tags = {'highway': 'primary'}
+        if row % 3 == 0:
+            tags['oneway'] = 'yes'
+        if row == 1:
+            tags['maxspeed'] = '30 mph'
+        ways.append(([1000 + row * side + col for col in range(side)], tags))
+    for col in range(0, side, 4):
+        tags = {'highway': 'secondary', 'oneway': '-1'} if col == 4 else {'highway': 'secondary'}
+        ways.append(([1000 + row * side + col for row in range(side)], tags))
+    ways.append(([1000, 1000 + side + 1, 1000 + 2 * side + 2], {'highway': 'footway'}))
+    ways.append(([1005, OUTSIDE], {'highway': 'primary'}))
+    return nodes, ways
+
+
+def write_xml(path, nodes, ways):
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0"?>\n<osm version="0.6">\n')
+        for node, (lat, lng) in nodes.items():
+            f.write(f' <node id="{node}" lat="{lat:.7f}" lon="{lng:.7f}"/>\n')
+        for i, (refs, tags) in enumerate(ways, 1):
+            f.write(f' <way id="{i}">' + ''.join(f'<nd ref="{ref}"/>' for ref in refs)
+                    + ''.join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items()) + '</way>\n')
+        f.write('</osm>\n')
+
+
+# --- A minimal PBF encoder, the inverse of the decoder under test ---
+
+def varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, value):
+    if isinstance(value, int):
+        return varint(number << 3) + varint(value)
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def packed(values, signed=False, delta=False):
+    out, previous = b'', 0
+    for value in values:
+        stored = value - previous if delta else value
+        previous = value
+        out += varint(zigzag(stored) if signed else stored)
+    return out
+
+
+def blob(kind, data):
+    body = field(2, len(data)) + field(3, zlib.compress(data))
+    header = field(1, kind) + field(3, len(body))
+    return len(header).to_bytes(4, 'big') + header + body
+
+
+# Half the nodes go in a DenseNodes group and half as plain nodes, in a block
+# of their own ahead of the ways
+def write_pbf(path, nodes, ways):
+    strings = ['']
+    for _, tags in ways:
+        strings += [s for item in tags.items() for s in item if s not in strings]
+
+    def block(groups):
+        table = b''.join(field(1, s.encode()) for s in strings)
+        return field(1, table) + b''.join(field(2, group) for group in groups)
+
+    ids = sorted(nodes)
+    dense_ids, plain_ids = ids[:len(ids) // 2], ids[len(ids) // 2:]
+    dense = (field(1, packed(dense_ids, True, True))
+             + field(8, packed([round(nodes[i][0] * 1e7) for i in dense_ids], True, True))
+             + field(9, packed([round(nodes[i][1] * 1e7) for i in dense_ids], True, True)))
+    plain = b''.join(field(1, field(1, zigzag(i)) + field(8, zigzag(round(nodes[i][0] * 1e7)))
+                           + field(9, zigzag(round(nodes[i][1] * 1e7)))) for i in plain_ids)
+    way_group = b''.join(field(3, field(1, i) + field(2, packed([strings.index(k) for k in tags]))
+                               + field(3, packed([strings.index(v) for v in tags.values()]))
+                               + field(8, packed(refs, True, True)))
+                         for i, (refs, tags) in enumerate(ways, 1))
+    with open(path, 'wb') as f:
+        f.write(blob(b'OSMHeader', b''))
+        f.write(blob(b'OSMData', block([field(2, dense), plain])))
+        f.write(blob(b'OSMData', block([way_group])))
+
+
+@pytest.fixture(scope='module')
+def extracts(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('osm')
+    nodes, ways = small_extract()
+    write_xml(str(directory / 'small.osm'), nodes, ways)
+    write_pbf(str(directory / 'small.osm.pbf'), nodes, ways)
+    return str(directory / 'small.osm'), str(directory / 'small.osm.pbf'), nodes
+
+
+def quiet(*args):
+    pass
+
+
+def test_pbf_and_xml_import_alike(extracts):
+    xml_path, pbf_path, nodes = extracts
+    xml_graph, xml_coordinates = osm_import.import_osm(xml_path, log=quiet)
+    pbf_graph, pbf_coordinates = osm_import.import_osm(pbf_path, log=quiet)
+    assert xml_graph.keys() == pbf_graph.keys()
+    for node, neighbors in xml_graph.items():
+        assert neighbors.keys() == pbf_graph[node].keys()
+        for neighbor, hours in neighbors.items():
+            assert math.isclose(hours, pbf_graph[node][neighbor], abs_tol=1e-9)
+        assert xml_coordinates[node] == pytest.approx(nodes[node], abs=1e-7)
+        assert pbf_coordinates[node] == pytest.approx(nodes[node], abs=1e-7)
+
+
+def test_roads_leaving_the_extract_and_other_classes_are_dropped(extracts):
+    xml_path, _, _ = extracts
+    graph, _ = osm_import.import_osm(xml_path, compress=False, log=quiet)
+    assert OUTSIDE not in graph
+    # Footways are not imported, so where one crosses row 1 is no junction
+    assert 1011 not in graph
+    # Row 0 is one-way along the way, column 4 one-way against it
+    assert 1004 in graph[1000] and 1000 not in graph[1004]
+    assert 1004 in graph[1014] and 1014 not in graph[1004]
+
+
+# Merging degree-2 junctions must not change the travel time between the
+# junctions that remain
+def test_compress_chains_preserves_distances(extracts):
+    _, pbf_path, _ = extracts
+    full, _ = osm_import.import_osm(pbf_path, compress=False, log=quiet)
+    graph = {node: dict(neighbors) for node, neighbors in full.items()}
+    assert osm_import.compress_chains(graph) > 0
+    assert len(graph) < len(full)
+    for start in graph:
+        compressed = routing.reachable(graph, [start])
+        uncompressed = routing.reachable(full, [start])
+        for node in graph:
+            if node in uncompressed:
+                assert math.isclose(compressed[node][0], uncompressed[node][0], rel_tol=1e-9)
+            else:
+                assert node not in compressed
+
+
+def test_compress_chains_keeps_one_way_junctions():
+    graph = {'a': {'b': 1.0}, 'b': {'c': 2.0}, 'c': {'d': 3.0, 'b': 1.0}, 'd': {}}
+    osm_import.compress_chains(graph)
+    # b is passed straight through from a to c, but c -> b has nowhere to go on
+    assert graph == {'a': {'b': 1.0}, 'b': {'c': 2.0}, 'c': {'d': 3.0, 'b': 1.0}, 'd': {}}
+
+    graph = {'a': {'b': 1.0}, 'b': {'a': 1.0, 'c': 2.0}, 'c': {'b': 2.0, 'd': 3.0}, 'd': {'c': 3.0}}
+    assert osm_import.compress_chains(graph) == 2
+    assert graph == {'a': {'d': 6.0}, 'd': {'a': 6.0}}
+
+
+def test_tags():
+    assert osm_import.parse_speed('50') == 50
+    assert osm_import.parse_speed('30 mph') == pytest.approx(48.28032)
+    assert osm_import.parse_speed('none') is None
+    assert osm_import.parse_speed('0') is None
+    assert osm_import.way_direction({'highway': 'motorway'}) == 1
+    assert osm_import.way_direction({'highway': 'motorway', 'oneway': 'no'}) == 0
+    assert osm_import.way_direction({'highway': 'primary', 'oneway': '-1'}) == -1
+    assert osm_import.way_direction({'highway': 'primary', 'junction': 'roundabout'}) == 1
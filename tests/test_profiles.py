@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+import route_engine as routing
+
+# Morning and evening peaks, and quieter nights
+SHAPES = {
+    'peak': [(7, 1.0), (8.5, 1.8), (10, 1.1), (17, 1.0), (18.5, 1.7), (20, 1.0)],
+    'night': [(0, 0.7), (6, 1.0), (22, 0.8)],
+}
+
+DEPARTURES = [0, 6.5, 8, 9.25, 17.75, 23.5, 31]
+
+
+# Random road network of a few cities around Nagpur, with shaped roads
+def random_profiles(nodes, edges, seed):
+    rng = random.Random(seed)
+    # Roads of at most about two hours, which every shape keeps FIFO
+    coordinates = {f"n{i}": (21 + rng.uniform(-0.4, 0.4), 79 + rng.uniform(-0.4, 0.4))
+                   for i in range(nodes)}
+    names = list(coordinates)
+    graph = {name: {} for name in names}
+    for _ in range(edges):
+        u, v = rng.sample(names, 2)
+        km = routing.haversine(coordinates[u], coordinates[v])
+        graph[u][v] = round(km / rng.uniform(60, 100) + 0.1, 3)
+    profiles = routing.TravelTimeProfiles(graph)
+    for name, points in SHAPES.items():
+        profiles.add_shape(name, points)
+    for u in graph:
+        for v in graph[u]:
+            if rng.random() < 0.7:
+                profiles.assign(u, v, rng.choice(list(SHAPES)))
+    return graph, coordinates, profiles
+
+
+# Earliest arrival over every simple path, each timed leg by leg
+def brute_force_arrival(graph, profiles, start, end, departure):
+    best = float('infinity')
+    stack = [[start]]
+    while stack:
+        path = stack.pop()
+        if path[-1] == end:
+            best = min(best, departure + sum(profiles.leg_times(path, departure)))
+            continue
+        stack.extend(path + [city] for city in graph[path[-1]] if city not in path)
+    return best
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_time_dependent_route_matches_brute_force(seed):
+    graph, coordinates, profiles = random_profiles(8, 24, seed)
+    for start in graph:
+        for end in graph:
+            for departure in DEPARTURES:
+                expected = brute_force_arrival(graph, profiles, start, end, departure)
+                for places in (None, coordinates):
+                    path, hours, arrival = routing.time_dependent_route(profiles, start, end, departure,
+                                                                        places)
+                    assert arrival == pytest.approx(expected)
+                    if start != end and path:
+                        assert path[0] == start and path[-1] == end
+                        assert sum(profiles.leg_times(path, departure)) == pytest.approx(hours)
+
+
+def test_profiles_round_trip(network, tmp_path):
+    path = str(tmp_path / 'profiles.bin')
+    network.profiles.save(path)
+    loaded = routing.TravelTimeProfiles.load(path, network.compact)
+    assert loaded.shape_names == network.profiles.shape_names
+    assert loaded.edge_shapes == network.profiles.edge_shapes
+    for departure in DEPARTURES:
+        assert routing.time_dependent_route(loaded, 'Mumbai', 'Kolkata', departure) == \
+            routing.time_dependent_route(network.profiles, 'Mumbai', 'Kolkata', departure)
+
+
+# Same number of roads, but one of them takes longer
+def test_profiles_of_another_graph_are_rejected(network, tmp_path):
+    path = str(tmp_path / 'profiles.bin')
+    network.profiles.save(path)
+    graph = {city: dict(roads) for city, roads in network.graph.items()}
+    graph['Mumbai']['Pune'] += 1
+    with pytest.raises(ValueError, match='different graph'):
+        routing.TravelTimeProfiles.load(path, graph)
@@ -0,0 +1,183 @@
+import random
+
+import pytest
+
+import route_engine as routing
+
+
+# Random directed graph with float weights; some nodes have no outgoing roads,
+# so some pairs are unreachable
+def random_graph(nodes, edges, seed):
+    rng = random.Random(seed)
+    graph = {f"n{i}": {} for i in range(nodes)}
+    names = list(graph)
+    for _ in range(edges):
+        u, v = rng.choice(names), rng.choice(names)
+        if u != v and u not in names[:3]:
+            graph[u][v] = round(rng.uniform(0.1, 10), 3)
+    return graph
+
+
+def random_graphs():
+    return [random_graph(n, e, seed) for seed, (n, e) in enumerate([(10, 15), (40, 120), (150, 600)])]
+
+
+# Function to check that a path is made of real roads and takes the given time
+def check_path(graph, path, start, end, hours):
+    if start == end or hours == float('infinity'):
+        assert path == []
+        return
+    assert path[0] == start and path[-1] == end
+    assert sum(graph[a][b] for a, b in zip(path[:-1], path[1:])) == pytest.approx(hours)
+
+
+# Every start/destination pair of a small graph, or a random sample of them
+def pairs(graph, limit=400, seed=0):
+    everything = [(start, end) for start in graph for end in graph]
+    if len(everything) <= limit:
+        return everything
+    return random.Random(seed).sample(everything, limit)
+
+
+def test_dijkstra_heap_matches_reference_on_builtin_network(network):
+    graph = network.graph
+    for start, end in pairs(graph, limit=len(graph) ** 2):
+        _, expected = routing.dijkstra(graph, start, end)
+        for search_graph in (graph, network.compact):
+            path, hours = routing.dijkstra_heap(search_graph, start, end)
+            assert hours == pytest.approx(expected)
+            check_path(graph, path, start, end, hours)
+
+
+@pytest.mark.parametrize('graph', random_graphs())
+def test_dijkstra_heap_matches_reference_on_random_graphs(graph):
+    compact = routing.compile_graph(graph)
+    for start, end in pairs(graph):
+        _, expected = routing.dijkstra(graph, start, end)
+        for search_graph in (graph, compact):
+            path, hours = routing.dijkstra_heap(search_graph, start, end)
+            assert hours == pytest.approx(expected)
+            check_path(graph, path, start, end, hours)
+
+
+def test_unreachable_and_same_city():
+    graph = {'A': {'B': 1.5}, 'B': {}, 'C': {'A': 2}}
+    for search_graph in (graph, routing.compile_graph(graph)):
+        assert routing.dijkstra_heap(search_graph, 'B', 'A') == ([], float('infinity'))
+        assert routing.dijkstra_heap(search_graph, 'A', 'C') == ([], float('infinity'))
+        assert routing.dijkstra_heap(search_graph, 'A', 'A') == ([], 0)
+        assert routing.dijkstra_heap(search_graph, 'C', 'B') == (['C', 'A', 'B'], 3.5)
+    assert routing.dijkstra(graph, 'B', 'A') == ([], float('infinity'))
+    assert routing.dijkstra(graph, 'A', 'A') == ([], 0)
+
+
+# Random geometric graph whose roads run at 50-130 km/h, faster than
+# routing.DEFAULT_MAX_SPEED
+def fast_road_graph(nodes, seed):
+    rng = random.Random(seed)
+    coordinates = {f"c{i}": (rng.uniform(20, 25), rng.uniform(75, 80)) for i in range(nodes)}
+    names = list(coordinates)
+    graph = {name: {} for name in names}
+    for name in names:
+        closest = sorted(names, key=lambda other: routing.haversine(coordinates[name], coordinates[other]))
+        for other in closest[1:4]:
+            for a, b in ((name, other), (other, name)):
+                graph[a][b] = routing.haversine(coordinates[a], coordinates[b]) / rng.uniform(50, 130)
+    return graph, coordinates
+
+
+def test_astar_matches_dijkstra_on_fast_roads():
+    graph, coordinates = fast_road_graph(300, seed=1)
+    compact = routing.compile_graph(graph)
+    max_speed = routing.admissible_speed(compact, coordinates)
+    assert max_speed > routing.DEFAULT_MAX_SPEED
+    for start, end in pairs(graph, limit=300):
+        _, expected = routing.dijkstra_heap(compact, start, end)
+        path, hours = routing.astar(compact, start, end, coordinates, max_speed)
+        assert hours == pytest.approx(expected)
+        check_path(graph, path, start, end, hours)
+    # Without a top speed, A* works it out itself
+    start, end = list(graph)[0], list(graph)[-1]
+    assert routing.astar(compact, start, end, coordinates)[1] == pytest.approx(
+        routing.dijkstra_heap(compact, start, end)[1])
+
+
+def test_astar_on_builtin_network(network):
+    graph = network.graph
+    for start, end in pairs(graph, limit=len(graph) ** 2):
+        _, expected = routing.dijkstra_heap(network.compact, start, end)
+        path, hours = routing.astar(network.compact, start, end, network.coordinates,
+                                    network.max_speed)
+        assert hours == pytest.approx(expected)
+        check_path(graph, path, start, end, hours)
+
+
+def test_astar_without_all_coordinates_falls_back_to_dijkstra():
+    # B has no coordinates, so there is no consistent heuristic
+    graph = {'A': {'B': 1, 'C': 1}, 'B': {'D': 10}, 'C': {'D': 1}, 'D': {}}
+    coordinates = {'A': (0, 0), 'C': (0, 0.001), 'D': (0, 0.002)}
+    path, hours = routing.astar(graph, 'A', 'D', coordinates)
+    assert (path, hours) == (['A', 'C', 'D'], 2)
+
+
+def test_network_max_speed_follows_faster_roads(fresh_network):
+    network = fresh_network
+    network.update_weights([('Mumbai', 'Pune', 0.5)])
+    speed = routing.haversine(network.coordinates['Mumbai'], network.coordinates['Pune']) / 0.5
+    assert network.max_speed == pytest.approx(speed)
+    _, expected = routing.dijkstra_heap(network.compact, 'Mumbai', 'Pune')
+    assert routing.astar(network.compact, 'Mumbai', 'Pune', network.coordinates,
+                         network.max_speed)[1] == pytest.approx(expected)
+
+
+# Bidirectional search may pick a different route among equally fast ones, so
+# only the time and the validity of the route are compared
+def test_bidirectional_matches_reference(network):
+    for graph, limit in [(network.graph, len(network.graph) ** 2)] + [(g, 400) for g in random_graphs()]:
+        compact = routing.compile_graph(graph)
+        for start, end in pairs(graph, limit):
+            _, expected = routing.dijkstra(graph, start, end)
+            path, hours = routing.bidirectional_dijkstra(compact, start, end)
+            assert hours == pytest.approx(expected)
+            check_path(graph, path, start, end, hours)
+
+
+# Every route is loop-free, takes the time reported, stays within max_stretch
+# of the fastest, and shares at most max_overlap of its time with the routes
+# before it
+@pytest.mark.parametrize('max_overlap', [0.3, 0.5, 0.8])
+def test_alternative_routes_respect_their_limits(network, max_overlap):
+    graph, max_stretch = network.graph, 1.4
+    for start, end in pairs(graph, limit=300, seed=4):
+        routes = routing.alternative_routes(network.compact, start, end, k=4,
+                                            max_overlap=max_overlap, max_stretch=max_stretch)
+        _, fastest = routing.dijkstra(graph, start, end)
+        if start == end or fastest == float('infinity'):
+            assert routes == []
+            continue
+        assert routes[0][1] == pytest.approx(fastest)
+        used = set()
+        for path, hours in routes:
+            check_path(graph, path, start, end, hours)
+            assert len(set(path)) == len(path)
+            assert hours <= fastest * max_stretch + 1e-9
+            roads = set(zip(path[:-1], path[1:]))
+            if used:
+                shared = sum(graph[a][b] for a, b in roads & used)
+                assert shared <= max_overlap * hours + 1e-9
+            used |= roads
+        assert len({tuple(path) for path, _ in routes}) == len(routes)
+
+
+# Pairs are shuffled so a start's destinations are spread over many chunks
+# and each group is a one-to-many search that stops early
+@pytest.mark.parametrize('graph', random_graphs()[:2])
+def test_batch_routes_match_dijkstra(graph):
+    everything = [(start, end) for start in graph for end in graph]
+    random.Random(1).shuffle(everything)
+    results = list(routing.batch_routes(graph, everything, processes=2, chunk_size=3))
+    assert sorted((start, end) for start, end, _, _ in results) == sorted(everything)
+    for start, end, path, hours in results:
+        expected = routing.dijkstra(graph, start, end)[1]
+        assert hours == pytest.approx(expected)
+        check_path(graph, path, start, end, expected)
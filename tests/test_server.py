@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+from http import HTTPStatus
+
+import pytest
+
+import build_hierarchy
+import route_engine as routing
+import route_server
+
+
+@pytest.fixture(scope='module')
+def cache_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('cache'))
+
+
+@pytest.fixture(scope='module')
+def service(data_dir, cache_dir):
+    service = route_server.RouteService(data_dir, cache_dir, workers=2)
+    yield service
+    service.pool.shutdown()
+
+
+def call(service, path, payload):
+    return asyncio.run(service.dispatch('POST', path, json.dumps(payload).encode()))
+
+
+def test_batch_keeps_request_order(service, monkeypatch):
+    # Small tasks, so the pairs are spread over several workers
+    monkeypatch.setattr(route_server, 'TASK_SIZE', 2)
+    pairs = [['Pune', 'Delhi'], ['Agra', 'Mumbai'], ['Pune', 'Agra'], ['Delhi', 'Pune'],
+             ['Agra', 'Mumbai'], ['Pune', [28.61, 77.21]]]
+    routes = call(service, '/batch', {'pairs': pairs})['routes']
+    assert [(route['start'], route['end']) for route in routes] == [
+        ('Pune', 'Delhi'), ('Agra', 'Mumbai'), ('Pune', 'Agra'), ('Delhi', 'Pune'),
+        ('Agra', 'Mumbai'), ('Pune', 'Delhi')]
+
+
+# Each row is a one-to-many search that stops at the last target
+def test_matrix_matches_dijkstra(service, network):
+    sources, targets = ['Pune', 'Delhi', 'Kolkata'], ['Agra', 'Pune', 'Mumbai', 'Agra']
+    hours = call(service, '/matrix', {'sources': sources, 'targets': targets})['hours']
+    assert hours == [[pytest.approx(routing.dijkstra(network.graph, source, target)[1])
+                      for target in targets] for source in sources]
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/batch', {'pairs': [[['x'], 'Delhi']]}),
+    ('/batch', {'pairs': [['Pune', None]]}),
+    ('/matrix', {'sources': ['Pune'], 'targets': [{'city': 'Delhi'}]}),
+    ('/matrix', {'sources': [['x']]}),
+    ('/reachable', {'sources': [['Nagpur']]}),
+    ('/tour', {'stops': ['Pune', ['Delhi']]}),
+])
+def test_malformed_places_are_bad_requests(service, path, payload):
+    with pytest.raises(route_server.RequestError) as error:
+        call(service, path, payload)
+    assert error.value.status == HTTPStatus.BAD_REQUEST
+
+
+# The hierarchy is only ever loaded from the file build_hierarchy.py writes
+def test_ch_queries_need_the_offline_hierarchy(service, data_dir, cache_dir, monkeypatch):
+    with pytest.raises(route_server.RequestError) as error:
+        call(service, '/route', {'start': 'Pune', 'end': 'Delhi', 'algorithm': 'ch'})
+    assert error.value.status == HTTPStatus.SERVICE_UNAVAILABLE
+    # Tours fall back to plain searches
+    tour = call(service, '/tour', {'stops': ['Pune', 'Delhi', 'Agra']})
+    assert tour['order'][0] == 'Pune' and sorted(tour['order'][1:3]) == ['Agra', 'Delhi']
+
+    monkeypatch.setattr('sys.argv', ['build_hierarchy.py', '--data', data_dir, '--cache', cache_dir])
+    build_hierarchy.main()
+    network = routing.load_network(data_dir)
+    assert routing.load_hierarchy(routing.hierarchy_path(network.fingerprint, cache_dir),
+                                  network.fingerprint) is not None
+    route = call(service, '/route', {'start': 'Pune', 'end': 'Delhi', 'algorithm': 'ch'})
+    assert route['hours'] == pytest.approx(routing.dijkstra(network.graph, 'Pune', 'Delhi')[1])
+    assert call(service, '/tour', {'stops': ['Pune', 'Delhi', 'Agra']})['hours'] == \
+        pytest.approx(tour['hours'])
+
+
+@pytest.mark.parametrize('method, target, body', [
+    ('GET', '/reachable?sources=Nagpur&hours=nan', b''),
+    ('GET', '/reachable?sources=Nagpur&hours=inf', b''),
+    ('GET', '/reachable?sources=Nagpur&hours=-1', b''),
+    ('GET', '/nearest?lat=nan&lng=72.88', b''),
+    ('GET', '/nearest?lat=19.07&lng=-inf', b''),
+    ('GET', '/nearest?lat=190&lng=72.88', b''),
+    ('POST', '/route', b'{"start": "Pune", "end": [1e400, 5]}'),
+    ('POST', '/route', b'{"start": "Pune", "end": [NaN, 5]}'),
+    ('POST', '/snap', b'{"points": [[19.07, 72.88], [Infinity, 0]]}'),
+    ('POST', '/snap', b'{"points": [[1' + b'0' * 400 + b', 0]]}'),
+    ('POST', '/tour', b'{"stops": ["Pune", "Delhi"], "time_limit": NaN}'),
+])
+def test_non_finite_numbers_are_bad_requests(service, method, target, body):
+    with pytest.raises(route_server.RequestError) as error:
+        asyncio.run(service.dispatch(method, target, body))
+    assert error.value.status == HTTPStatus.BAD_REQUEST
+
+
+class Writer:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def test_responses_are_strict_json(service):
+    writer = Writer()
+    asyncio.run(service.respond(writer, HTTPStatus.OK, {'hours': float('nan')}, False))
+    head, _, body = writer.data.partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 500')
+    assert 'error' in json.loads(body)
+
+    writer = Writer()
+    reached = asyncio.run(service.dispatch('GET', '/reachable?sources=Nagpur', b''))
+    asyncio.run(service.respond(writer, HTTPStatus.OK, reached, False))
+    assert writer.data.startswith(b'HTTP/1.1 200') and reached['hours'] is None
+
+
+def test_matrix_from_the_distance_table(data_dir, tmp_path, network):
+    service = route_server.RouteService(data_dir, str(tmp_path), workers=1, distance_table=True)
+    try:
+        assert any(name.startswith('apsp-') for name in os.listdir(tmp_path))
+        sources, targets = ['Pune', 'Delhi'], ['Agra', 'Pune']
+        hours = call(service, '/matrix', {'sources': sources, 'targets': targets})['hours']
+    finally:
+        service.pool.shutdown()
+    assert hours == [[pytest.approx(routing.dijkstra(network.graph, source, target)[1])
+                      for target in targets] for source in sources]
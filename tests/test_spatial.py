@@ -0,0 +1,87 @@
+import random
+
+import numpy as np
+import pytest
+
+import route_engine as routing
+
+
+# Random cities in a lat/lng box, a few of them sharing another city's
+# coordinates exactly
+def random_cities(count, bounds, seed):
+    rng = random.Random(seed)
+    (lat0, lat1), (lng0, lng1) = bounds
+    coordinates = {f"c{i}": (rng.uniform(lat0, lat1), rng.uniform(lng0, lng1)) for i in range(count)}
+    for i in range(count // 10):
+        coordinates[f"d{i}"] = coordinates[rng.choice(list(coordinates))]
+    return coordinates
+
+
+# Query points inside the box and well outside the grid on every side
+def query_points(bounds, seed, count=40):
+    rng = random.Random(seed)
+    (lat0, lat1), (lng0, lng1) = bounds
+    inside = [(rng.uniform(lat0, lat1), rng.uniform(lng0, lng1)) for _ in range(count)]
+    outside = [(lat0 - 5, lng0 - 5), (lat1 + 3, (lng0 + lng1) / 2), ((lat0 + lat1) / 2, lng1 + 20),
+               (-lat1, lng0), (89.9, 0), (-89.9, 179.9)]
+    return inside + outside
+
+
+def brute_force(coordinates, point):
+    return sorted((routing.haversine(point, place), city) for city, place in coordinates.items())
+
+
+BOUNDS = [((8, 33), (68, 97)), ((60, 70), (10, 30)), ((19, 19.2), (72.8, 73))]
+
+
+@pytest.mark.parametrize('seed, bounds', list(enumerate(BOUNDS)))
+def test_nearest_matches_brute_force(seed, bounds):
+    coordinates = random_cities(300, bounds, seed)
+    index = routing.SpatialIndex(coordinates)
+    for point in query_points(bounds, seed):
+        expected = brute_force(coordinates, point)
+        for k in (1, 3, 25):
+            found = index.nearest(*point, k=k)
+            assert len({city for city, _ in found}) == k
+            assert [km for _, km in found] == pytest.approx([km for km, _ in expected[:k]])
+            # Ties between duplicates may come in either order
+            for city, km in found:
+                assert routing.haversine(point, coordinates[city]) == pytest.approx(km)
+
+
+@pytest.mark.parametrize('seed, bounds', list(enumerate(BOUNDS)))
+def test_within_matches_brute_force(seed, bounds):
+    coordinates = random_cities(300, bounds, seed)
+    index = routing.SpatialIndex(coordinates)
+    for point in query_points(bounds, seed, count=15):
+        expected = brute_force(coordinates, point)
+        for radius in (0, expected[0][0] + 1e-3, expected[10][0], expected[-1][0] + 1):
+            found = index.within(*point, radius)
+            kms = [km for _, km in found]
+            assert kms == sorted(kms) and all(km <= radius for km in kms)
+            # Cities right on the circle may fall either side of it
+            cities = {city for city, _ in found}
+            assert {city for km, city in expected if km < radius - 1e-6} <= cities
+            assert cities <= {city for km, city in expected if km <= radius + 1e-6}
+
+
+@pytest.mark.parametrize('seed, bounds', list(enumerate(BOUNDS)))
+def test_snap_matches_brute_force(seed, bounds):
+    coordinates = random_cities(300, bounds, seed)
+    index = routing.SpatialIndex(coordinates)
+    points = query_points(bounds, seed, count=500)
+    # Small chunks, so points are snapped in several passes
+    cities, kms = index.snap([lat for lat, _ in points], [lng for _, lng in points], chunk_size=64)
+    assert len(cities) == len(kms) == len(points)
+    for point, city, km in zip(points, cities, kms):
+        assert km == pytest.approx(brute_force(coordinates, point)[0][0])
+        assert routing.haversine(point, coordinates[city]) == pytest.approx(km)
+
+
+def test_every_duplicate_is_found():
+    coordinates = {'a': (19.07, 72.88), 'b': (19.07, 72.88), 'c': (19.07, 72.88), 'd': (18.52, 73.86)}
+    index = routing.SpatialIndex(coordinates)
+    assert {city for city, _ in index.nearest(19.07, 72.88, k=3)} == {'a', 'b', 'c'}
+    assert [city for city, _ in index.within(19.07, 72.88, 1)] == ['a', 'b', 'c']
+    cities, kms = index.snap(np.array([19.07, 18.52]), np.array([72.88, 73.86]))
+    assert cities[0] in ('a', 'b', 'c') and cities[1] == 'd' and kms.tolist() == [0, 0]
@@ -0,0 +1,64 @@
+import pytest
+
+import route_engine as routing
+
+# A → B → C is faster than A → C, so C is queued twice
+GRAPH = {'A': {'B': 1, 'C': 4}, 'B': {'C': 1}, 'C': {'D': 1}, 'D': {}, 'E': {'A': 1}}
+
+
+def test_counts_of_a_known_search():
+    for graph in (GRAPH, routing.compile_graph(GRAPH)):
+        stats = {}
+        assert routing.dijkstra_heap(graph, 'A', 'D', stats=stats) == (['A', 'B', 'C', 'D'], 3)
+        # D ends the search before its roads are relaxed
+        assert (stats['settled'], stats['relaxed'], stats['pushes']) == (4, 4, 5)
+        assert stats['search_ms'] >= 0
+
+
+def searches(network, hierarchy, start, end):
+    compact = network.compact
+    return {
+        'dijkstra': lambda stats: routing.dijkstra_heap(compact, start, end, stats=stats),
+        'dict': lambda stats: routing.dijkstra_heap(network.graph, start, end, stats=stats),
+        'astar': lambda stats: routing.astar(compact, start, end, network.coordinates,
+                                             network.max_speed, stats=stats),
+        'bidirectional': lambda stats: routing.bidirectional_dijkstra(compact, start, end, stats=stats),
+        'ch': lambda stats: hierarchy.query(start, end, stats=stats),
+        'all': lambda stats: routing.dijkstra_all(compact, start, stats=stats),
+        'reachable': lambda stats: routing.reachable(compact, start, 10, stats=stats),
+        'alternatives': lambda stats: routing.alternative_routes(compact, start, end, stats=stats),
+        'time-dependent': lambda stats: routing.time_dependent_route(
+            network.profiles, start, end, 8, network.coordinates, stats=stats),
+    }
+
+
+# Stats are filled whether or not a route is found, and asking for them
+# doesn't change the result
+@pytest.mark.parametrize('start, end', [('Mumbai', 'Kolkata'), ('Delhi', 'Delhi')])
+def test_every_search_fills_stats(network, start, end):
+    hierarchy = routing.ContractionHierarchy.build(network.compact)
+    for name, search in searches(network, hierarchy, start, end).items():
+        stats = {}
+        assert search(stats) == search(None), name
+        assert set(stats) == {'settled', 'relaxed', 'pushes', 'search_ms'}, name
+        assert stats['pushes'] >= stats['settled'] >= 0, name
+        if start != end or name in ('all', 'reachable'):
+            assert stats['settled'] > 0 and stats['relaxed'] > 0, name
+
+
+def test_unreachable_destination_fills_stats():
+    for graph in (GRAPH, routing.compile_graph(GRAPH)):
+        stats = {}
+        assert routing.dijkstra_heap(graph, 'A', 'E', stats=stats) == ([], float('infinity'))
+        assert (stats['settled'], stats['relaxed'], stats['pushes']) == (4, 4, 5)
+
+
+def test_stats_hooks_receive_emitted_stats(monkeypatch):
+    monkeypatch.setattr(routing, 'STATS_HOOKS', [])
+    received = []
+    routing.add_stats_hook(received.append)
+    routing.add_stats_hook(lambda stats: received.append(stats['settled']))
+    stats = {}
+    routing.dijkstra_heap(GRAPH, 'A', 'E', stats=stats)
+    routing.emit_stats(stats)
+    assert received == [stats, 4]
@@ -0,0 +1,98 @@
+import os
+import threading
+from array import array
+
+import route_engine as routing
+
+
+def test_write_arrays_round_trip(tmp_path):
+    path = str(tmp_path / 'sub' / 'arrays.bin')
+    routing.write_arrays(path, {'format': 'test'}, {'a': array('l', [1, 2, 3]), 'b': array('d', [0.5])})
+    header, arrays = routing.read_arrays(path)
+    assert header['format'] == 'test'
+    assert arrays == {'a': array('l', [1, 2, 3]), 'b': array('d', [0.5])}
+    assert os.listdir(tmp_path / 'sub') == ['arrays.bin']
+
+
+# Several writers of one file (e.g. server workers building the same
+# hierarchy) each use a temporary file of their own
+def test_concurrent_writers_of_one_file(tmp_path):
+    path = str(tmp_path / 'shared.bin')
+    errors = []
+
+    def write(value):
+        try:
+            for _ in range(20):
+                routing.write_arrays(path, {'writer': value}, {'values': array('l', [value]) * 50000})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(value,)) for value in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    header, arrays = routing.read_arrays(path)
+    assert set(arrays['values']) == {header['writer']}
+    assert os.listdir(tmp_path) == ['shared.bin']
+
+
+def test_graph_store_round_trip(tmp_path):
+    store = routing.GraphStore(str(tmp_path))
+    graph = {'A': {'B': 1.5}, 'B': {'C': 2}, 'C': {}}
+    store.save('my graph/1', graph, {'A': (0, 1), 'C': (2.5, 3)})
+    assert store.names() == ['my graph/1'] and 'my graph/1' in store
+    cgraph, positions, directed = store.load('my graph/1')
+    assert {node: cgraph[node] for node in cgraph} == graph
+    assert positions == {'A': (0, 1), 'C': (2.5, 3)}
+    assert directed
+    store.delete('my graph/1')
+    assert store.names() == []
+
+
+# Counts the tables built, while still building them
+def count_builds(monkeypatch):
+    built = []
+    build = routing.DistanceMatrix.build
+
+    def counted(graph):
+        built.append(graph)
+        return build(graph)
+
+    monkeypatch.setattr(routing.DistanceMatrix, 'build', counted)
+    return built
+
+
+def test_cached_distance_table_is_reused(network, tmp_path, monkeypatch):
+    built = count_builds(monkeypatch)
+    matrix = routing.load_or_build_distance_matrix(network.compact, str(tmp_path))
+    cached = routing.load_or_build_distance_matrix(network.compact, str(tmp_path))
+    assert len(built) == 1
+    assert cached.fingerprint == matrix.fingerprint == network.fingerprint
+    assert cached.query('Mumbai', 'Kolkata') == matrix.query('Mumbai', 'Kolkata')
+
+
+def test_changed_graph_rebuilds_the_distance_table(fresh_network, tmp_path, monkeypatch):
+    network = fresh_network
+    old = routing.load_or_build_distance_matrix(network.compact, str(tmp_path))
+    built = count_builds(monkeypatch)
+    network.update_weights([('Mumbai', 'Pune', network.graph['Mumbai']['Pune'] / 2)])
+    matrix = routing.load_or_build_distance_matrix(network.compact, str(tmp_path))
+    assert len(built) == 1 and matrix.fingerprint == network.fingerprint != old.fingerprint
+    assert matrix.distance('Mumbai', 'Pune') == routing.dijkstra(network.graph, 'Mumbai', 'Pune')[1]
+
+
+# Saving replaces the files, so a process that has the old table
+# memory-mapped keeps reading it
+def test_saving_leaves_mapped_tables_intact(network, tmp_path):
+    directory = str(tmp_path / 'table')
+    matrix = routing.DistanceMatrix.build(network.compact)
+    matrix.save(directory)
+    mapped = routing.DistanceMatrix.load(directory)
+    expected = mapped.distances.copy()
+    routing.DistanceMatrix(matrix.names, matrix.distances * 2, matrix.predecessors,
+                           matrix.fingerprint).save(directory)
+    assert (mapped.distances == expected).all()
+    assert (routing.DistanceMatrix.load(directory).distances == matrix.distances * 2).all()
+    assert sorted(os.listdir(directory)) == ['distances.npy', 'names.json', 'predecessors.npy']
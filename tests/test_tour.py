@@ -0,0 +1,106 @@
+import itertools
+import math
+import random
+
+import pytest
+
+import route_engine as routing
+
+
+# Cities of the built-in network that can all reach each other
+def connected_cities(network):
+    compact = network.compact
+    forward, _ = routing.dijkstra_all(compact, 'Mumbai')
+    backward, _ = routing.dijkstra_all(compact.reverse(), 'Mumbai')
+    return [city for city, i in compact.index.items()
+            if not math.isinf(forward[i]) and not math.isinf(backward[i])]
+
+
+# Random road network with a ring through every node, so any node reaches any
+# other, and roads that take different times in each direction
+def random_network(nodes, seed):
+    rng = random.Random(seed)
+    names = [f"n{i}" for i in range(nodes)]
+    graph = {name: {names[(i + 1) % nodes]: round(rng.uniform(1, 10), 3)}
+             for i, name in enumerate(names)}
+    for name in names:
+        for other in rng.sample(names, 5):
+            if other != name:
+                graph[name][other] = round(rng.uniform(1, 10), 3)
+    return graph
+
+
+def reference_matrix(graph, stops):
+    return [[routing.dijkstra(graph, a, b)[1] for b in stops] for a in stops]
+
+
+# Hours of visiting stops in the given order (positions in stops)
+def order_hours(matrix, order, round_trip):
+    order = list(order) + [0] if round_trip else list(order)
+    return sum(matrix[a][b] for a, b in zip(order, order[1:]))
+
+
+# Function to check that a tour leaves the depot, visits every stop exactly
+# once and is made of real legs that add up to its total
+def check_tour(graph, stops, round_trip, order, legs, total):
+    assert order[0] == stops[0]
+    assert sorted(order[:len(stops)]) == sorted(stops)
+    assert len(order) == len(stops) + round_trip
+    if round_trip:
+        assert order[-1] == stops[0]
+    assert len(legs) == len(order) - 1
+    for (a, b), (path, hours) in zip(zip(order, order[1:]), legs):
+        assert path[0] == a and path[-1] == b
+        assert sum(graph[u][v] for u, v in zip(path[:-1], path[1:])) == pytest.approx(hours)
+        assert hours == pytest.approx(routing.dijkstra(graph, a, b)[1])
+    assert total == pytest.approx(sum(hours for _, hours in legs))
+
+
+@pytest.mark.parametrize('round_trip', [True, False])
+@pytest.mark.parametrize('size', range(2, 8))
+def test_small_tours_match_brute_force(network, size, round_trip):
+    cities = connected_cities(network)
+    rng = random.Random(size)
+    for _ in range(5):
+        stops = rng.sample(cities, size)
+        order, legs, total = routing.plan_tour(network.compact, stops, round_trip)
+        check_tour(network.graph, stops, round_trip, order, legs, total)
+        matrix = reference_matrix(network.graph, stops)
+        best = min(order_hours(matrix, (0,) + rest, round_trip)
+                   for rest in itertools.permutations(range(1, size)))
+        assert total == pytest.approx(best)
+
+
+# Above EXACT_TOUR_STOPS the order comes from 2-opt and Or-opt moves, which
+# start from nearest neighbor and only ever shorten the tour
+@pytest.mark.parametrize('round_trip', [True, False])
+@pytest.mark.parametrize('seed', range(3))
+def test_large_tours_are_never_worse_than_nearest_neighbor(seed, round_trip):
+    graph = random_network(60, seed)
+    stops = random.Random(seed).sample(list(graph), 30)
+    order, legs, total = routing.plan_tour(graph, stops, round_trip, time_limit=0.5)
+    check_tour(graph, stops, round_trip, order, legs, total)
+    matrix = reference_matrix(graph, stops)
+    if not round_trip:
+        matrix = [[0 if j == 0 else hours for j, hours in enumerate(row)] for row in matrix]
+    greedy = order_hours(matrix, routing.nearest_neighbor_tour(matrix), round_trip)
+    assert total <= greedy + 1e-9
+
+
+# The heuristic still gives a valid tour when it is used on few stops
+def test_improved_small_tours_are_valid(network, monkeypatch):
+    monkeypatch.setattr(routing, 'EXACT_TOUR_STOPS', 1)
+    stops = random.Random(0).sample(connected_cities(network), 7)
+    for round_trip in (True, False):
+        check_tour(network.graph, stops, round_trip,
+                   *routing.plan_tour(network.compact, stops, round_trip))
+
+
+def test_tour_with_a_hierarchy(network):
+    hierarchy = routing.ContractionHierarchy.build(network.compact)
+    stops = random.Random(1).sample(connected_cities(network), 9)
+    for round_trip in (True, False):
+        order, legs, total = routing.plan_tour(network.compact, stops, round_trip,
+                                               hierarchy=hierarchy)
+        check_tour(network.graph, stops, round_trip, order, legs, total)
+        assert total == pytest.approx(routing.plan_tour(network.compact, stops, round_trip)[2])
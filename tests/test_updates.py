@@ -0,0 +1,97 @@
+import random
+
+import numpy as np
+import pytest
+
+import route_engine as routing
+
+
+# Random batches of road time changes (slower, faster, or back to the
+# original), including several changes to one road in a batch. Roads with a
+# time-of-day profile are left alone, as large changes could break FIFO.
+def update_batches(network, batches, size, seed=0):
+    rng = random.Random(seed)
+    roads = [(source, target, hours) for source, neighbors in network.graph.items()
+             for target, hours in neighbors.items() if not has_profile(network, source, target)]
+    for _ in range(batches):
+        batch = []
+        for source, target, hours in rng.sample(roads, size):
+            batch.append((source, target, round(hours * rng.choice([0.3, 0.8, 1, 1.5, 4]), 3)))
+        batch.append(batch[0][:2] + (rng.uniform(0.5, 5),))
+        yield batch
+
+
+def has_profile(network, source, target):
+    compact = network.compact
+    return network.profiles.edge_shapes[compact.edge_slot(compact.index[source], compact.index[target])] >= 0
+
+
+def test_update_weights_keeps_the_network_in_step(fresh_network):
+    network = fresh_network
+    fingerprint, version = network.fingerprint, network.version
+    changes = network.update_weights([('Mumbai', 'Pune', 5)])
+    assert network.graph['Mumbai']['Pune'] == 5
+    assert network.compact['Mumbai']['Pune'] == 5
+    assert network.compact.reverse()['Pune']['Mumbai'] == 5
+    assert network.fingerprint == routing.graph_fingerprint(routing.compile_graph(network.graph))
+    assert network.fingerprint != fingerprint and network.version != version
+    assert [change[2:] for change in changes] == [(3, 5)]
+
+
+def test_invalid_update_changes_nothing(fresh_network):
+    network = fresh_network
+    fingerprint = network.fingerprint
+    with pytest.raises(KeyError):
+        network.update_weights([('Mumbai', 'Pune', 5), ('Mumbai', 'Kolkata', 1)])
+    with pytest.raises(ValueError):
+        network.update_weights([('Mumbai', 'Pune', 5), ('Pune', 'Mumbai', -1)])
+    assert network.graph['Mumbai']['Pune'] == 3
+    assert network.compact['Mumbai']['Pune'] == 3
+    assert network.fingerprint == fingerprint
+
+
+def test_repaired_trees_match_recomputed_trees(fresh_network):
+    network = fresh_network
+    trees = [routing.ShortestPathTree(network.compact, start) for start in list(network.graph)[::4]]
+    for batch in update_batches(network, batches=15, size=6):
+        changes = network.update_weights(batch)
+        for tree in trees:
+            changed = tree.repair(changes)
+            expected, _ = routing.dijkstra_all(network.compact, tree.start)
+            assert tree.distances == pytest.approx(expected)
+            for end in network.graph:
+                path = tree.path(end)
+                if path:
+                    assert sum(network.graph[a][b] for a, b in zip(path[:-1], path[1:])) == \
+                        pytest.approx(tree.distance(end))
+            assert set(changed) <= set(network.graph)
+
+
+def test_repaired_distance_matrix_matches_rebuilt_matrix(fresh_network):
+    network = fresh_network
+    matrix = routing.DistanceMatrix.build(network.compact)
+    for batch in update_batches(network, batches=10, size=8, seed=1):
+        changes = network.update_weights(batch)
+        matrix.repair(network.compact, changes)
+        rebuilt = routing.DistanceMatrix.build(network.compact)
+        np.testing.assert_allclose(matrix.distances, rebuilt.distances)
+        assert matrix.fingerprint == network.fingerprint
+        for start, end in [('Mumbai', 'Kolkata'), ('Delhi', 'Chennai'), ('Guwahati', 'Surat')]:
+            path, hours = matrix.query(start, end)
+            assert sum(network.graph[a][b] for a, b in zip(path[:-1], path[1:])) == pytest.approx(hours)
+
+
+# metro_peak eases by 0.5 between 18:00 and 21:00, so a road over 6 hours long
+# would let a later departure arrive earlier
+def test_update_that_breaks_fifo_is_rejected(fresh_network):
+    network = fresh_network
+    profiles = network.profiles
+    with pytest.raises(ValueError):
+        network.update_weights([('Mumbai', 'Pune', 12)])
+    assert network.graph['Mumbai']['Pune'] == 3
+    assert network.compact['Mumbai']['Pune'] == 3
+
+    network.update_weights([('Mumbai', 'Pune', 6)])
+    arrivals = [departure + routing.time_dependent_route(profiles, 'Mumbai', 'Pune', departure)[1]
+                for departure in np.arange(0, 48, 0.25)]
+    assert all(later >= earlier - 1e-9 for earlier, later in zip(arrivals, arrivals[1:]))